@@ -0,0 +1,262 @@
+import sqlite3
+import bisect
+import os
+import threading
+import time
+
+# ========================================================
+# 🔔 到價 / 均線提醒 (bot 使用，不依賴 pandas)
+# 訂閱存在本地 SQLite；盤中由單一背景執行緒批次抓「所有被訂閱代號」的報價，
+# 每檔代號各有一組排序好的門檻陣列 (突破 / 跌破)，以二分搜尋直接切出觸發的那一段，
+# 每個週期的成本只跟「觸發數」有關，與總提醒數無關。
+# 提醒是「穿越」而不是「位階」：設定當下條件已成立 (例如已在月線下還設跌破月線) 的提醒先待命，
+# 等價格回到另一側 (armed) 才開始監控，不會在第一個週期就觸發用掉。
+# 觸發時以 UPDATE ... WHERE fired_at IS NULL 原子認領，多個 worker 行程也只會推播一次。
+# ========================================================
+
+CACHE_DIR = os.environ.get('DATA_CACHE_DIR', 'data_cache')
+ALERT_DB_PATH = os.environ.get('ALERT_DB_PATH', os.path.join(CACHE_DIR, 'alerts.db'))
+ALERT_MAX_PER_USER = int(os.environ.get('ALERT_MAX_PER_USER', 20))
+
+KIND_LABELS = {
+    "above": "突破", "below": "跌破",
+    "ma20_above": "站上月線", "ma20_below": "跌破月線",
+}
+PRICE_KINDS = ("above", "below")
+MA_KINDS = ("ma20_above", "ma20_below")
+
+class AlertStore:
+    """提醒的持久層；同一行程內共用一條連線 (以 lock 保護)"""
+    def __init__(self, path=ALERT_DB_PATH):
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.local_changes = 0   # 本連線的新增 / 取消次數 (PRAGMA data_version 只反映其他連線的變動)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS alerts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                code TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                threshold REAL,
+                created_at REAL NOT NULL,
+                fired_at REAL,
+                fired_price REAL,
+                armed INTEGER NOT NULL DEFAULT 0
+            )""")
+        columns = {r[1] for r in self.conn.execute("PRAGMA table_info(alerts)")}
+        if 'armed' not in columns:
+            # 舊版資料庫：既有提醒維持原本的位階判斷 (視為已開始監控)
+            self.conn.execute("ALTER TABLE alerts ADD COLUMN armed INTEGER NOT NULL DEFAULT 1")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_active ON alerts (fired_at, code)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_user ON alerts (user_id, fired_at)")
+
+    def add(self, user_id, code, kind, threshold=None, armed=False):
+        """armed=True 代表設定當下條件尚未成立，可直接監控；否則先待命到價格回到另一側"""
+        if kind not in KIND_LABELS: raise ValueError(f"未知的提醒類型: {kind}")
+        with self.lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM alerts WHERE user_id = ? AND fired_at IS NULL", (user_id,)).fetchone()[0]
+            if count >= ALERT_MAX_PER_USER:
+                raise ValueError(f"每人最多 {ALERT_MAX_PER_USER} 筆提醒，請先取消部分提醒")
+            cur = self.conn.execute(
+                "INSERT INTO alerts (user_id, code, kind, threshold, created_at, armed) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, code, kind, threshold, time.time(), int(armed)))
+            self.local_changes += 1
+            return cur.lastrowid
+
+    def list_user(self, user_id):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, code, kind, threshold FROM alerts WHERE user_id = ? AND fired_at IS NULL ORDER BY id",
+                (user_id,)).fetchall()
+        return [{"id": r[0], "code": r[1], "kind": r[2], "threshold": r[3]} for r in rows]
+
+    def cancel(self, user_id, alert_id=None):
+        """取消單筆 (alert_id) 或該使用者全部提醒，回傳取消筆數"""
+        with self.lock:
+            if alert_id is None:
+                cur = self.conn.execute("DELETE FROM alerts WHERE user_id = ? AND fired_at IS NULL", (user_id,))
+            else:
+                cur = self.conn.execute("DELETE FROM alerts WHERE user_id = ? AND id = ? AND fired_at IS NULL", (user_id, alert_id))
+            self.local_changes += 1
+            return cur.rowcount
+
+    def active(self):
+        with self.lock:
+            return self.conn.execute("SELECT id, user_id, code, kind, threshold, armed FROM alerts WHERE fired_at IS NULL").fetchall()
+
+    def arm(self, alert_ids):
+        """待命的提醒開始監控 (記憶體索引已同步更新，不計入 local_changes，不必重建)"""
+        with self.lock:
+            self.conn.executemany("UPDATE alerts SET armed = 1 WHERE id = ?", [(i,) for i in alert_ids])
+
+    def claim(self, alert_ids, price):
+        """原子認領觸發的提醒，只回傳本行程認領成功的 id (其他行程已推播過的會被略過)"""
+        claimed = []
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for alert_id in alert_ids:
+                    cur = self.conn.execute(
+                        "UPDATE alerts SET fired_at = ?, fired_price = ? WHERE id = ? AND fired_at IS NULL",
+                        (now, price, alert_id))
+                    if cur.rowcount == 1: claimed.append(alert_id)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def version(self):
+        with self.lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0], self.local_changes
+
+def condition_met(kind, threshold, price, ma20=None):
+    """現價是否已在條件的那一側 (MA 類型缺 MA20 時回傳 None)"""
+    if kind == 'above': return price >= threshold
+    if kind == 'below': return price <= threshold
+    if not ma20: return None
+    return price > ma20 if kind == 'ma20_above' else price < ma20
+
+class AlertIndex:
+    """代號 -> 排序門檻陣列 (監控中 / 待命各一組)；take 以 bisect 切出觸發區段，成本 O(log n + 觸發數)"""
+    def __init__(self, rows=()):
+        self.alerts = {}    # id -> (user_id, code, kind, threshold)
+        by_code = {}
+        for alert_id, user_id, code, kind, threshold, armed in rows:
+            self.alerts[alert_id] = (user_id, code, kind, threshold)
+            by_code.setdefault(code, []).append((alert_id, bool(armed)))
+        self.tables = {code: self._build(items) for code, items in by_code.items()}
+
+    def _build(self, items):
+        table = {}
+        for prefix, armed in (('', True), ('pending_', False)):
+            ids = [i for i, a in items if a == armed]
+            for kind in PRICE_KINDS:
+                pairs = sorted((self.alerts[i][3], i) for i in ids if self.alerts[i][2] == kind)
+                table[prefix + kind] = ([p[0] for p in pairs], [p[1] for p in pairs])
+            for kind in MA_KINDS:
+                table[prefix + kind] = [i for i in ids if self.alerts[i][2] == kind]
+        return table
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def codes(self):
+        return list(self.tables)
+
+    def needs_ma20(self, code):
+        table = self.tables.get(code)
+        return bool(table and any(table[prefix + kind] for prefix in ('', 'pending_') for kind in MA_KINDS))
+
+    def take(self, code, price, ma20=None):
+        """切出並移除觸發的提醒，回傳 (觸發 id 清單, 本週期開始監控的 id 清單)
+        突破門檻 <= 現價 必為排序陣列的前段、跌破門檻 >= 現價 必為後段，切片刪除即可，不必重建；
+        待命中的提醒則相反：條件不成立的那一段 (價格已在另一側) 移進監控陣列"""
+        table = self.tables.get(code)
+        if not table: return [], []
+        thresholds, ids = table['above']
+        k = bisect.bisect_right(thresholds, price)
+        hit = ids[:k]
+        del thresholds[:k], ids[:k]
+        thresholds, ids = table['below']
+        k = bisect.bisect_left(thresholds, price)
+        hit += ids[k:]
+        del thresholds[k:], ids[k:]
+        if ma20:
+            kind = 'ma20_above' if price > ma20 else 'ma20_below' if price < ma20 else None
+            if kind:
+                hit += table[kind]
+                table[kind] = []
+        armed = self._arm(table, price, ma20)
+        if not any(v[0] if isinstance(v, tuple) else v for v in table.values()):
+            del self.tables[code]
+        return hit, armed
+
+    def _arm(self, table, price, ma20):
+        armed = []
+        thresholds, ids = table['pending_above']
+        k = bisect.bisect_right(thresholds, price)    # 門檻高於現價 -> 尚未突破，開始監控
+        moved = list(zip(thresholds[k:], ids[k:]))
+        del thresholds[k:], ids[k:]
+        thresholds, ids = table['pending_below']
+        k = bisect.bisect_left(thresholds, price)     # 門檻低於現價 -> 尚未跌破，開始監控
+        moved_below = list(zip(thresholds[:k], ids[:k]))
+        del thresholds[:k], ids[:k]
+        for kind, pairs in (('above', moved), ('below', moved_below)):
+            thresholds, ids = table[kind]
+            for threshold, alert_id in pairs:
+                i = bisect.bisect_left(thresholds, threshold)
+                thresholds.insert(i, threshold); ids.insert(i, alert_id)
+                armed.append(alert_id)
+        if ma20:
+            kind = 'ma20_above' if price < ma20 else 'ma20_below' if price > ma20 else None
+            if kind and table['pending_' + kind]:
+                armed += table['pending_' + kind]
+                table[kind] += table['pending_' + kind]
+                table['pending_' + kind] = []
+        return armed
+
+    def pop(self, alert_id):
+        return self.alerts.pop(alert_id)
+
+def describe(kind, threshold):
+    return f"{KIND_LABELS[kind]} {threshold:g}" if kind in PRICE_KINDS else KIND_LABELS[kind]
+
+class AlertEngine:
+    """批次評估器：
+    fetch_prices(codes) -> {代號: 現價}；get_ma20(code, price) -> 盤中 MA20 或 None；
+    notify(user_id, lines) 推播 (同一使用者同一週期的觸發合併成一則)"""
+    def __init__(self, store, fetch_prices, get_ma20, notify):
+        self.store = store
+        self.fetch_prices = fetch_prices
+        self.get_ma20 = get_ma20
+        self.notify = notify
+        self.index = AlertIndex()
+        self.version = None
+
+    def refresh_index(self):
+        """資料庫有變動 (本行程或其他行程新增 / 取消 / 觸發) 才重建索引"""
+        version = self.store.version()
+        if version != self.version:
+            self.index = AlertIndex(self.store.active())
+            self.version = version
+
+    def evaluate_once(self):
+        self.refresh_index()
+        codes = self.index.codes()
+        if not codes: return 0
+        prices = self.fetch_prices(codes)
+        fired = {}   # user_id -> [訊息行]
+        total = 0
+        for code, price in prices.items():
+            if not price: continue
+            ma20 = self.get_ma20(code, price) if self.index.needs_ma20(code) else None
+            hit, armed = self.index.take(code, price, ma20)   # 其他行程已認領的也一併移出
+            if armed:
+                try:
+                    self.store.arm(armed)
+                except Exception as e:
+                    print(f"[Warn] 提醒狀態更新失敗 ({code}): {e}")
+            if not hit: continue
+            try:
+                claimed = set(self.store.claim(hit, price))
+            except Exception as e:
+                print(f"[Warn] 提醒認領失敗 ({code}): {e}")
+                self.version = None   # 下個週期重建索引，未認領的提醒不會遺失
+                continue
+            for alert_id in hit:
+                user_id, _, kind, threshold = self.index.pop(alert_id)
+                if alert_id not in claimed: continue
+                extra = f" (MA20 {ma20:.2f})" if kind in MA_KINDS else ""
+                fired.setdefault(user_id, []).append(f"🔔 {code} {describe(kind, threshold)}：現價 {price:g}{extra}")
+            total += len(claimed)
+        for user_id, lines in fired.items():
+            try:
+                self.notify(user_id, lines)
+            except Exception as e:
+                print(f"[Warn] 提醒推播失敗 ({user_id}): {e}")
+        return total   # 認領是本連線的寫入，不會改變 data_version，索引不必重建
@@ -2,10 +2,20 @@ import os, requests, random, re
 import json
 import time
 import math
+import bisect
+import threading
+import contextvars
 import concurrent.futures
 import twstock
+import trading_calendar
+import stock_listing
+import publication
+import alerts
+import profiler
+import tracing
+import compact_store
 from datetime import datetime, timedelta, time as dtime, timezone
-from flask import Flask, request, abort
+from flask import Flask, request, abort, jsonify
 from linebot import LineBotApi, WebhookHandler
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, FlexSendMessage
 
@@ -16,32 +26,80 @@ BOT_VERSION = "v17.3 (隨機推薦)"
 
 # --- 1. 全域快取與設定 ---
 AI_RESPONSE_CACHE = {}
+AI_RESPONSE_LOCK = threading.Lock()   # 事件並行處理時多個執行緒同時讀寫快取
 TWSE_CACHE = {"date": "", "data": []}
+PUBLISHED = {"hash": None, "date": None, "dates": {}, "artifacts": {}, "checked_at": 0}  # generator 發布的 bundle
+MANIFEST_CHECK_INTERVAL = int(os.environ.get('MANIFEST_CHECK_INTERVAL', 300))  # 幾秒檢查一次 manifest
+HISTORY_CACHE = {}   # 代號 -> {"data": 日K (compact_store.Bars), "expires": 到期時間}
 
-# 🔥 新增：由外部 JSON 驅動的全域詮釋資料庫
-STOCK_META = {}
-ALL_STOCK_MAP = {}   # 中文名稱轉代號 (供對話比對)
-CODE_TO_NAME = {}    # 代號轉中文名稱
+# 🔥 盤中報價快照 (背景輪詢器維護，使用者查詢直接讀記憶體)
+QUOTE_SNAPSHOT = {}  # 代號 -> {"rt": twstock 即時報價, "fetched_at": 抓取時間}
+QUOTE_LOCK = threading.Lock()
+QUOTE_POLL_INTERVAL = int(os.environ.get('QUOTE_POLL_INTERVAL', 15))  # 輪詢週期 (秒)
+QUOTE_MAX_AGE = int(os.environ.get('QUOTE_MAX_AGE', 45))              # 快照超過幾秒視為過期
+QUOTE_BATCH_SIZE = 50                                                 # MIS 單次批次查詢檔數
+HOT_TICKER_TOP_N = int(os.environ.get('HOT_TICKER_TOP_N', 30))        # 額外輪詢的熱門查詢檔數
+
+# 🔥 新增：由外部 JSON 驅動的全域詮釋資料庫 (代號 -> 精簡紀錄，另含中文名稱反查)
+STOCK_META = compact_store.StockMetaStore()
 FALLBACK_POOL = []   # 備用抽樣池 (僅限普通股票)
 
+STOCK_LIST_HASH = None          # 目前載入清單的內容指紋 (比對差異檔用)
+STOCK_LIST_REFRESH_INTERVAL = int(os.environ.get('STOCK_LIST_REFRESH_INTERVAL', 3600))  # 檢查清單更新的週期 (秒)
+STOCK_LIST_CHECKED_AT = 0
+STOCK_META_LOCK = threading.Lock()
+GITHUB_RAW_BASE = "https://raw.githubusercontent.com/RodHome/line-bot-lab/main"
+PUBLISH_RAW_BASE = f"{GITHUB_RAW_BASE}/{publication.PUBLISH_DIR}"
+
+def rebuild_fallback_pool():
+    # 建立純股票的備用池 (排除 ETF)，供推薦選股失效時抽樣
+    global FALLBACK_POOL
+    FALLBACK_POOL = STOCK_META.codes('股票')
+
+def load_stock_meta(stock_map):
+    """整份清單重建 (建好新表再替換，查詢中的請求不會看到半套清單)"""
+    global STOCK_META, STOCK_LIST_HASH
+    STOCK_META = compact_store.StockMetaStore(stock_map)
+    rebuild_fallback_pool()
+    STOCK_LIST_HASH = STOCK_META.listing_hash()
+
+def apply_stock_list_delta(delta):
+    """只套用差異 (新上市 / 下市 / 更名)，其餘紀錄不動"""
+    global STOCK_LIST_HASH
+    STOCK_META.apply_delta(delta)
+    rebuild_fallback_pool()
+    STOCK_LIST_HASH = STOCK_META.listing_hash()
+
+def refresh_stock_meta():
+    """從 GitHub 取最新差異檔；基準版本吻合就只套差異，否則 (漏了好幾版) 重抓整份清單"""
+    headers = {'Cache-Control': 'no-cache'}
+    try:
+        delta = requests.get(f"{GITHUB_RAW_BASE}/{stock_listing.DELTA_PATH}", headers=headers, timeout=5).json()
+        with STOCK_META_LOCK:
+            if delta.get('hash') == STOCK_LIST_HASH: return
+            if delta.get('base_hash') == STOCK_LIST_HASH:
+                apply_stock_list_delta(delta)
+                if STOCK_LIST_HASH == delta.get('hash'):
+                    print(f"[System] 股票清單熱更新 ({delta.get('date')})：新上市 {len(delta.get('added', {}))}、下市 {len(delta.get('removed', []))}、變動 {len(delta.get('changed', {}))}")
+                    return
+        full = requests.get(f"{GITHUB_RAW_BASE}/{stock_listing.STOCK_LIST_PATH}", headers=headers, timeout=10).json()
+        with STOCK_META_LOCK:
+            load_stock_meta(full)
+        print(f"[System] 股票清單重新載入：共 {len(full)} 檔")
+    except Exception as e:
+        print(f"[Warn] 股票清單更新失敗: {e}")
+
+def maybe_refresh_stock_meta():
+    global STOCK_LIST_CHECKED_AT
+    if STOCK_LIST_REFRESH_INTERVAL <= 0 or time.time() - STOCK_LIST_CHECKED_AT < STOCK_LIST_REFRESH_INTERVAL: return
+    STOCK_LIST_CHECKED_AT = time.time()
+    threading.Thread(target=refresh_stock_meta, name="stock-list-refresh", daemon=True).start()
+
 try:
-    if os.path.exists('stock_list.json'):
-        with open('stock_list.json', 'r', encoding='utf-8') as f:
-            STOCK_META = json.load(f)
-            
-        # 動態建立查詢字典與備用池
-        for code, info in STOCK_META.items():
-            name = info.get('name', '')
-            if name:
-                ALL_STOCK_MAP[name] = code      # "台積電" -> "2330"
-            ALL_STOCK_MAP[code] = code          # "2330" -> "2330" (防呆)
-            CODE_TO_NAME[code] = name
-            
-            # 建立純股票的備用池 (排除 ETF)，供推薦選股失效時抽樣
-            if info.get('type') == '股票':
-                FALLBACK_POOL.append(code)
+    load_stock_meta(stock_listing.load_stock_list())
 except Exception as e:
     print(f"[Warn] 載入 stock_list.json 失敗: {e}")
+STOCK_LIST_CHECKED_AT = time.time()  # 啟動時剛讀過本地檔，下一個週期再檢查
 
 token = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN')
 secret = os.environ.get('LINE_CHANNEL_SECRET')
@@ -51,6 +109,28 @@ handler = WebhookHandler(secret if secret else 'UNKNOWN')
 @app.route("/")
 def health_check(): return f"OK ({BOT_VERSION})", 200
 
+# --- 🔬 管理員：效能分析 ---
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+ADMIN_USER_IDS = {u.strip() for u in os.environ.get('ADMIN_USER_IDS', '').split(',') if u.strip()}
+
+def is_admin_request():
+    return bool(ADMIN_TOKEN) and (request.headers.get('X-Admin-Token') or request.args.get('token')) == ADMIN_TOKEN
+
+@app.route("/admin/profiler")
+def admin_profiler():
+    """所有 worker 最慢的 N 筆請求與各階段耗時 (pid 為回應這次查詢的 worker)"""
+    if not is_admin_request(): abort(404)
+    return jsonify({"enabled": profiler.refresh_enabled(), "pid": os.getpid(),
+                    "threshold": profiler.SLOW_THRESHOLD, "slowest": profiler.slowest()})
+
+@app.route("/admin/profiler/<key>.folded")
+def admin_profiler_folded(key):
+    """folded stacks，可直接丟給 flamegraph.pl 或 speedscope (key 為 slowest 的「PID-編號」)"""
+    if not is_admin_request(): abort(404)
+    folded = profiler.get_folded(key)
+    if folded is None: abort(404)
+    return folded, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
 # --- 2. 核心：全市場掃描與數據引擎 ---
 
 def get_taiwan_time_str():
@@ -60,13 +140,21 @@ def get_taiwan_time_str():
 
 # TWSE 全市場掃描 [修改] 讓 Bot 直接讀取 GitHub 算好的資料
 # --- [新增功能] 隔日沖券商讀取 ---
+DAY_TRADE_BROKERS_PATH = 'day_trade_brokers.json'
+DAY_TRADE_BROKERS = {"mtime": None, "data": None}   # 名單只在檔案修改時間變動時重讀
+DAY_TRADE_INDEX = {"hash": None, "data": {}}        # 代號 -> 隔日沖集中度 (generator 發布)
+DAY_TRADE_ALERT_PCT = float(os.environ.get('DAY_TRADE_ALERT_PCT', 10))  # 占比達此值 (%) 才在卡片上示警
+
 def get_day_trade_brokers():
-    """讀取本地 JSON 檔，若檔案不存在或讀取失敗則回傳預設名單"""
+    """讀取本地 JSON 檔 (載入一次，檔案更新時自動重讀)，若檔案不存在或讀取失敗則回傳預設名單"""
     try:
-        if os.path.exists('day_trade_brokers.json'):
-            with open('day_trade_brokers.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
+        mtime = os.path.getmtime(DAY_TRADE_BROKERS_PATH)
+        if mtime != DAY_TRADE_BROKERS['mtime']:
+            with open(DAY_TRADE_BROKERS_PATH, 'r', encoding='utf-8') as f:
+                DAY_TRADE_BROKERS.update(data=json.load(f), mtime=mtime)
+        return DAY_TRADE_BROKERS['data']
     except Exception as e:
+        if DAY_TRADE_BROKERS['data']: return DAY_TRADE_BROKERS['data']  # 檔案寫到一半時沿用舊版
         print(f"[Warn] 讀取隔日沖名單失敗: {e}")
     
     # 防呆預設值 (避免檔案遺失導致報錯)
@@ -76,10 +164,67 @@ def get_day_trade_brokers():
             "預設常見分點": ["凱基-台北", "元大-土城永寧", "富邦-建國", "群益-大安"]
         }
     }
+
+def load_day_trade_index():
+    """代號 -> 隔日沖集中度 (發布版本變動時重建)"""
+    if DAY_TRADE_INDEX['hash'] != PUBLISHED['hash'] or not DAY_TRADE_INDEX['data']:
+        rows = get_published_artifact('day_trade') or []
+        DAY_TRADE_INDEX.update(hash=PUBLISHED['hash'], data={r['code']: r for r in rows})
+    return DAY_TRADE_INDEX['data']
+
+def get_day_trade_concentration(code):
+    """隔日沖分點買進占成交量：{"pct", "net_lots", "top_branch"}；未達發布門檻回傳 None"""
+    return load_day_trade_index().get(code)
+
+def day_trade_warning(code, signal_str):
+    """卡片用的隔日沖警語：有實際占比就顯示數字，否則維持爆量訊號的通用提醒"""
+    conc = get_day_trade_concentration(code)
+    if conc and conc['pct'] >= DAY_TRADE_ALERT_PCT:
+        return f"🚨 隔日沖分點買進占 {conc['pct']}% ({conc['top_branch']})"
+    if "量增價漲" in signal_str or "RSI過熱" in signal_str:
+        return "🚨 留意隔日沖倒貨風險"
+    return ""
+
+def fetch_published_artifacts():
+    """讀取 generator 發布的 manifest；雜湊與記憶體中相同就不下載 bundle
+    回傳 {產物名稱: 資料}，manifest 不存在 (舊版 generator) 時回傳 None"""
+    global PUBLISHED
+    if time.time() - PUBLISHED['checked_at'] < MANIFEST_CHECK_INTERVAL:
+        return PUBLISHED['artifacts'] or None
+    PUBLISHED['checked_at'] = time.time()  # 失敗也算檢查過，避免每次查詢都重打
+    headers = {'Cache-Control': 'no-cache'}
+    try:
+        res = requests.get(f"{PUBLISH_RAW_BASE}/{publication.MANIFEST_NAME}", headers=headers, timeout=5)
+        if res.status_code != 200: return PUBLISHED['artifacts'] or None
+        manifest = res.json()
+        if manifest.get('hash') != PUBLISHED['hash']:
+            # 優先下載 gzip 版本 (約為原檔 1/2 ~ 1/3)
+            res = requests.get(f"{PUBLISH_RAW_BASE}/{publication.BUNDLE_NAME}.gz", headers=headers, timeout=5)
+            artifacts = publication.parse_bundle(res.content, gzipped=True)
+            dates = {name: a.get('date') for name, a in manifest.get('artifacts', {}).items() if a.get('date')}
+            PUBLISHED = {"hash": manifest['hash'], "date": manifest.get('date'), "dates": dates, "artifacts": artifacts, "checked_at": time.time()}
+            print(f"[System] 載入發布資料 {manifest.get('date')} (hash {manifest['hash']})：" + "、".join(f"{k} {len(v)} 筆" for k, v in artifacts.items()))
+    except Exception as e:
+        print(f"[Warn] 讀取發布資料失敗: {e}")
+    return PUBLISHED['artifacts'] or None
+
+def get_published_artifact(name, default=None):
+    artifacts = fetch_published_artifacts() or {}
+    return artifacts.get(name, default)
+
+def published_date(name):
+    """產物實際的資料日期 (當日產線失敗而沿用上一版時，比 bundle 日期舊)"""
+    return PUBLISHED.get('dates', {}).get(name) or PUBLISHED.get('date')
+
 def fetch_twse_candidates():
+    # 🔥 優先讀 generator 發布的精簡 bundle (manifest 沒變就直接用記憶體)
+    daily = get_published_artifact('daily')
+    if daily:
+        return daily
+
     # 🔥 這是你的 GitHub Raw 連結 (根據你提供的截圖 RodHome/line-bot-lab)
     # 如果你的檔案名稱不是 daily_recommendations.json，請修改這裡
-    GITHUB_RAW_URL = "https://raw.githubusercontent.com/RodHome/line-bot-lab/main/daily_recommendations.json"
+    GITHUB_RAW_URL = f"{GITHUB_RAW_BASE}/daily_recommendations.json"
     
     # 加入簡單的快取機制 (避免短時間重複下載)
     global TWSE_CACHE
@@ -119,6 +264,168 @@ def fetch_twse_candidates():
     fallback_list = ["2330", "2317", "2454", "2382", "2308"]
     return fallback_list
 
+# --- 🔥 盤中熱門報價輪詢器 ---
+class HeavyHitterSketch:
+    """Space-Saving 熱門代號統計：固定 capacity 個計數器，記憶體不隨查詢量成長"""
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def add(self, code):
+        with self.lock:
+            if code in self.counts:
+                self.counts[code] += 1
+            elif len(self.counts) < self.capacity:
+                self.counts[code] = 1
+            else:
+                # 擠掉目前最冷門的代號，新代號繼承其計數 (Space-Saving 的高估上界)
+                victim = min(self.counts, key=self.counts.get)
+                self.counts[code] = self.counts.pop(victim) + 1
+
+    def top(self, n):
+        with self.lock:
+            ranked = sorted(self.counts.items(), key=lambda x: x[1], reverse=True)
+        return [code for code, _ in ranked[:n]]
+
+HOT_TICKERS = HeavyHitterSketch(capacity=max(64, HOT_TICKER_TOP_N * 2))
+
+def store_snapshot_quote(code, rt):
+    with QUOTE_LOCK:
+        QUOTE_SNAPSHOT[code] = {"rt": rt, "fetched_at": time.time()}
+
+def get_snapshot_quote(code):
+    """讀取報價快照，回傳 (即時報價, 快照秒數)；過期或不存在回傳 (None, None)"""
+    with QUOTE_LOCK:
+        record = QUOTE_SNAPSHOT.get(code)
+    if not record: return None, None
+    age = time.time() - record['fetched_at']
+    if age > QUOTE_MAX_AGE: return None, None
+    return record['rt'], round(age, 1)
+
+def get_poll_target_codes():
+    """輪詢目標 = 今日推薦母池 + 使用者最常查詢的前 N 檔"""
+    codes = []
+    for item in fetch_twse_candidates():
+        code = item.get('code') if isinstance(item, dict) else str(item)
+        if code: codes.append(code)
+    codes.extend(HOT_TICKERS.top(HOT_TICKER_TOP_N))
+    return list(dict.fromkeys(codes))  # 去重但保留順序
+
+@profiler.timed("poll_quotes_once")
+@tracing.traced("poll_quotes_once")
+def poll_quotes_once(codes):
+    """以 MIS 批次查詢刷新快照，每批最多 QUOTE_BATCH_SIZE 檔"""
+    refreshed = 0
+    for i in range(0, len(codes), QUOTE_BATCH_SIZE):
+        chunk = codes[i:i + QUOTE_BATCH_SIZE]
+        try:
+            batch = twstock.realtime.get(chunk)
+            if not batch.get('success'): continue
+            for code in chunk:
+                rt = batch.get(code)
+                if rt and rt.get('success'):
+                    store_snapshot_quote(code, rt)
+                    refreshed += 1
+        except Exception as e:
+            print(f"[Warn] 報價輪詢失敗 ({chunk[0]}...): {e}")
+    return refreshed
+
+def quote_poller_loop():
+    while True:
+        started = time.time()
+        if is_trading_hours():
+            try:
+                poll_quotes_once(get_poll_target_codes())
+            except Exception as e:
+                print(f"[Warn] 報價輪詢器錯誤: {e}")
+        time.sleep(max(1, QUOTE_POLL_INTERVAL - (time.time() - started)))
+
+QUOTE_POLLER_PID = None
+
+def ensure_quote_poller():
+    """每個 worker 行程各啟動一條背景輪詢執行緒 (相容 gunicorn --preload fork)"""
+    global QUOTE_POLLER_PID
+    if os.environ.get('QUOTE_POLLER', '1') == '0' or QUOTE_POLLER_PID == os.getpid(): return
+    QUOTE_POLLER_PID = os.getpid()
+    threading.Thread(target=quote_poller_loop, name="quote-poller", daemon=True).start()
+
+# --- 🔔 到價 / 均線提醒 ---
+ALERT_POLL_INTERVAL = int(os.environ.get('ALERT_POLL_INTERVAL', QUOTE_POLL_INTERVAL))
+ALERT_STORE = None
+ALERT_EVALUATOR_PID = None
+ALERT_MA_BASE = {"hash": None, "data": {}}   # 代號 -> 近 19 日收盤合計 (由 generator 發布的 sector_members)
+ALERT_PATTERN = re.compile(r'^提醒\s*(\S+?)\s*(>|<|突破|跌破|站上|高於|低於)\s*(月線|MA20|\d+\.?\d*)$', re.IGNORECASE)
+
+def get_alert_store():
+    global ALERT_STORE
+    if ALERT_STORE is None: ALERT_STORE = alerts.AlertStore()
+    return ALERT_STORE
+
+def parse_alert_command(msg):
+    """「提醒 2330 突破 1000」「提醒 台積電 < 900」「提醒 2330 跌破月線」-> (代號, 類型, 門檻)"""
+    m = ALERT_PATTERN.match(msg.strip())
+    if not m: return None
+    code = get_stock_id(m.group(1))
+    if not code: return None
+    rising = m.group(2) in ('>', '突破', '站上', '高於')
+    if m.group(3).upper() in ('月線', 'MA20'):
+        return code, ('ma20_above' if rising else 'ma20_below'), None
+    return code, ('above' if rising else 'below'), float(m.group(3))
+
+def fetch_alert_prices(codes):
+    """所有被訂閱代號的現價：快照過期的合併成 MIS 批次查詢"""
+    missing = [c for c in codes if get_snapshot_quote(c)[0] is None]
+    if missing: poll_quotes_once(missing)
+    prices = {}
+    for code in codes:
+        rt, _ = get_snapshot_quote(code)
+        if rt is None: continue
+        try:
+            price, _ = live_quote_price(rt)
+        except (KeyError, IndexError, TypeError, ValueError):
+            continue
+        if price: prices[code] = price
+    return prices
+
+def get_alert_ma20(code, price):
+    """盤中 MA20 = (近 19 日收盤合計 + 現價) / 20；發布資料沒有的代號改用 fetch_data_light"""
+    if ALERT_MA_BASE['hash'] != PUBLISHED['hash']:
+        members = get_published_artifact('sector_members') or []
+        ALERT_MA_BASE.update(hash=PUBLISHED['hash'], data={m['code']: m['ma_base'] for m in members if m.get('ma_base')})
+    base = ALERT_MA_BASE['data'].get(code)
+    if base: return (base + price) / 20
+    data = fetch_data_light(code)
+    return data['ma20'] if data and data['ma20'] else None
+
+def push_alert(user_id, lines):
+    line_bot_api.push_message(user_id, TextSendMessage(text="\n".join(lines)))
+
+def alert_evaluator_loop():
+    engine = alerts.AlertEngine(get_alert_store(), fetch_alert_prices, get_alert_ma20, push_alert)
+    while True:
+        started = time.time()
+        if is_trading_hours():
+            try:
+                fired = engine.evaluate_once()
+                if fired: print(f"[System] 🔔 觸發 {fired} 筆提醒 (監控中 {len(engine.index)} 筆)")
+            except Exception as e:
+                print(f"[Warn] 提醒評估器錯誤: {e}")
+        time.sleep(max(1, ALERT_POLL_INTERVAL - (time.time() - started)))
+
+def ensure_alert_evaluator():
+    """與報價輪詢器相同：每個 worker 行程一條；重複觸發由資料庫原子認領擋下"""
+    global ALERT_EVALUATOR_PID
+    if os.environ.get('ALERT_EVALUATOR', '1') == '0' or ALERT_EVALUATOR_PID == os.getpid(): return
+    ALERT_EVALUATOR_PID = os.getpid()
+    threading.Thread(target=alert_evaluator_loop, name="alert-evaluator", daemon=True).start()
+
+@app.before_request
+def start_background_workers():
+    ensure_quote_poller()
+    ensure_alert_evaluator()
+    maybe_refresh_stock_meta()
+
 # 技術指標
 def calculate_rsi(prices, period=14):
     if len(prices) < period + 1: return 50
@@ -155,8 +462,8 @@ def calculate_cdp(high, low, close):
 
 def get_technical_signals(data, chips_val):
     signals = []
-    closes = data['raw_closes']; highs = data['raw_highs']; lows = data['raw_lows']
-    volumes = data['raw_volumes']
+    bars = data['bars']
+    closes = bars.closes; highs = bars.highs; lows = bars.lows; volumes = bars.volumes
     
     rsi = calculate_rsi(closes)
     k, d = calculate_kd(highs, lows, closes)
@@ -181,33 +488,98 @@ def get_technical_signals(data, chips_val):
     if close > ma5 > ma20 > ma60: signals.append("🔴三線多頭")
     elif close < ma5 < ma20 < ma60: signals.append("🟢三線空頭")
     
-    unique_signals = list(set(signals))
+    unique_signals = list(dict.fromkeys(signals))   # 保持判斷順序 (set 的順序每個行程不同，快取鍵會對不上)
     if not unique_signals: unique_signals = ["🟡趨勢盤整"]
     return unique_signals[:3]
 
 # --- 3. 智慧快取與 API (Gemini/FinMind) ---
+def is_trading_hours():
+    # 📅 交易日曆判斷：週末與國定休市日不算盤中
+    return trading_calendar.is_market_open()
+
 def get_smart_cache_ttl():
-    utc_now = datetime.now(timezone.utc)
-    tw_now = utc_now + timedelta(hours=8)
-    if dtime(9, 0) <= tw_now.time() <= dtime(13, 30): return 60 
+    # 快取鍵已含量化後的盤勢 (均線位階 / 訊號)，盤勢變了自然換鍵，盤中不必 60 秒就丟掉
+    if is_trading_hours(): return AI_CACHE_TTL_TRADING
     else: return 43200
 
 def get_cached_ai_response(key):
-    if key in AI_RESPONSE_CACHE:
-        record = AI_RESPONSE_CACHE[key]
+    with AI_RESPONSE_LOCK:
+        record = AI_RESPONSE_CACHE.get(key)
+        if record is None: return None
         if time.time() < record['expires']: return record['data']
-        else: del AI_RESPONSE_CACHE[key]
+        del AI_RESPONSE_CACHE[key]
     return None
 
 def set_cached_ai_response(key, data):
-    AI_RESPONSE_CACHE[key] = {'data': data, 'expires': time.time() + get_smart_cache_ttl()}
+    expires = time.time() + get_smart_cache_ttl()   # 在鎖外判斷 (可能需要載入交易日曆)
+    with AI_RESPONSE_LOCK:
+        if len(AI_RESPONSE_CACHE) >= AI_CACHE_MAX:
+            now = time.time()
+            for k in [k for k, v in AI_RESPONSE_CACHE.items() if v['expires'] <= now]:
+                AI_RESPONSE_CACHE.pop(k, None)
+            while len(AI_RESPONSE_CACHE) >= AI_CACHE_MAX:   # 仍然太多就丟最舊的
+                AI_RESPONSE_CACHE.pop(next(iter(AI_RESPONSE_CACHE)), None)
+        AI_RESPONSE_CACHE[key] = {'data': data, 'expires': expires}
+
+# --- 🧮 AI 快取鍵量化：同一檔、同樣盤勢 (均線位階 / 訊號 / 帳面區間) 的使用者共用同一份 AI 回覆 ---
+AI_CACHE_TTL_TRADING = int(os.environ.get('AI_CACHE_TTL_TRADING', 900))   # 盤中 AI 回覆快取秒數
+AI_CACHE_MAX = 5000
+MA_BIAS_EDGES = (-20, -10, -5, -2, 0, 2, 5, 10, 20)   # 現價相對均線 (%) 的分界
+PROFIT_EDGES = (-30, -20, -10, -5, 0, 5, 10, 20, 30, 50)   # 帳面損益 (%) 的分界
+AI_INFLIGHT = {}     # 快取鍵 -> Lock (同一個鍵同時只有一個請求呼叫 Gemini)
+AI_INFLIGHT_LOCK = threading.Lock()
+
+def band_label(value, edges):
+    """12.3, PROFIT_EDGES -> 「+10%~+20%」"""
+    i = bisect.bisect_right(edges, value)
+    if i == 0: return f"低於{edges[0]:+d}%"
+    if i == len(edges): return f"{edges[-1]:+d}%以上"
+    return f"{edges[i - 1]:+d}%~{edges[i]:+d}%"
+
+def ma_position(data, ma):
+    base = data[ma]
+    return band_label((data['close'] - base) / base * 100, MA_BIAS_EDGES) if base else "無資料"
+
+def ai_cache_key(kind, stock_id, data, signals, profit_pct=None, foreign=None):
+    """以 prompt 的輸入量化後組成快取鍵：MA5/20/60 位階、訊號集合、(成本診斷) 帳面區間、(一般診斷) 外資方向"""
+    parts = [kind, stock_id] + [ma_position(data, ma) for ma in ('ma5', 'ma20', 'ma60')]
+    parts.append("+".join(sorted(signals)))
+    if profit_pct is not None: parts.append(band_label(profit_pct, PROFIT_EDGES))
+    if foreign is not None: parts.append("買" if foreign > 0 else "賣" if foreign < 0 else "平")
+    return "|".join(parts)
+
+def cached_ai_call(key, produce):
+    """快取命中直接回傳；未命中才呼叫 produce() (回傳 None 代表失敗，不快取)。
+    同一批 webhook 事件並行處理時，同一個鍵只會打一次 Gemini，其他請求等結果"""
+    text = get_cached_ai_response(key)
+    if text: return text
+    with AI_INFLIGHT_LOCK:
+        lock = AI_INFLIGHT.setdefault(key, threading.Lock())
+    with lock:
+        text = get_cached_ai_response(key)   # 等待期間別的請求已經產生
+        if not text:
+            text = produce()
+            if text: set_cached_ai_response(key, text)
+        with AI_INFLIGHT_LOCK:
+            # 只移除自己放進去的那把鎖 (放開後可能已有新請求換上新的鎖)
+            if AI_INFLIGHT.get(key) is lock: AI_INFLIGHT.pop(key)
+    return text
 
 def clean_json_string(text):
     text = re.sub(r'```json\s*', '', text)
     text = re.sub(r'```\s*', '', text)
     return text.strip()
 
-def call_gemini_json(prompt, system_instruction=None):
+AI_OUTPUT_TOKENS = 2000            # 單檔診斷的輸出上限
+AI_TOKENS_PER_STOCK = 800          # 多檔批次 (持股 / 推薦) 每檔追加的輸出額度，避免 JSON 陣列被截斷
+AI_MAX_OUTPUT_TOKENS = 8192
+
+def batch_output_tokens(n):
+    return min(AI_MAX_OUTPUT_TOKENS, max(AI_OUTPUT_TOKENS, AI_TOKENS_PER_STOCK * n))
+
+@profiler.timed("call_gemini_json")
+@tracing.traced("call_gemini_json")
+def call_gemini_json(prompt, system_instruction=None, max_tokens=AI_OUTPUT_TOKENS):
     keys = [os.environ.get(f'GEMINI_API_KEY_{i}') for i in range(1, 7) if os.environ.get(f'GEMINI_API_KEY_{i}')]
     if not keys and os.environ.get('GEMINI_API_KEY'): keys = [os.environ.get('GEMINI_API_KEY')]
     if not keys: return None
@@ -229,7 +601,7 @@ def call_gemini_json(prompt, system_instruction=None):
                 
                 payload = {
                     "contents": contents,
-                    "generationConfig": {"maxOutputTokens": 2000, "temperature": 0.3, "responseMimeType": "application/json"}
+                    "generationConfig": {"maxOutputTokens": max_tokens, "temperature": 0.3, "responseMimeType": "application/json"}
                 }
                 response = requests.post(url, headers=headers, params=params, json=payload, timeout=30)
                 if response.status_code == 200:
@@ -239,10 +611,22 @@ def call_gemini_json(prompt, system_instruction=None):
             except: continue
     return None
 
+def get_history_cache_ttl():
+    # 盤中歷史日K不會變動，快取到收盤；盤後 FinMind 會補上當日K棒，30 分鐘刷新一次
+    tw_now = datetime.now(timezone.utc) + timedelta(hours=8)
+    if is_trading_hours():
+        close_dt = tw_now.replace(hour=13, minute=30, second=0, microsecond=0)
+        return max(60, int((close_dt - tw_now).total_seconds()))
+    return 1800
+
 # --- 🔥 優化版：數據並行擷取 (Safe Mode) ---
+@profiler.timed("fetch_data_light")
+@tracing.traced("fetch_data_light")
 def fetch_data_light(stock_id):
     # 定義內部子任務
     def get_history():
+        record = HISTORY_CACHE.get(stock_id)
+        if record and time.time() < record['expires']: return record['data']
         token = os.environ.get('FINMIND_TOKEN', '')
         url_hist = "https://api.finmindtrade.com/api/v4/data"
         try:
@@ -250,29 +634,41 @@ def fetch_data_light(stock_id):
             res = requests.get(url_hist, params={
                 "dataset": "TaiwanStockPrice", "data_id": stock_id, "start_date": start, "token": token
             }, timeout=4)
-            return res.json().get('data', [])
-        except: return []
+            bars = compact_store.Bars.from_finmind(res.json().get('data', []))
+            if bars: HISTORY_CACHE[stock_id] = {"data": bars, "expires": time.time() + get_history_cache_ttl()}
+            return bars
+        except: return None
 
     def get_realtime():
         try:
-            return twstock.realtime.get(stock_id)
+            rt = twstock.realtime.get(stock_id)
+            if rt and rt.get('success'): store_snapshot_quote(stock_id, rt)
+            return rt
         except: return None
 
-    # 並行執行
-    hist_data = []
-    stock_rt = None
-    try:
-        # max_workers=2 為 Zeabur 安全值
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-            future_hist = executor.submit(get_history)
-            future_rt = executor.submit(get_realtime)
-            
-            hist_data = future_hist.result(timeout=5)
-            stock_rt = future_rt.result(timeout=5)
-    except Exception as e:
-        print(f"[Warn] 並行擷取失敗，改為序列執行: {e}")
-        hist_data = get_history()
+    # 🔥 先讀盤中快照與日K快取，命中時完全不需對外連線
+    stock_rt, quote_age = get_snapshot_quote(stock_id)
+    hist_record = HISTORY_CACHE.get(stock_id)
+    hist_data = hist_record['data'] if hist_record and time.time() < hist_record['expires'] else None
+
+    if hist_data and stock_rt is None:
         stock_rt = get_realtime()
+    elif not hist_data and stock_rt is not None:
+        hist_data = get_history()
+    elif not hist_data:
+        # 並行執行
+        try:
+            # max_workers=2 為 Zeabur 安全值
+            with tracing.TracedExecutor(max_workers=2) as executor:
+                future_hist = executor.submit(get_history)
+                future_rt = executor.submit(get_realtime)
+                
+                hist_data = future_hist.result(timeout=5)
+                stock_rt = future_rt.result(timeout=5)
+        except Exception as e:
+            print(f"[Warn] 並行擷取失敗，改為序列執行: {e}")
+            hist_data = get_history()
+            stock_rt = get_realtime()
 
     if not hist_data: return None
 
@@ -289,7 +685,7 @@ def fetch_data_light(stock_id):
             
             if real_price and real_price != "-":
                 latest_price = float(real_price)
-                source_name = "TWSE"
+                source_name = "TWSE" if quote_age is None else "TWSE快照"
             else:
                 bid = stock_rt['realtime']['best_bid_price'][0]
                 ask = stock_rt['realtime']['best_ask_price'][0]
@@ -299,23 +695,11 @@ def fetch_data_light(stock_id):
     except: pass
 
     if latest_price == 0:
-        latest_price = hist_data[-1]['close']
+        latest_price = hist_data.closes[-1]
 
-    closes = [d['close'] for d in hist_data]
-    highs = [d['max'] for d in hist_data]
-    lows = [d['min'] for d in hist_data]
-    volumes = [d['Trading_Volume'] for d in hist_data]
-
-    today_str = datetime.now().strftime('%Y-%m-%d')
-    hist_last_date = hist_data[-1]['date']
-
-    if hist_last_date != today_str:
-        closes.append(latest_price)
-        highs.append(latest_price)
-        lows.append(latest_price)
-        volumes.append(0)
-    else:
-        closes[-1] = latest_price
+    # 快取中的日K不動，另接上盤中價格 (今天還沒有日K就補一根)
+    bars = hist_data.with_live_price(latest_price, datetime.now().strftime('%Y-%m-%d'))
+    closes = bars.closes
 
     ma5 = round(sum(closes[-5:]) / 5, 2) if len(closes) >= 5 else 0
     ma20 = round(sum(closes[-20:]) / 20, 2) if len(closes) >= 20 else 0
@@ -327,8 +711,7 @@ def fetch_data_light(stock_id):
     sign = "+" if change > 0 else ""
     color = "#D32F2F" if change >= 0 else "#2E7D32"
 
-    last_day = hist_data[-1]
-    res_price, sup_price = calculate_cdp(last_day['max'], last_day['min'], last_day['close'])
+    res_price, sup_price = calculate_cdp(hist_data.highs[-1], hist_data.lows[-1], hist_data.closes[-1])
 
     return {
         "code": stock_id, 
@@ -338,10 +721,13 @@ def fetch_data_light(stock_id):
         "ma5": ma5, "ma20": ma20, "ma60": ma60,
         "change_display": f"({sign}{round(change, 2)}, {sign}{change_pct}%)", 
         "color": color,
-        "raw_closes": closes, "raw_highs": highs, "raw_lows": lows, "raw_volumes": volumes,
-        "open": hist_data[-1]['open']
+        "bars": bars,
+        "open": hist_data.opens[-1],
+        "quote_age": quote_age  # 報價快照秒數 (None 代表即時連線取得)
     }
 
+@profiler.timed("fetch_chips_accumulate")
+@tracing.traced("fetch_chips_accumulate")
 def fetch_chips_accumulate(stock_id):
     token = os.environ.get('FINMIND_TOKEN', '')
     url = "https://api.finmindtrade.com/api/v4/data"
@@ -366,6 +752,8 @@ def fetch_chips_accumulate(stock_id):
         return f"{today_f} (5日: {acc_f})", f"{today_t} (5日: {acc_t})", acc_f, acc_t
     except: return "N/A", "N/A", 0, 0
 
+@profiler.timed("fetch_dividend_yield")
+@tracing.traced("fetch_dividend_yield")
 def fetch_dividend_yield(stock_id, current_price):
     token = os.environ.get('FINMIND_TOKEN', '')
     try:
@@ -378,6 +766,8 @@ def fetch_dividend_yield(stock_id, current_price):
         else: return "N/A"
     except: return "N/A"
 
+@profiler.timed("fetch_eps")
+@tracing.traced("fetch_eps")
 def fetch_eps(stock_id):
     if stock_id.startswith("00"): return "ETF"
     token = os.environ.get('FINMIND_TOKEN', '')
@@ -395,10 +785,131 @@ def fetch_eps(stock_id):
 def get_stock_id(text):
     text = text.strip()
     clean = re.sub(r'(成本|cost).*', '', text, flags=re.IGNORECASE).strip()
-    if clean in ALL_STOCK_MAP: return ALL_STOCK_MAP[clean]
+    code = STOCK_META.resolve(clean)
+    if code: return code
     if clean.isdigit() and len(clean) >= 4: return clean
     return None
 
+# --- 📋 多檔持股批次診斷 ---
+PORTFOLIO_MAX = 10          # Flex carousel 上限 12 張，保留餘裕
+PORTFOLIO_WORKERS = 6       # 日K / 法人資料並行數
+PORTFOLIO_SPLIT = re.compile(r'[,，、;；\n]+')
+COST_PATTERN = re.compile(r'(成本|cost)[:\s]*(\d+\.?\d*)', re.IGNORECASE)
+
+def parse_portfolio(msg):
+    """「2330 成本 900, 2317 成本 150, 2454」-> ([(代號, 成本或 None), ...], 無法辨識的片段)
+    辨識出的代號少於兩檔時回傳 (None, [])，交給單檔診斷流程"""
+    parts = [p.strip() for p in PORTFOLIO_SPLIT.split(msg) if p.strip()]
+    if len(parts) < 2: return None, []
+    holdings = {}
+    unknown = []
+    for part in parts:
+        code = get_stock_id(part)
+        if not code:
+            unknown.append(part)
+            continue
+        m = COST_PATTERN.search(part)
+        holdings[code] = float(m.group(2)) if m else None   # 重複輸入以最後一筆為準
+    if len(holdings) < 2: return None, []
+    return list(holdings.items())[:PORTFOLIO_MAX], unknown
+
+def fetch_portfolio_data(codes):
+    """整份持股一次抓齊：報價走 MIS 批次查詢 (寫入快照後 fetch_data_light 直接命中)，
+    日K與法人資料共用一個執行緒池並行；回傳 {代號: (行情, 法人)}"""
+    missing = [c for c in codes if get_snapshot_quote(c)[0] is None]
+    if missing: poll_quotes_once(missing)
+    results = {}
+    with tracing.TracedExecutor(max_workers=PORTFOLIO_WORKERS) as executor:
+        jobs = {code: (executor.submit(batch_fetch, fetch_data_light, code), executor.submit(batch_fetch, fetch_chips_accumulate, code))
+                for code in codes}
+        for code, (future_data, future_chips) in jobs.items():
+            try:
+                data = future_data.result(timeout=10)
+            except Exception as e:
+                print(f"[Warn] 持股 {code} 行情擷取失敗: {e}")
+                data = None
+            try:
+                chips = future_chips.result(timeout=10)
+            except Exception:
+                chips = ("N/A", "N/A", 0, 0)
+            results[code] = (data, chips)
+    return results
+
+def diagnose_portfolio(holdings):
+    """整份持股只呼叫一次 Gemini，回傳每檔的卡片資料 (依輸入順序)"""
+    fetched = fetch_portfolio_data([code for code, _ in holdings])
+    rows = []
+    for code, cost in holdings:
+        data, (f_str, t_str, af_val, at_val) = fetched.get(code, (None, ("N/A", "N/A", 0, 0)))
+        if not data: continue
+        HOT_TICKERS.add(code)
+        rows.append({
+            "code": code, "name": STOCK_META.name(code, code),
+            "cost": cost, "data": data, "f_str": f_str, "t_str": t_str,
+            "profit_pct": round((data['close'] - cost) / cost * 100, 1) if cost else None,
+            "signal_str": " | ".join(get_technical_signals(data, af_val + at_val)),
+        })
+    if not rows: return []
+
+    sys_prompt = (
+        "你是操盤手，請逐檔診斷使用者的持股清單。"
+        "回傳 JSON 陣列：[{'code': '股票代號', 'action': '建議', 'analysis': '30字內分析', 'strategy': '操作建議'}]。"
+        "有成本的持股 action 只能是 🔴續抱 / 🟡減碼 / ⚫停損；沒有成本的 action 只能是 🔴進場 / 🟡觀望 / ⚫避開。"
+        "【規則】：請嚴格檢查數字邏輯。若給出防守價，『大於成本』才可稱為停利，『小於成本』必須稱為停損。"
+    )
+    payload = [{
+        "code": r['code'], "name": r['name'], "price": r['data']['close'], "cost": r['cost'],
+        "profit_pct": r['profit_pct'], "ma5": r['data']['ma5'], "ma20": r['data']['ma20'], "ma60": r['data']['ma60'],
+        "signal": r['signal_str'], "foreign": r['f_str'], "trust": r['t_str'],
+    } for r in rows]
+    advice = {}
+    try:
+        ai_data = json.loads(call_gemini_json(f"持股清單: {json.dumps(payload, ensure_ascii=False)}", system_instruction=sys_prompt,
+                                              max_tokens=batch_output_tokens(len(payload))))
+        items = ai_data if isinstance(ai_data, list) else ai_data.get('stocks', [])
+        advice = {str(item.get('code')): item for item in items if isinstance(item, dict)}
+    except Exception as e:
+        print(f"[Warn] 持股批次診斷解析失敗: {e}")
+    for r in rows:
+        r['advice'] = advice.get(r['code'], {})
+    return rows
+
+def build_portfolio_bubble(row):
+    data = row['data']
+    advice = row['advice']
+    if row['cost']:
+        profit_color = "#D32F2F" if row['profit_pct'] >= 0 else "#2E7D32"
+        profit_text = f"💰 帳面 {'+' if row['profit_pct'] > 0 else ''}{row['profit_pct']}% (成本 {row['cost']})"
+    else:
+        profit_color = "#666666"
+        profit_text = "💰 未提供成本"
+    warning = day_trade_warning(row['code'], row['signal_str'])
+    if warning: warning = f"\n{warning}"
+    return {
+        "type": "bubble", "size": "hecto",
+        "header": {
+            "type": "box", "layout": "vertical",
+            "contents": [
+                {"type": "text", "text": f"{row['name']} ({row['code']})", "weight": "bold", "size": "lg", "color": "#ffffff"},
+                {"type": "text", "text": f"🕒 {data['update_time']}", "size": "xxs", "color": "#eeeeee"}
+            ], "backgroundColor": data['color']
+        },
+        "body": {"type": "box", "layout": "vertical", "contents": [
+            {"type": "text", "text": str(data['close']), "weight": "bold", "size": "3xl", "color": data['color'], "align": "center"},
+            {"type": "text", "text": data['change_display'], "size": "xs", "color": data['color'], "align": "center"},
+            {"type": "text", "text": profit_text, "size": "sm", "weight": "bold", "color": profit_color, "align": "center", "margin": "md"},
+            {"type": "text", "text": f"📊 週 {data['ma5']} | 月 {data['ma20']} | 季 {data['ma60']}", "size": "xxs", "color": "#666666", "align": "center", "margin": "sm"},
+            {"type": "text", "text": f"✈️ 外資 {row['f_str']}", "size": "xxs", "color": "#666666", "align": "center"},
+            {"type": "text", "text": row['signal_str'], "size": "xxs", "color": "#1976D2", "align": "center", "wrap": True, "margin": "sm"},
+            {"type": "separator", "margin": "md"},
+            {"type": "text", "text": f"【建議】{advice.get('action', 'N/A')}", "size": "sm", "weight": "bold", "margin": "md"},
+            {"type": "text", "text": f"{advice.get('analysis', 'AI 數據解析失敗。')}\n【策略】{advice.get('strategy', 'N/A')}{warning}", "size": "xs", "color": "#333333", "wrap": True, "margin": "sm"},
+            {"type": "button", "action": {"type": "message", "label": "詳細診斷", "text": row['code']}, "style": "link", "margin": "md"}
+        ]}
+    }
+
+@profiler.timed("check_stock_worker_turbo")
+@tracing.traced("check_stock_worker_turbo")
 def check_stock_worker_turbo(item):
     # 支援新版字典結構或舊版字串
     if isinstance(item, dict):
@@ -417,8 +928,8 @@ def check_stock_worker_turbo(item):
         if data['close'] < data['ma20']: 
             return None 
 
-        name = CODE_TO_NAME.get(code, code)
-        sector = STOCK_META.get(code, {}).get('sector', '熱門股')
+        name = STOCK_META.name(code, code)
+        sector = STOCK_META.sector(code, '熱門股')
         
         # 2. 提取後台算好的強大數據
         chips_display = item_data.get('chips_display', 'N/A')
@@ -446,9 +957,37 @@ def check_stock_worker_turbo(item):
         print(f"Worker Error: {e}")
         return None
 
+SECTOR_SCAN_SIZE = 8   # 「推薦 <產業>」從評分索引取前幾名交給 worker 確認
+
+def lookup_sector_candidates(target_sector):
+    """查 generator 發布的產業倒排索引 (關鍵字 -> 依分數排序的代號)
+    先精確比對關鍵字，沒有再找包含查詢字串的關鍵字；回傳依分數排序的名單，索引不存在時回傳 None"""
+    scores = get_published_artifact('scores')
+    sector_index = get_published_artifact('sector_index')
+    if not scores or not sector_index: return None
+    if target_sector in sector_index:
+        matched = set(sector_index[target_sector])
+    else:
+        matched = set()
+        for key, codes in sector_index.items():
+            if target_sector in key:
+                matched.update(codes)
+    # scores 本身已依分數排序，照順序挑出命中的代號即可
+    return [row for row in scores if row['code'] in matched]
+
 def scan_recommendations_turbo(target_sector=None):
     candidates_pool = []
     
+    # 🔥 指定產業時直接查全市場評分索引，不再只侷限於前 15 名的母池
+    if target_sector:
+        indexed = lookup_sector_candidates(target_sector)
+        if indexed is not None:
+            candidates_pool = indexed[:SECTOR_SCAN_SIZE]
+            if not candidates_pool: return []
+            with tracing.TracedExecutor(max_workers=3) as executor:
+                results = executor.map(check_stock_worker_turbo, candidates_pool)
+            return [res for res in results if res][:5]   # 保持分數順序
+    
     # 1. 先取得今日的推薦母池 (由 generator 算好的 GitHub 嚴格名單)
     twse_list = fetch_twse_candidates()
     
@@ -464,7 +1003,7 @@ def scan_recommendations_turbo(target_sector=None):
         # 🔥 修正點：只在「嚴格過濾後的推薦母池」中，比對 STOCK_META 裡的產業標籤
         for item in pool_source:
             code = item.get('code')
-            sector = STOCK_META.get(code, {}).get('sector', '')
+            sector = STOCK_META.sector(code)
             if target_sector in sector:
                 candidates_pool.append(item)
                 
@@ -483,7 +1022,7 @@ def scan_recommendations_turbo(target_sector=None):
     valid_candidates = []
     
     # 3. 交給 worker 進行最後的現價與均線確認
-    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+    with tracing.TracedExecutor(max_workers=3) as executor:
         results = executor.map(check_stock_worker_turbo, candidates_pool)
     
     for res in results:
@@ -495,18 +1034,173 @@ def scan_recommendations_turbo(target_sector=None):
         
     return valid_candidates[:5]
 
+# --- 🏭 產業儀表板 (「產業 <名稱>」) ---
+SECTOR_LIVE_TTL = int(os.environ.get('SECTOR_LIVE_TTL', 60))   # 盤中產業彙總快取秒數
+SECTOR_LIVE_CACHE = {}   # 產業 -> {"data": 彙總列, "expires": 到期時間}
+
+def resolve_sector(query, sectors):
+    """使用者輸入 -> 產業名稱：先精確比對 (含去掉「業」字尾)，再找包含查詢字串、成交值最大的產業"""
+    group = stock_listing.sector_group(query)
+    names = [row['sector'] for row in sectors]   # generator 已依成交值排序
+    if group in names: return group
+    for name in names:
+        if group and group in name: return name
+    return None
+
+def live_quote_price(rt):
+    """twstock 即時報價 -> (現價, 累計成交張數)；尚未成交時用最佳買賣價中間價
+    暫停交易或沒有委買委賣 (MIS 缺 b / a 欄位、值為 "-") 時回傳 (None, 0)"""
+    real = rt.get('realtime') or {}
+    try:
+        price = real.get('latest_trade_price')
+        if not price or price == "-":
+            bid = (real.get('best_bid_price') or [None])[0]; ask = (real.get('best_ask_price') or [None])[0]
+            if not (bid and ask and bid != "-" and ask != "-"): return None, 0
+            price = (float(bid) + float(ask)) / 2
+        volume = real.get('accumulate_trade_volume')
+        return float(price), float(volume) if volume and volume != "-" else 0
+    except (TypeError, ValueError):
+        return None, 0
+
+def aggregate_sector_live(base, members):
+    """盤中以批次報價重算產業彙總；法人欄位沿用盤後資料。報價不足一半時回傳 None"""
+    codes = [m['code'] for m in members]
+    missing = [c for c in codes if get_snapshot_quote(c)[0] is None]
+    if missing: poll_quotes_once(missing)   # MIS 一次最多 QUOTE_BATCH_SIZE 檔
+    up = down = above = ma_count = quoted = 0
+    turnover = weighted = 0.0
+    for m in members:
+        rt, _ = get_snapshot_quote(m['code'])
+        if rt is None: continue
+        price, volume = live_quote_price(rt)
+        if not price: continue
+        quoted += 1
+        change_pct = (price - m['ref_close']) / m['ref_close'] * 100 if m['ref_close'] else 0
+        up += change_pct > 0; down += change_pct < 0
+        value = volume * 1000 * price
+        turnover += value; weighted += change_pct * value
+        if m.get('ma_base') is not None:
+            ma_count += 1
+            above += price > (m['ma_base'] + price) / 20
+    if quoted < len(members) / 2: return None
+    return {**base, "count": quoted, "up": up, "down": down, "flat": quoted - up - down,
+            "turnover": turnover, "change_pct": round(weighted / turnover, 2) if turnover else 0,
+            "above_ma20": above, "ma20_count": ma_count, "live": True}
+
+def get_sector_dashboard(query):
+    """回傳 (彙總列, 候選產業名稱)；盤後直接查表，盤中以批次報價刷新 (快取 SECTOR_LIVE_TTL 秒)"""
+    sectors = get_published_artifact('sectors')
+    if not sectors: return None, []
+    name = resolve_sector(query, sectors)
+    if name is None:
+        return None, [row['sector'] for row in sectors[:12]]
+    base = next(row for row in sectors if row['sector'] == name)
+    if not is_trading_hours(): return base, []
+
+    record = SECTOR_LIVE_CACHE.get(name)
+    if record and time.time() < record['expires']: return record['data'], []
+    members = [m for m in get_published_artifact('sector_members', []) if m['sector'] == name]
+    data = aggregate_sector_live(base, members) if members else None
+    data = data or base
+    SECTOR_LIVE_CACHE[name] = {"data": data, "expires": time.time() + SECTOR_LIVE_TTL}
+    return data, []
+
+def format_sector_dashboard(row):
+    flow = lambda lots: f"{'+' if lots > 0 else ''}{int(lots):,}張"
+    ratio = row['above_ma20'] / row['ma20_count'] * 100 if row['ma20_count'] else 0
+    source = "盤中即時" if row.get('live') else f"盤後 {published_date('sectors') or ''}".strip()
+    return (
+        f"🏭【{row['sector']}】產業儀表板 ({source})\n"
+        f"📊 漲 {row['up']} / 跌 {row['down']} / 平 {row['flat']} (共 {row['count']} 檔)\n"
+        f"💹 成交值加權漲跌：{'+' if row['change_pct'] > 0 else ''}{row['change_pct']}%\n"
+        f"💰 成交金額：{round(row['turnover'] / 100000000, 1)} 億\n"
+        f"📈 站上月線：{row['above_ma20']} / {row['ma20_count']} 檔 ({ratio:.0f}%)\n"
+        f"🏦 外資 {flow(row['foreign'])}、投信 {flow(row['trust'])} (盤後當日)\n"
+        f"🏦 近 5 日：外資 {flow(row['foreign5'])}、投信 {flow(row['trust5'])}"
+    )
+
+# --- 📨 webhook 批次：同一個 body 的多個事件 (例如群組裡好幾人同時查股) 並行處理 ---
+WEBHOOK_EVENT_WORKERS = int(os.environ.get('WEBHOOK_EVENT_WORKERS', 5))   # 同時處理的事件數
+WEBHOOK_PREFETCH_WORKERS = 6
+WEBHOOK_BATCH = contextvars.ContextVar('webhook_batch', default=None)     # (查詢函式, 代號) -> Future
+
+def batch_fetch(func, code):
+    """同一批事件已預取的代號直接取結果 (多個事件查同一檔只抓一次)，否則照常查詢"""
+    batch = WEBHOOK_BATCH.get()
+    future = batch.get((func, code)) if batch else None
+    return future.result() if future is not None else func(code)
+
+def event_stock_ids(event):
+    """預估事件會查詢的代號 (單檔診斷或多檔持股)；其他指令回傳空清單"""
+    if not (isinstance(event, MessageEvent) and isinstance(event.message, TextMessage)): return []
+    msg = event.message.text.strip()
+    holdings, _ = parse_portfolio(msg)
+    if holdings: return [code for code, _ in holdings]
+    code = get_stock_id(msg)
+    return [code] if code else []
+
+def prefetch_batch(codes, executor):
+    """所有事件代號的聯集：報價一次 MIS 批次查詢，日K與法人每檔各抓一次"""
+    if not codes: return {}
+    missing = [c for c in codes if get_snapshot_quote(c)[0] is None]
+    if missing: poll_quotes_once(missing)
+    return {(func, code): executor.submit(func, code)
+            for code in codes for func in (fetch_data_light, fetch_chips_accumulate)}
+
+def dispatch_event(event):
+    """比照 WebhookHandler.handle 的對應規則 (訊息類型 > 事件類型 > 預設) 呼叫 @handler.add 註冊的函式"""
+    func = None
+    if isinstance(event, MessageEvent):
+        func = handler._handlers.get(f"{event.__class__.__name__}_{event.message.__class__.__name__}")
+    func = func or handler._handlers.get(event.__class__.__name__) or handler._default
+    if func is None: return
+    try:
+        func(event)
+    except Exception as e:
+        print(f"[Error] 事件處理失敗 ({getattr(event, 'type', '?')}): {e}")
+
+def handle_events(events):
+    if len(events) <= 1:
+        for event in events: dispatch_event(event)
+        return
+    codes = list(dict.fromkeys(code for event in events for code in event_stock_ids(event)))
+    with tracing.TracedExecutor(max_workers=WEBHOOK_PREFETCH_WORKERS) as prefetch_pool:
+        token = WEBHOOK_BATCH.set(prefetch_batch(codes, prefetch_pool))
+        try:
+            # TracedExecutor 會把預取表 (contextvar) 一併帶進每個事件的執行緒
+            with tracing.TracedExecutor(max_workers=min(WEBHOOK_EVENT_WORKERS, len(events))) as pool:
+                for future in [pool.submit(dispatch_event, event) for event in events]:
+                    future.result()
+        finally:
+            WEBHOOK_BATCH.reset(token)
+
 # --- Line Bot Handlers ---
 @app.route("/callback", methods=['POST'])
 def callback():
     signature = request.headers.get('X-Line-Signature')
     body = request.get_data(as_text=True)
-    try: handler.handle(body, signature)
-    except: abort(400)
+    with profiler.request("callback"), tracing.trace("callback", bytes=len(body)):
+        try: events = handler.parser.parse(body, signature)
+        except: abort(400)
+        handle_events(events)
     return 'OK'
 
 @handler.add(MessageEvent, message=TextMessage)
+@tracing.per_event("handle_message")
 def handle_message(event):
     msg = event.message.text.strip()
+    profiler.annotate(msg[:20])
+
+    # 🔬 管理員指令：切換效能分析
+    if msg.startswith("管理 效能分析") and event.source.user_id in ADMIN_USER_IDS:
+        arg = msg.replace("管理 效能分析", "").strip()
+        if arg in ("開", "on"): profiler.set_enabled(True)
+        elif arg in ("關", "off"): profiler.set_enabled(False)
+        slow = profiler.slowest()[:3]
+        text = (f"🔬 效能分析：{'開啟' if profiler.ENABLED else '關閉'} (慢請求門檻 {profiler.SLOW_THRESHOLD}s)\n"
+                + "\n".join(f"#{x['key']} {x['label']} {x['elapsed']}s" for x in slow))
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=text.strip()))
+        return
 
     # 🔥 [新增功能] 選股邏輯說明
     if msg in ["選股邏輯", "推薦說明", "篩選條件"]:
@@ -532,6 +1226,61 @@ def handle_message(event):
         line_bot_api.reply_message(event.reply_token, TextSendMessage(text=logic_text))
         return
     
+    # [功能] 到價 / 均線提醒
+    if msg.startswith("提醒") or msg in ["我的提醒", "提醒列表"] or msg.startswith("取消提醒"):
+        user_id = event.source.user_id
+        store = get_alert_store()
+        if msg in ["我的提醒", "提醒列表"]:
+            rows = store.list_user(user_id)
+            text = ("🔔 您的提醒：\n" + "\n".join(
+                f"#{r['id']} {r['code']} {STOCK_META.name(r['code'], '')} {alerts.describe(r['kind'], r['threshold'])}" for r in rows
+            ) + "\n(取消：取消提醒 <編號> / 取消提醒 全部)") if rows else "目前沒有設定提醒。\n💡 例：提醒 2330 突破 1000、提醒 2330 跌破月線"
+        elif msg.startswith("取消提醒"):
+            arg = msg[4:].strip().lstrip('#')
+            if arg in ("全部", "all"):
+                text = f"🗑️ 已取消 {store.cancel(user_id)} 筆提醒。"
+            elif arg.isdigit():
+                text = "🗑️ 已取消提醒。" if store.cancel(user_id, int(arg)) else f"⚠️ 找不到提醒 #{arg}。"
+            else:
+                text = "💡 用法：取消提醒 <編號> 或 取消提醒 全部"
+        else:
+            parsed = parse_alert_command(msg)
+            if not parsed:
+                text = "💡 用法：提醒 2330 突破 1000 / 提醒 2330 < 900 / 提醒 2330 跌破月線"
+            else:
+                code, kind, threshold = parsed
+                # 提醒只在「穿越」時觸發：設定當下條件已成立就先待命，等價格回到另一側才開始監控
+                price = fetch_alert_prices([code]).get(code)
+                ma20 = get_alert_ma20(code, price) if price and kind in alerts.MA_KINDS else None
+                met = alerts.condition_met(kind, threshold, price, ma20) if price else None
+                try:
+                    alert_id = store.add(user_id, code, kind, threshold, armed=met is False)
+                    HOT_TICKERS.add(code)
+                    text = f"✅ 已設定提醒 #{alert_id}：{STOCK_META.name(code, code)}({code}) {alerts.describe(kind, threshold)}\n盤中觸發時會推播通知 (觸發一次後自動失效)。"
+                    if met:
+                        extra = f"、MA20 {ma20:.2f}" if ma20 else ""
+                        text += f"\n⚠️ 目前已經{alerts.describe(kind, threshold)} (現價 {price:g}{extra})，要等價格回到另一側後再次穿越才會通知。"
+                except ValueError as e:
+                    text = f"⚠️ {e}"
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=text))
+        return
+
+    # [功能] 產業儀表板
+    if msg.startswith("產業"):
+        query = msg[2:].strip()
+        if not query:
+            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="💡 用法：產業 半導體"))
+            return
+        row, suggestions = get_sector_dashboard(query)
+        if row:
+            text = format_sector_dashboard(row)
+        elif suggestions:
+            text = f"⚠️ 找不到「{query}」產業，可以試試：" + "、".join(suggestions)
+        else:
+            text = "⚠️ 產業資料尚未發布，請稍後再試。"
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=text))
+        return
+
     # [功能 1] 推薦選股
     if msg.startswith("推薦") or msg.startswith("選股"):
         parts = msg.split()
@@ -542,7 +1291,7 @@ def handle_message(event):
        # 🔥 優化：更精確的回報找不到標的之原因
         if not good_stocks:
             if target_sector:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"⚠️ 今日的嚴選飆股池中，暫無符合條件的「{target_sector}」相關個股。"))
+                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"⚠️ 今日全市場評分名單中，暫無站穩月線的「{target_sector}」相關個股。"))
             else:
                 line_bot_api.reply_message(event.reply_token, TextSendMessage(text="⚠️ 市場震盪，暫無符合強勢條件的標的。"))
             return
@@ -555,7 +1304,8 @@ def handle_message(event):
             "規則：必須結合『產業趨勢』或『技術突破』，語氣專業，不要只寫籌碼集中。"
             "例如：AI伺服器需求爆發，量價齊揚突破前高。"
         )
-        ai_json_str = call_gemini_json(f"清單: {json.dumps(stocks_payload, ensure_ascii=False)}", system_instruction=sys_prompt)
+        ai_json_str = call_gemini_json(f"清單: {json.dumps(stocks_payload, ensure_ascii=False)}", system_instruction=sys_prompt,
+                                       max_tokens=batch_output_tokens(len(stocks_payload)))
         
         reasons_map = {}
         try:
@@ -565,14 +1315,18 @@ def handle_message(event):
                 reasons_map[item.get('code')] = item.get('reason', '動能強勁。')
         except: pass
 
+        # 當日產線失敗而沿用上一版名單時，卡片標出實際資料日期
+        data_date = published_date('scores' if target_sector else 'daily')
+        stale_note = f" | 資料 {data_date}" if data_date and data_date != PUBLISHED.get('date') else ""
+
         bubbles = []
         for stock in good_stocks:
             default_reason = f"主力控盤，{stock['signal_str']}，多頭排列。"
             reason = reasons_map.get(stock['code'], default_reason)
 
-            # 🔥 [修改處 1] 被動防禦提醒 (推薦卡片)：若帶量突破，短評後方附加警語
-            if "量增價漲" in stock['signal_str'] or "RSI過熱" in stock['signal_str']:
-                reason += "\n🚨 留意隔日沖倒貨風險"
+            # 🔥 [修改處 1] 被動防禦提醒 (推薦卡片)：隔日沖分點占比偏高或帶量突破時，短評後方附加警語
+            warning = day_trade_warning(stock['code'], stock['signal_str'])
+            if warning: reason += f"\n{warning}"
             
             bubble = {
                 "type": "bubble", "size": "hecto",
@@ -580,7 +1334,7 @@ def handle_message(event):
                     "type": "box", "layout": "vertical", 
                     "contents": [
                         {"type": "text", "text": f"{stock['name']} ({stock['code']})", "weight": "bold", "size": "lg", "color": "#ffffff"},
-                        {"type": "text", "text": f"{stock['sector']} | {stock['tag']}", "size": "xxs", "color": "#eeeeee"}
+                        {"type": "text", "text": f"{stock['sector']} | {stock['tag']}{stale_note}", "size": "xxs", "color": "#eeeeee"}
                     ], "backgroundColor": stock['color']
                 },
                 "body": {"type": "box", "layout": "vertical", "contents": [
@@ -623,6 +1377,14 @@ def handle_message(event):
                 reply_text += " ‧ ".join(chunk) + "\n"
             reply_text += "\n"
             
+        # 📊 前一交易日實際占比最高的個股 (generator 分點資料)
+        top_rows = sorted(load_day_trade_index().values(), key=lambda r: r['pct'], reverse=True)[:5]
+        if top_rows:
+            reply_text += f"📊 【{published_date('day_trade') or '前一交易日'} 隔日沖買進占比最高】\n"
+            for r in top_rows:
+                reply_text += f" ‧ {STOCK_META.name(r['code'], r['code'])}({r['code']}) {r['pct']}%｜{r['top_branch']}\n"
+            reply_text += "\n"
+
         reply_text += (
             f"────────────────\n"
             f"💡 實戰技巧：\n"
@@ -632,10 +1394,23 @@ def handle_message(event):
         line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
         return
         
+    # [功能] 多檔持股批次診斷 (例：2330 成本 900, 2317 成本 150, 2454)
+    holdings, unknown = parse_portfolio(msg)
+    if holdings:
+        rows = diagnose_portfolio(holdings)
+        if not rows:
+            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="⚠️ 持股行情暫時無法取得，請稍後再試。"))
+            return
+        messages = [FlexSendMessage(alt_text="持股批次診斷", contents={"type": "carousel", "contents": [build_portfolio_bubble(r) for r in rows]})]
+        if unknown:
+            messages.insert(0, TextSendMessage(text=f"⚠️ 無法辨識：{'、'.join(unknown)}，其餘 {len(rows)} 檔診斷如下。"))
+        line_bot_api.reply_message(event.reply_token, messages)
+        return
+
     # [功能 2] 個股/ETF 診斷 (優化版)
     stock_id = get_stock_id(msg)
     user_cost = None
-    cost_match = re.search(r'(成本|cost)[:\s]*(\d+\.?\d*)', msg, re.IGNORECASE)
+    cost_match = COST_PATTERN.search(msg)
     if cost_match: user_cost = float(cost_match.group(2))
 
     # 🔥 [修改處 3] 防呆引導：攔截無效輸入，回傳 Flex 導覽選單
@@ -660,7 +1435,10 @@ def handle_message(event):
                     # 第四顆按鈕：隔日沖名單查詢
                     {"type": "button", "style": "secondary", "action": {"type": "message", "label": "🚨 隔日沖券商名單", "text": "隔日沖"}},
 
-                    # 🔥 [新增] 第 5 顆按鈕：選股邏輯說明
+                    # 第五顆按鈕：產業儀表板
+                    {"type": "button", "style": "secondary", "action": {"type": "message", "label": "🏭 產業儀表板", "text": "產業 半導體"}},
+
+                    # 🔥 [新增] 第 6 顆按鈕：選股邏輯說明
                     {"type": "button", "style": "secondary", "color": "#F57C00", "action": {"type": "message", "label": "🧠 AI 選股邏輯說明", "text": "選股邏輯"}}
                 ]
             }
@@ -669,7 +1447,8 @@ def handle_message(event):
         return
     
     if stock_id:
-        name = STOCK_META.get(stock_id, {}).get('name', CODE_TO_NAME.get(stock_id, stock_id))
+        HOT_TICKERS.add(stock_id)  # 🔥 記錄熱門查詢，讓背景輪詢器預先暖好報價
+        name = STOCK_META.name(stock_id, stock_id)
 
         # 🔥 並行抓取開始
         data = None
@@ -679,9 +1458,9 @@ def handle_message(event):
         
         try:
             # Zeabur 安全設置 max_workers=3
-            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-                future_data = executor.submit(fetch_data_light, stock_id)
-                future_chips = executor.submit(fetch_chips_accumulate, stock_id)
+            with tracing.TracedExecutor(max_workers=3) as executor:
+                future_data = executor.submit(batch_fetch, fetch_data_light, stock_id)
+                future_chips = executor.submit(batch_fetch, fetch_chips_accumulate, stock_id)
                 future_eps = executor.submit(fetch_eps, stock_id)
                 
                 # 必須先等到 data
@@ -705,43 +1484,60 @@ def handle_message(event):
         signals = get_technical_signals(data, af_val + at_val)
         signal_str = " | ".join(signals)
 
-        # 🔥 [修改處 4-1] 產生被動防禦字串
+        # 🔥 [修改處 4-1] 產生被動防禦字串 (有分點資料時直接顯示隔日沖買進占比)
         warning_block = ""
-        if "🚀量增價漲" in signal_str or "🔥RSI過熱" in signal_str:
+        day_trade_conc = get_day_trade_concentration(stock_id)
+        if day_trade_conc and day_trade_conc['pct'] >= DAY_TRADE_ALERT_PCT:
+            warning_block = (f"🚨【籌碼防禦】前一交易日隔日沖分點買進占成交量 {day_trade_conc['pct']}%"
+                             f" (淨買 {day_trade_conc['net_lots']} 張，主力：{day_trade_conc['top_branch']})，嚴防開高走低！\n------------------\n")
+        elif "🚀量增價漲" in signal_str or "🔥RSI過熱" in signal_str:
             warning_block = "🚨【籌碼防禦】本檔爆量強勢，請留意是否隔日沖分點進駐，嚴防洗盤！\n------------------\n"
         
         if user_cost:
             profit_pct = round((data['close'] - user_cost) / user_cost * 100, 1)
-            sys_prompt = "你是操盤手。回傳JSON: analysis(30字內), action(🔴續抱/🟡減碼/⚫停損), strategy(操作建議)。"
-            "【規則】：請嚴格檢查數字邏輯。若給出防守價，『大於成本』才可稱為停利，『小於成本』必須稱為停損。"
-            user_prompt = f"標的:{name}, 現價:{data['close']}, 成本:{user_cost}, 均線:{data['ma5']}/{data['ma60']}"
-            json_str = call_gemini_json(user_prompt, system_instruction=sys_prompt)
-            try:
-                res = json.loads(json_str)
-                # 🔥 [修改處 4-2] 字串尾端加上 warning_block
-                reply = f"🩺 **{name}診斷**\n💰 帳面: {profit_pct}%\n【建議】{res['action']}\n【分析】{res['analysis']}\n【策略】{res['strategy']}\n------------------\n{warning_block.strip()}"
-            except: reply = "AI 數據解析失敗 (請檢查 Key)。"
+            profit_band = band_label(profit_pct, PROFIT_EDGES)
+
+            def produce_cost_advice():
+                # 只給 AI 量化後的帳面區間與位階 (不給個人成本)，同區間的使用者共用回覆，內容也不會和畫面上的數字矛盾
+                sys_prompt = ("你是操盤手。回傳JSON: analysis(30字內), action(🔴續抱/🟡減碼/⚫停損), strategy(操作建議)。"
+                              "【規則】：請嚴格檢查數字邏輯。防守價請以均線表示；帳面獲利時稱停利，帳面虧損時必須稱停損。")
+                user_prompt = (f"標的:{name}, 帳面損益區間:{profit_band}, 均線(週/月/季):{data['ma5']}/{data['ma20']}/{data['ma60']}, "
+                               f"現價相對月線:{ma_position(data, 'ma20')}, 訊號:{signal_str}")
+                try:
+                    res = json.loads(call_gemini_json(user_prompt, system_instruction=sys_prompt))
+                    return f"【建議】{res['action']}\n【分析】{res['analysis']}\n【策略】{res['strategy']}"
+                except: return None
+
+            advice = cached_ai_call(ai_cache_key("cost", stock_id, data, signals, profit_pct=profit_pct), produce_cost_advice)
+            # 🔥 [修改處 4-2] 字串尾端加上 warning_block
+            if advice: reply = f"🩺 **{name}診斷**\n💰 帳面: {profit_pct}%\n{advice}\n------------------\n{warning_block.strip()}"
+            else: reply = "AI 數據解析失敗 (請檢查 Key)。"
             line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
             return    
-                
-        cache_key = f"{stock_id}_query"
-        ai_reply_text = get_cached_ai_response(cache_key)
-        
-        if not ai_reply_text:
+
+        def produce_query_advice():
+            # 與成本診斷相同：只給量化後的均線位階 (不給現價)，目標 / 防守以均線表示，同盤勢共用的回覆不會和畫面上的現價矛盾
             sys_prompt = (
-                "你是資深操盤手。請回傳 JSON: analysis (100字內), advice (🔴進場 / 🟡觀望 / ⚫避開), target_price, stop_loss。"
+                "你是資深操盤手。請回傳 JSON: analysis (100字內), advice (🔴進場 / 🟡觀望 / ⚫避開), target, stop_loss。"
+                "target 與 stop_loss 請以均線或相對均線的百分比表示 (例如「季線附近」「月線上方 5%」)，不要寫絕對價格。"
                 "規則：1. 若現價站上 MA5 與 MA20，視為強勢。2. 若外資大賣且破線，請示警。"
             )
-            user_prompt = f"標的:{name}, 現價:{data['close']}, MA5:{data['ma5']}, MA20:{data['ma20']}, 訊號:{signal_str}, 外資:{f_str}"
-            json_str = call_gemini_json(user_prompt, system_instruction=sys_prompt)
+            foreign_dir = "買超" if af_val > 0 else "賣超" if af_val < 0 else "持平"
+            user_prompt = (f"標的:{name}, 均線(週/月/季):{data['ma5']}/{data['ma20']}/{data['ma60']}, "
+                           f"現價相對均線(週/月/季):{ma_position(data, 'ma5')}/{ma_position(data, 'ma20')}/{ma_position(data, 'ma60')}, "
+                           f"訊號:{signal_str}, 外資近5日:{foreign_dir}")
             try:
-                res = json.loads(json_str)
-                advice_str = f"【建議】{res['advice']}\n🎯目標：{res.get('target_price','N/A')} | 🛑防守：{res.get('stop_loss','N/A')}"
-                ai_reply_text = f"【分析】{res['analysis']}\n{advice_str}"
-            except: ai_reply_text = "AI 數據解析失敗 (連線異常)。"
-            if "解析失敗" not in ai_reply_text: set_cached_ai_response(cache_key, ai_reply_text)
+                res = json.loads(call_gemini_json(user_prompt, system_instruction=sys_prompt))
+                advice_str = f"【建議】{res['advice']}\n🎯目標：{res.get('target','N/A')} | 🛑防守：{res.get('stop_loss','N/A')}"
+                return f"【分析】{res['analysis']}\n{advice_str}"
+            except: return None
+
+        cache_key = ai_cache_key("query", stock_id, data, signals, foreign=af_val)
+        ai_reply_text = cached_ai_call(cache_key, produce_query_advice) or "AI 數據解析失敗 (連線異常)。"
 
         indicator_line = f"💎 殖利率: {yield_rate}" if is_etf else f"💎 EPS: {eps}"
+        if day_trade_conc:
+            indicator_line += f"\n🎯 隔日沖占比: {day_trade_conc['pct']}%"
         
         data_dashboard = (
             f"💰 現價:{data['close']} {data['change_display']} 🕒{data['update_time']}\n"
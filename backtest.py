@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import sys
+import time
+import itertools
+from datetime import date
+import bar_store
+import institutional_flows
+import market_snapshot
+import revenue
+import stock_listing
+
+# ========================================================
+# 📐 選股規則回測 (日期 × 代號 矩陣，全向量化)
+# 資料全部來自本地：日K庫 (data_cache/bars)、法人歷史庫 (data_cache/flows)、
+# 月營收快取 (data_cache/revenue)。先把所有特徵一次算成矩陣，
+# 每組參數只剩幾個布林運算，參數掃描數百組也只需幾秒到幾分鐘。
+# 進場：訊號日「隔天開盤價」；出場：第 1 / 5 / 20 個交易日收盤。
+# ⚠️ 每日產線只回補最近 BAR_BACKFILL_DAYS (120) / FLOW_BACKFILL_DAYS (60) 個交易日，之後逐日累積；
+#    要直接做多年回測，先執行一次 --backfill 把兩個歷史庫補到 bar_store.MAX_DAYS (約 3 年)。
+#    依 TWSE 的禮貌等待，完整回補約需 30~60 分鐘 (中斷後重跑會接續)。
+# 用法：python backtest.py [daily|left_side] [--sweep]
+#       python backtest.py --backfill [交易日數]
+# ========================================================
+
+HORIZONS = [1, 5, 20]
+OUTPUT_DIR = os.path.join(bar_store.CACHE_DIR, 'backtest')
+
+# 與 generator 現行門檻相同的預設參數
+DAILY_PARAMS = {
+    "price_floor": 10,            # 股價 >= 10 元
+    "turnover_min": 300000000,    # 成交金額 > 3 億
+    "chips_min": 300000000,       # 近 5 日法人買超金額 > 3 億
+    "yoy_min": 10,                # 營收 YoY > 10%
+    "top_n": 15,                  # 每日只保留買超金額前 15 檔
+}
+LEFT_SIDE_PARAMS = {
+    "price_floor": 10,
+    "turnover_lo": 50000000,      # 成交金額 5000 萬 ~ 3 億
+    "turnover_hi": 300000000,
+    "bias_max": -0.05,            # 季線乖離 < -5%
+    "vol_ratio_max": 0.6,         # 當日量 < 20 日均量 6 成
+    "amp_max": 0.05,              # 10 日振幅 < 5%
+    "ret5_max": 0.03,             # 5 日漲幅 < 3%
+    "yoy_min": 0,                 # 營收 YoY > 0
+    "buy_days_min": 3,            # 近 5 日法人買超 >= 3 天
+}
+DAILY_GRID = {
+    "turnover_min": [100000000, 200000000, 300000000, 500000000],
+    "chips_min": [100000000, 300000000, 500000000],
+    "yoy_min": [0, 10, 20, 30],
+    "top_n": [5, 15, 30],
+}
+LEFT_SIDE_GRID = {
+    "bias_max": [-0.03, -0.05, -0.08, -0.10],
+    "vol_ratio_max": [0.5, 0.6, 0.8],
+    "amp_max": [0.04, 0.05, 0.08],
+    "ret5_max": [0.0, 0.03],
+    "buy_days_min": [2, 3, 4],
+}
+
+class Panel:
+    """回測用的 日期 × 代號 特徵矩陣 (皆為 DataFrame，index 為日期、columns 為代號)"""
+    def __init__(self, bars, flows=None, yoy_history=None, stock_codes=None):
+        self.dates = pd.to_datetime(bars.dates)
+        self.codes = list(bars.codes)
+        frame = lambda arr: pd.DataFrame(np.asarray(arr, dtype=float), index=self.dates, columns=self.codes)
+        close = frame(bars.arrays['close']); open_ = frame(bars.arrays['open'])
+        high = frame(bars.arrays['high']); low = frame(bars.arrays['low'])
+        volume = frame(bars.arrays['volume']); turnover = frame(bars.arrays['turnover'])
+
+        code = pd.Series(self.codes)
+        common = ((code.str.len() == 4) & ~code.str.startswith('00') & ~code.str.startswith('91')).to_numpy()
+        self.common = np.broadcast_to(common, close.shape)
+        listed = np.array([c in stock_codes for c in self.codes]) if stock_codes is not None else common
+        self.listed = np.broadcast_to(listed, close.shape)
+
+        self.close = close.to_numpy(); self.turnover = turnover.to_numpy()
+        self.is_up = (close > close.shift(1)).to_numpy()
+
+        # 第二層技術指標 (視窗內有停牌日的代號該日為 NaN，條件自然不成立)
+        ma60 = close.rolling(60).mean()
+        self.bias60 = (close / ma60 - 1).to_numpy()
+        self.vol_ratio = (volume / volume.rolling(20).mean()).to_numpy()
+        low10 = low.rolling(10).min()
+        self.amp10 = ((high.rolling(10).max() - low10) / low10).to_numpy()
+        self.ret5 = (close / close.shift(4) - 1).to_numpy()
+
+        # 法人：外資 + 投信淨買張數；歷史庫沒有的日子整列為 NaN
+        net = pd.DataFrame(np.nan, index=self.dates, columns=self.codes)
+        if flows is not None and flows.dates:
+            f = pd.DataFrame(np.asarray(flows.arrays['foreign'], dtype=float) + np.asarray(flows.arrays['trust'], dtype=float),
+                             index=pd.to_datetime(flows.dates), columns=flows.codes)
+            net = f.reindex(columns=self.codes).fillna(0).reindex(self.dates)  # 當日沒出現在法人表 = 0
+        self.flow5_value = (net.rolling(5).sum() * 1000 * close).to_numpy()
+        self.buy_days5 = (net > 0).astype(float).where(net.notna()).rolling(5).sum().to_numpy()
+
+        # 營收 YoY：每個交易日只看得到「當時已公布」的月份
+        self.yoy = np.full(close.shape, np.nan)
+        if yoy_history is not None and not yoy_history.empty:
+            yh = yoy_history.reindex(self.codes)
+            period_col = {p: i for i, p in enumerate(yh.columns)}
+            yh_arr = yh.to_numpy()
+            for i, d in enumerate(self.dates):
+                col = period_col.get(revenue.available_period(d))
+                if col is not None: self.yoy[i] = yh_arr[:, col]
+
+        # 遠期報酬：隔日開盤進場
+        entry = open_.shift(-1)
+        self.forward = {k: (close.shift(-k) / entry - 1).to_numpy() for k in HORIZONS}
+        self.mae20 = (low.rolling(20).min().shift(-20) / entry - 1).to_numpy()  # 持有 20 日內最大不利變動
+
+    @classmethod
+    def load(cls, yoy_months=None):
+        bars = bar_store.BarStore.load()
+        flows = bar_store.BarStore.load(institutional_flows.FLOW_DIR, fields=institutional_flows.FLOW_FIELDS)
+        yoy_history = revenue.load_yoy_history(months=yoy_months or (len(bars.dates) // 20 + 14))
+        try:
+            with open('stock_list.json', 'r', encoding='utf-8') as f:
+                stock_codes = {k for k, v in json.load(f).items() if v.get('type') == '股票'}
+        except (OSError, ValueError):
+            stock_codes = None
+        return cls(bars, flows, yoy_history, stock_codes)
+
+def _top_n(mask, score, n):
+    """每列 (日期) 在 mask 內依 score 取前 n 名"""
+    ranked = pd.DataFrame(np.where(mask, score, np.nan)).rank(axis=1, ascending=False, method='first')
+    return (ranked <= n).to_numpy()
+
+def daily_rule(p, params):
+    """右側：generate_daily_recommendations 的選股條件"""
+    mask = (
+        p.common & (p.close >= params['price_floor']) & p.is_up
+        & (p.turnover > params['turnover_min'])
+        & (p.flow5_value > params['chips_min'])
+        & (p.yoy > params['yoy_min'])
+    )
+    return _top_n(mask, p.flow5_value, params['top_n'])
+
+def left_side_rule(p, params):
+    """左側：generate_left_side_value 三層漏斗 (EPS 無歷史資料，回測不含 EPS>0 條件)"""
+    return (
+        p.listed & (p.close >= params['price_floor'])
+        & (p.turnover >= params['turnover_lo']) & (p.turnover <= params['turnover_hi'])
+        & (p.bias60 < params['bias_max'])
+        & (p.vol_ratio < params['vol_ratio_max'])
+        & (p.amp10 < params['amp_max'])
+        & (p.ret5 < params['ret5_max'])
+        & (p.yoy > params['yoy_min'])
+        & (p.buy_days5 >= params['buy_days_min'])
+    )
+
+RULES = {"daily": (daily_rule, DAILY_PARAMS, DAILY_GRID), "left_side": (left_side_rule, LEFT_SIDE_PARAMS, LEFT_SIDE_GRID)}
+
+def max_drawdown(returns):
+    equity = np.cumprod(1 + returns)
+    peak = np.maximum.accumulate(equity)
+    return float((equity / peak - 1).min()) if len(equity) else 0.0
+
+def evaluate(p, mask):
+    """各持有期的平均 / 中位數報酬、勝率，以及每日等權持有 1 日組合的最大回撤"""
+    stats = {"signals": int(mask.sum()), "signal_days": int(mask.any(axis=1).sum())}
+    for k in HORIZONS:
+        vals = p.forward[k][mask & ~np.isnan(p.forward[k])]
+        stats[f"n_{k}d"] = int(len(vals))
+        stats[f"mean_{k}d"] = float(vals.mean()) if len(vals) else np.nan
+        stats[f"median_{k}d"] = float(np.median(vals)) if len(vals) else np.nan
+        stats[f"hit_{k}d"] = float((vals > 0).mean()) if len(vals) else np.nan
+    mae = p.mae20[mask & ~np.isnan(p.mae20)]
+    stats["mae_20d"] = float(mae.mean()) if len(mae) else np.nan
+
+    held = mask & ~np.isnan(p.forward[1])
+    counts = held.sum(axis=1)
+    daily = np.where(held, p.forward[1], 0).sum(axis=1) / np.maximum(counts, 1)  # 無訊號日報酬為 0
+    stats["max_drawdown"] = max_drawdown(daily)
+    return stats
+
+def run(p, rule_name, params=None):
+    rule, defaults, _ = RULES[rule_name]
+    return evaluate(p, rule(p, {**defaults, **(params or {})}))
+
+def sweep(p, rule_name, grid=None):
+    rule, defaults, default_grid = RULES[rule_name]
+    grid = grid or default_grid
+    keys = list(grid)
+    rows = []
+    for values in itertools.product(*(grid[k] for k in keys)):
+        params = dict(zip(keys, values))
+        rows.append({**params, **evaluate(p, rule(p, {**defaults, **params}))})
+    return pd.DataFrame(rows).sort_values('mean_5d', ascending=False)
+
+def print_stats(name, stats):
+    print(f"\n📐 {name}：{stats['signals']} 筆訊號 / {stats['signal_days']} 個訊號日")
+    for k in HORIZONS:
+        print(f"   {k:>2} 日：平均 {stats[f'mean_{k}d']*100:6.2f}%、中位數 {stats[f'median_{k}d']*100:6.2f}%、勝率 {stats[f'hit_{k}d']*100:5.1f}% (n={stats[f'n_{k}d']})")
+    print(f"   20 日內平均最大不利變動 {stats['mae_20d']*100:.2f}%，每日等權組合最大回撤 {stats['max_drawdown']*100:.2f}%")
+
+def backfill_history(days=bar_store.MAX_DAYS):
+    """日K庫與法人歷史庫回補到 days 個交易日 (依序執行，不同時連打 TWSE)"""
+    snapshot = market_snapshot.load_market_snapshot()
+    if snapshot is None or snapshot.empty:
+        print("⚠️ 無法取得最新全市場行情，回補中止")
+        return
+    bar_store.update_bar_store(snapshot, list(stock_listing.load_stock_list().keys()), backfill_days=days)
+    institutional_flows.update_flow_store(backfill_days=days, base_date=snapshot.attrs['date'])
+
+if __name__ == "__main__":
+    if '--backfill' in sys.argv:
+        args = [a for a in sys.argv[1:] if not a.startswith('--')]
+        backfill_history(int(args[0]) if args else bar_store.MAX_DAYS)
+        sys.exit()
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    rule_names = args or list(RULES)
+    t0 = time.perf_counter()
+    panel = Panel.load()
+    print(f"📦 特徵矩陣：{len(panel.dates)} 個交易日 × {len(panel.codes)} 檔，耗時 {time.perf_counter() - t0:.1f}s")
+    for name in rule_names:
+        if '--sweep' in sys.argv:
+            t1 = time.perf_counter()
+            result = sweep(panel, name)
+            os.makedirs(OUTPUT_DIR, exist_ok=True)
+            path = os.path.join(OUTPUT_DIR, f"sweep_{name}_{date.today().isoformat()}.csv")
+            result.to_csv(path, index=False)
+            print(f"\n🔎 {name} 參數掃描 {len(result)} 組，耗時 {time.perf_counter() - t1:.1f}s -> {path}")
+            print(result.head(10).to_string(index=False))
+        else:
+            print_stats(name, run(panel, name))
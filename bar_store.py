@@ -0,0 +1,143 @@
+import numpy as np
+import json
+import os
+import trading_calendar
+import http_archive
+import market_snapshot
+
+# ========================================================
+# 🗄️ 全市場日K本地資料庫 (日期 × 代號 的欄式陣列)
+# 每個欄位 (開高低收量額) 存成一個 .npy，可用 mmap 直接讀取：
+#   data_cache/bars/meta.json   -> {"dates": [...], "codes": [...]}
+#   data_cache/bars/close.npy   -> float64[len(dates), len(codes)]，無交易為 NaN
+# 每天只需把當日全市場快照 append 進去，歷史只在第一次回補，
+# 第二層技術篩選、回測都能零網路讀取數個月的 K 線。
+# 只寫入一個交易所的日子 (上櫃資料尚未產出等) 記在 meta.json 的 partial，下次執行重新回補整天。
+# ========================================================
+
+CACHE_DIR = os.environ.get('DATA_CACHE_DIR', 'data_cache')
+BAR_DIR = os.path.join(CACHE_DIR, 'bars')
+BAR_FIELDS = ['open', 'high', 'low', 'close', 'volume', 'turnover']
+MAX_DAYS = int(os.environ.get('BAR_STORE_MAX_DAYS', 750))   # 約 3 年，足夠回測使用
+BACKFILL_DAYS = int(os.environ.get('BAR_BACKFILL_DAYS', 120))
+BACKFILL_SAVE_EVERY = 10   # 回補途中每寫入幾天就存檔一次，中斷後重跑可接續
+
+class BarStore:
+    """日期 × 代號 的日K矩陣；讀取時預設以 mmap 開啟，不把整份資料載進記憶體
+    欄位預設為開高低收量額，也可存其他逐日資料 (例如法人買賣超)"""
+    def __init__(self, dates, codes, arrays, partial=()):
+        self.dates = list(dates)      # 'YYYY-MM-DD'，舊到新
+        self.codes = list(codes)
+        self.partial = set(partial)   # 只有部分交易所資料的日子 (待重新回補)
+        self.arrays = arrays          # 欄位 -> ndarray[len(dates), len(codes)]
+        self.fields = list(arrays)
+        self.date_index = {d: i for i, d in enumerate(self.dates)}
+        self.code_index = {c: j for j, c in enumerate(self.codes)}
+
+    @classmethod
+    def empty(cls, codes=(), fields=BAR_FIELDS):
+        return cls([], codes, {f: np.full((0, len(codes)), np.nan) for f in fields})
+
+    @classmethod
+    def load(cls, path=BAR_DIR, mmap=True, fields=BAR_FIELDS):
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path): return cls.empty(fields=fields)
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {f: np.load(os.path.join(path, f"{f}.npy"), mmap_mode='r' if mmap else None) for f in meta.get('fields', fields)}
+        return cls(meta['dates'], meta['codes'], arrays, meta.get('partial', ()))
+
+    def save(self, path=BAR_DIR):
+        os.makedirs(path, exist_ok=True)
+        for field, arr in self.arrays.items():
+            tmp = os.path.join(path, f"{field}.tmp.npy")
+            np.save(tmp, np.ascontiguousarray(arr))
+            os.replace(tmp, os.path.join(path, f"{field}.npy"))
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({"dates": self.dates, "codes": self.codes, "fields": self.fields,
+                       "partial": sorted(d for d in self.partial if d in self.date_index)}, f)
+
+    def ensure_codes(self, codes):
+        """新上市代號補一整欄 NaN (歷史無資料)"""
+        new_codes = [c for c in codes if c not in self.code_index]
+        if not new_codes: return
+        pad = np.full((len(self.dates), len(new_codes)), np.nan)
+        self.arrays = {f: np.hstack([np.asarray(a), pad]) for f, a in self.arrays.items()}
+        self.codes.extend(new_codes)
+        self.code_index = {c: j for j, c in enumerate(self.codes)}
+
+    def put_day(self, date_str, snapshot, complete=True):
+        """寫入 (或覆蓋) 一天的全市場快照；只收錄 store 內已有的代號
+        complete=False 代表缺少某個交易所，記為 partial 待下次回補"""
+        if complete: self.partial.discard(date_str)
+        else: self.partial.add(date_str)
+        cols = snapshot['code'].map(self.code_index)
+        valid = cols.notna().to_numpy()
+        col_idx = cols[valid].astype(int).to_numpy()
+        row = {f: np.full(len(self.codes), np.nan) for f in self.fields}
+        for f in self.fields:
+            row[f][col_idx] = snapshot[f].to_numpy(dtype=float)[valid]
+
+        if date_str in self.date_index:
+            i = self.date_index[date_str]
+            for f in self.fields:
+                arr = np.array(self.arrays[f])  # mmap 為唯讀，複製後再改
+                arr[i] = row[f]
+                self.arrays[f] = arr
+            return
+        # 依日期排序插入 (回補時可能是較舊的日期)
+        pos = next((i for i, d in enumerate(self.dates) if d > date_str), len(self.dates))
+        self.arrays = {f: np.insert(np.asarray(self.arrays[f]), pos, row[f], axis=0) for f in self.fields}
+        self.dates.insert(pos, date_str)
+        self.date_index = {d: i for i, d in enumerate(self.dates)}
+
+    def trim(self, max_days=MAX_DAYS):
+        if len(self.dates) <= max_days: return
+        self.arrays = {f: np.asarray(a)[-max_days:] for f, a in self.arrays.items()}
+        self.dates = self.dates[-max_days:]
+        self.date_index = {d: i for i, d in enumerate(self.dates)}
+
+    def window(self, field, days, codes=None):
+        """最近 days 天的 (代號數 × days) 矩陣，舊到新；codes 為 None 時回傳全市場"""
+        arr = self.arrays[field][-days:]
+        if codes is not None:
+            arr = arr[:, [self.code_index[c] for c in codes]]
+        return np.asarray(arr, dtype=float).T
+
+    def history(self, code, days):
+        """單一代號最近 days 天的各欄位一維陣列 (去除無交易日)"""
+        j = self.code_index.get(code)
+        if j is None: return None
+        bars = {f: np.asarray(self.arrays[f][-days:, j], dtype=float) for f in self.fields}
+        traded = ~np.isnan(bars['close'])
+        return {f: v[traded] for f, v in bars.items()}
+
+def update_bar_store(snapshot, codes, backfill_days=BACKFILL_DAYS):
+    """把今日快照寫入本地日K庫；不足 backfill_days 的交易日只會在第一次執行時回補"""
+    store = BarStore.load(mmap=False)
+    store.ensure_codes(codes)
+
+    today = snapshot.attrs['date']
+    wanted = trading_calendar.recent_trading_days(backfill_days, today)
+    missing = [d for d in wanted if (d.isoformat() not in store.date_index or d.isoformat() in store.partial) and d != today]
+    if missing:
+        print(f"🗄️ 日K庫回補 {len(missing)} 個交易日 (僅首次執行需要)...")
+    for i, d in enumerate(sorted(missing), 1):
+        try:
+            day_snapshot = market_snapshot.load_market_snapshot(d, fallback=False)
+            if day_snapshot is not None and day_snapshot.attrs['date'] == d:
+                store.put_day(d.isoformat(), *market_snapshot.same_day_rows(day_snapshot))
+        except Exception as e:
+            print(f"⚠️ {d} 日K回補失敗: {e}")
+        if i % BACKFILL_SAVE_EVERY == 0:
+            store.save()
+        http_archive.pause(1)  # TWSE 連續請求過快會被暫時封鎖
+
+    rows, complete = market_snapshot.same_day_rows(snapshot)
+    if not complete:
+        print(f"⚠️ {today} 只寫入 {len(rows)} 檔 (另一個交易所資料日期不同或缺漏)，下次執行重新回補")
+    store.put_day(today.isoformat(), rows, complete)
+    store.trim()
+    store.save()
+    print(f"🗄️ 日K庫已更新：{len(store.dates)} 個交易日 × {len(store.codes)} 檔 (最新 {store.dates[-1]})")
+    return BarStore.load()
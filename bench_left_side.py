@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import sys
+import time
+import tempfile
+import bar_store
+import generator
+import http_archive
+from providers import LocalProviders, LiveProviders
+
+# ========================================================
+# ⏱️ 左側三層漏斗離線效能量測
+# 以亂數產生一份全市場假資料 (股票池 / 快照 / 日K庫 / 基本面 / 營收 / 籌碼)，
+# 透過 LocalProviders 跑完整條漏斗，完全不連網。
+# 用法：python bench_left_side.py [檔數=1800] [天數=120]
+#       python bench_left_side.py --replay   (改用 HTTP 錄製檔案庫的真實資料)
+# ========================================================
+
+def build_fixture(root, n_codes=1800, n_days=120, seed=0):
+    rng = np.random.default_rng(seed)
+    codes = [str(1101 + i) for i in range(n_codes)]
+    stock_list = {c: {"name": f"測試{c}", "sector": "測試業", "type": "股票"} for c in codes}
+    with open(os.path.join(root, 'stock_list.json'), 'w', encoding='utf-8') as f:
+        json.dump(stock_list, f, ensure_ascii=False)
+
+    # 日K：隨機漫步，前段下跌、最後 10 天窄幅盤整，讓部分代號能通過第二層
+    dates = [d.strftime('%Y-%m-%d') for d in pd.bdate_range(end='2026-10-16', periods=n_days)]
+    drift = rng.choice([-0.004, 0.0, 0.003], size=n_codes)
+    steps = rng.normal(drift, 0.01, size=(n_days, n_codes))
+    steps[-10:] *= 0.1
+    close = 50 * np.exp(np.cumsum(steps, axis=0))
+    volume = rng.uniform(1e6, 3e6, size=(n_days, n_codes))
+    volume[-1] *= rng.choice([0.3, 1.0], size=n_codes)
+    arrays = {
+        'open': close, 'high': close * 1.004, 'low': close * 0.996, 'close': close,
+        'volume': volume, 'turnover': close * volume,
+    }
+    bar_store.BarStore(dates, codes, arrays).save(os.path.join(root, 'bars'))
+
+    snapshot = pd.DataFrame({
+        'code': codes, 'name': [stock_list[c]['name'] for c in codes], 'exchange': '上市', 'market': 'TW',
+        'open': close[-1], 'high': arrays['high'][-1], 'low': arrays['low'][-1], 'close': close[-1],
+        'volume': volume[-1], 'turnover': rng.uniform(2e7, 5e8, size=n_codes), 'change': 0.0, 'is_up': False,
+    })
+    snapshot.to_csv(os.path.join(root, 'snapshot.csv'), index=False)
+
+    fixtures = {
+        'fundamentals.json': {c: {"eps": round(float(rng.normal(1, 1)), 2), "yield_rate": round(float(rng.uniform(0, 6)), 2)} for c in codes},
+        'revenue.json': {c: {"yoy": round(float(rng.normal(5, 15)), 2)} for c in codes},
+        'chips.json': {c: [int(x) for x in rng.integers(-200, 300, size=5)] for c in codes},
+    }
+    for name, data in fixtures.items():
+        with open(os.path.join(root, name), 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+def bench_replay():
+    """以錄製好的 HTTP 檔案庫 (HTTP_ARCHIVE_DIR) 跑正式資料來源，量測真實資料下的漏斗耗時"""
+    http_archive.install('replay')
+    t0 = time.perf_counter()
+    providers = LiveProviders(revenue_lookup=generator.get_finmind_revenue_yoy, chips_lookup=generator.get_finmind_chips_history)
+    result = generator.generate_left_side_value(providers, output_path=os.path.join(tempfile.gettempdir(), 'left_side_value.json'))
+    print(f"\n⏱️ 重播資料三層漏斗：{time.perf_counter() - t0:.3f}s，入選 {len(result or [])} 檔")
+    http_archive.report()
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['--replay']:
+        bench_replay()
+        sys.exit()
+    n_codes = int(sys.argv[1]) if len(sys.argv) > 1 else 1800
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 120
+    with tempfile.TemporaryDirectory() as root:
+        t0 = time.perf_counter()
+        build_fixture(root, n_codes, n_days)
+        t1 = time.perf_counter()
+        result = generator.generate_left_side_value(LocalProviders(root), output_path=os.path.join(root, 'left_side_value.json'))
+        t2 = time.perf_counter()
+    print(f"\n⏱️ 假資料產生 {t1 - t0:.2f}s；三層漏斗 {n_codes} 檔 × {n_days} 天：{t2 - t1:.3f}s，入選 {len(result or [])} 檔")
@@ -0,0 +1,108 @@
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+import tracemalloc
+from datetime import date, timedelta
+import compact_store
+import stock_listing
+
+# ========================================================
+# 🗜️ bot worker 記憶體量測 (舊版 dict / list 結構 vs compact_store)
+# 每個情境在獨立的子行程內執行，量測建立資料前後的 RSS 差距 (Linux /proc/self/status)，
+# 另以 tracemalloc 量測實際存活的物件大小 (小型資料表的 RSS 會被配置器保留的空間蓋過)：
+#   meta-*  ：載入 stock_list.json 後的股票清單查詢表
+#   bars-*  ：日K快取 (HISTORY_CACHE) 保存 N 檔 × 120 天，外加同時進行中的分析結果
+# 用法：python bench_memory.py [快取檔數=600] [進行中的分析結果數=50]
+# ========================================================
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'): return int(line.split()[1])
+    return 0
+
+def finmind_payload(code, n_days=120, seed=0):
+    """模擬 FinMind TaiwanStockPrice 回應 (JSON 字串，解析後才會是各自獨立的字串 / float 物件)"""
+    rng = random.Random(f"{code}-{seed}")
+    price = rng.uniform(20, 800)
+    rows = []
+    day = date(2026, 4, 1)
+    for _ in range(n_days):
+        day += timedelta(days=1)
+        price *= 1 + rng.gauss(0, 0.015)
+        volume = rng.randint(100_000, 30_000_000)
+        rows.append({"date": day.isoformat(), "stock_id": code, "Trading_Volume": volume,
+                     "Trading_money": int(volume * price), "open": round(price * 0.99, 2),
+                     "max": round(price * 1.01, 2), "min": round(price * 0.98, 2), "close": round(price, 2),
+                     "spread": round(price * 0.01, 2), "Trading_turnover": rng.randint(100, 20000)})
+    return json.dumps({"data": rows})
+
+def scenario_meta_old(stock_map):
+    meta = stock_map
+    all_map = {}; code_to_name = {}
+    for code, info in meta.items():
+        if info.get('name'): all_map[info['name']] = code
+        all_map[code] = code
+        code_to_name[code] = info.get('name', '')
+    return meta, all_map, code_to_name
+
+def scenario_meta_new(stock_map):
+    return compact_store.StockMetaStore(stock_map)
+
+def scenario_bars_old(codes, in_flight):
+    cache = {code: json.loads(finmind_payload(code))['data'] for code in codes}
+    results = []
+    for code in codes[:in_flight]:
+        hist = cache[code]
+        results.append({"raw_closes": [d['close'] for d in hist], "raw_highs": [d['max'] for d in hist],
+                        "raw_lows": [d['min'] for d in hist], "raw_volumes": [d['Trading_Volume'] for d in hist]})
+    return cache, results
+
+def scenario_bars_new(codes, in_flight):
+    cache = {code: compact_store.Bars.from_finmind(json.loads(finmind_payload(code))['data']) for code in codes}
+    results = [{"bars": cache[code].with_live_price(cache[code].closes[-1], '2099-01-01')} for code in codes[:in_flight]]
+    return cache, results
+
+def run_scenario(name, n_cached, in_flight, traced=False):
+    """子行程進入點：印出 RSS 增量或存活物件大小 (KB)"""
+    stock_map = stock_listing.load_stock_list()
+    codes = [str(1101 + i) for i in range(n_cached)]
+    payload = json.dumps(stock_map)   # 讓兩種情境都從「剛解析完的 JSON」開始建表
+    del stock_map
+    gc.collect()
+    if traced: tracemalloc.start()
+    before = rss_kb()
+    if name == 'meta-old': keep = scenario_meta_old(json.loads(payload))
+    elif name == 'meta-new': keep = scenario_meta_new(json.loads(payload))
+    elif name == 'bars-old': keep = scenario_bars_old(codes, in_flight)
+    else: keep = scenario_bars_new(codes, in_flight)
+    gc.collect()
+    print(tracemalloc.get_traced_memory()[0] // 1024 if traced else rss_kb() - before)
+    return keep
+
+def measure(name, n_cached, in_flight, traced=False, repeat=3):
+    """取多次子行程量測的中位數 (RSS 受配置器影響會有些微抖動)"""
+    mode = '--traced' if traced else '--scenario'
+    vals = sorted(int(subprocess.check_output([sys.executable, __file__, mode, name, str(n_cached), str(in_flight)],
+                                              cwd=os.path.dirname(os.path.abspath(__file__))).split()[-1])
+                  for _ in range(repeat))
+    return vals[len(vals) // 2]
+
+if __name__ == "__main__":
+    if sys.argv[1:2] in (['--scenario'], ['--traced']):
+        run_scenario(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), traced=sys.argv[1] == '--traced')
+        sys.exit()
+    n_cached = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    in_flight = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    print(f"🗜️ 每個 worker 的記憶體增量 (股票清單 {len(stock_listing.load_stock_list())} 檔；日K快取 {n_cached} 檔 × 120 天、進行中分析 {in_flight} 筆)")
+    totals = {}
+    for label, old, new in [("股票清單", 'meta-old', 'meta-new'), ("日K快取 + 分析結果", 'bars-old', 'bars-new')]:
+        for traced, unit in ((False, "RSS"), (True, "存活物件")):
+            a = measure(old, n_cached, in_flight, traced); b = measure(new, n_cached, in_flight, traced)
+            totals[unit] = (totals.get(unit, (0, 0))[0] + a, totals.get(unit, (0, 0))[1] + b)
+            print(f"   {label} {unit}: 舊版 {a / 1024:.1f} MB -> 精簡版 {b / 1024:.1f} MB")
+    for unit, (a, b) in totals.items():
+        print(f"   合計 {unit}: {a / 1024:.1f} MB -> {b / 1024:.1f} MB ({(1 - b / max(a, 1)) * 100:.0f}% ↓)")
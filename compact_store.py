@@ -0,0 +1,118 @@
+import sys
+from array import array
+import stock_listing
+
+# ========================================================
+# 🗜️ 精簡記憶體表示 (bot 使用，只依賴標準庫)
+# 每個 gunicorn worker 都各自持有一份，省下來的記憶體可以多開 worker：
+#   - StockMetaStore：股票清單只存一張「代號 -> __slots__ 紀錄」的表，加一張名稱反查表，
+#     代號 / 名稱 / 產業 / 類型字串全部 intern (2000 多檔共用同一個「股票」字串)，
+#     取代原本 STOCK_META / ALL_STOCK_MAP / CODE_TO_NAME 三份重疊的 dict。
+#   - Bars：日K以 array('d') 緩衝區保存 (每根 K 棒每欄 8 bytes)，
+#     取代 FinMind 回傳的 list of dict，分析結果直接帶同一個物件，不再複製成四個 list。
+# 量測：python bench_memory.py
+# ========================================================
+
+class StockRecord:
+    __slots__ = ('code', 'name', 'sector', 'type')
+
+    def __init__(self, code, info):
+        self.code = sys.intern(code)
+        self.name = sys.intern(info.get('name', ''))
+        self.sector = sys.intern(info.get('sector', ''))
+        self.type = sys.intern(info.get('type', ''))
+
+    def as_dict(self):
+        """還原成 stock_list.json 的格式 (比對清單指紋用)"""
+        return {"name": self.name, "sector": self.sector, "type": self.type}
+
+class StockMetaStore:
+    def __init__(self, stock_map=None):
+        self.records = {}   # 代號 -> StockRecord
+        self.by_name = {}   # 中文名稱 -> 代號 (與紀錄共用同一個字串物件)
+        if stock_map: self.load(stock_map)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, code):
+        return code in self.records
+
+    def _put(self, code, info):
+        record = StockRecord(code, info)
+        self.records[record.code] = record
+        if record.name: self.by_name[record.name] = record.code
+
+    def _drop(self, code):
+        record = self.records.pop(code, None)
+        if record is not None and self.by_name.get(record.name) == code:
+            del self.by_name[record.name]
+
+    def load(self, stock_map):
+        self.records.clear(); self.by_name.clear()
+        for code, info in stock_map.items():
+            self._put(code, info)
+
+    def apply_delta(self, delta):
+        """套用差異檔 (新上市 / 下市 / 更名)，格式同 stock_listing.apply_delta"""
+        for code in delta.get('removed', []):
+            self._drop(code)
+        for code, info in delta.get('added', {}).items():
+            self._drop(code); self._put(code, info)
+        for code, change in delta.get('changed', {}).items():
+            self._drop(code); self._put(code, change['new'])
+
+    def get(self, code):
+        return self.records.get(code)
+
+    def name(self, code, default=None):
+        record = self.records.get(code)
+        return record.name if record is not None else default
+
+    def sector(self, code, default=''):
+        record = self.records.get(code)
+        return record.sector if record is not None and record.sector else default
+
+    def resolve(self, text):
+        """代號或中文名稱 -> 代號；查無回傳 None"""
+        if text in self.records: return text
+        return self.by_name.get(text)
+
+    def codes(self, type_=None):
+        return [code for code, r in self.records.items() if type_ is None or r.type == type_]
+
+    def listing_hash(self):
+        return stock_listing.listing_hash({code: r.as_dict() for code, r in self.records.items()})
+
+class Bars:
+    """一檔股票的日K，舊到新；last_date 為最後一根 K 棒日期 (YYYY-MM-DD)"""
+    __slots__ = ('last_date', 'opens', 'highs', 'lows', 'closes', 'volumes')
+
+    def __init__(self, last_date, opens, highs, lows, closes, volumes):
+        self.last_date = last_date
+        self.opens = opens; self.highs = highs; self.lows = lows
+        self.closes = closes; self.volumes = volumes
+
+    @classmethod
+    def from_finmind(cls, rows):
+        """FinMind TaiwanStockPrice 的 data 陣列 -> Bars (空陣列回傳 None)"""
+        if not rows: return None
+        return cls(rows[-1]['date'],
+                   array('d', (r['open'] for r in rows)), array('d', (r['max'] for r in rows)),
+                   array('d', (r['min'] for r in rows)), array('d', (r['close'] for r in rows)),
+                   array('d', (r['Trading_Volume'] for r in rows)))
+
+    def __len__(self):
+        return len(self.closes)
+
+    def with_live_price(self, price, today_str):
+        """接上盤中價格的新 Bars (快取中的原件不動)：
+        最後一根不是今天就補一根 (高低收都是現價、量 0)，是今天就只改收盤價"""
+        opens, highs, lows = array('d', self.opens), array('d', self.highs), array('d', self.lows)
+        closes, volumes = array('d', self.closes), array('d', self.volumes)
+        if self.last_date != today_str:
+            opens.append(price); highs.append(price); lows.append(price)
+            closes.append(price); volumes.append(0)
+        else:
+            closes[-1] = price
+        return Bars(today_str, opens, highs, lows, closes, volumes)
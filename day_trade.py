@@ -0,0 +1,109 @@
+import pandas as pd
+import json
+import os
+import re
+import time
+import concurrent.futures
+import run_report
+
+# ========================================================
+# 🚨 隔日沖分點集中度 (generator 使用)
+# 以 FinMind 分點進出 (TaiwanStockTradingDailyReport，專用端點、一次一個交易日) 依「券商分點」查詢：
+# 名單上有幾個分點就只打幾次 API，一次拿到該分點當日買賣的所有股票，
+# 再向量化彙總成「每檔股票被隔日沖分點買進的股數 / 當日總成交股數」。
+# 結果只保留占比達門檻的代號，以精簡表格發布給 bot 直接查表。
+# ========================================================
+
+BROKER_LIST_PATH = 'day_trade_brokers.json'
+CACHE_DIR = os.environ.get('DATA_CACHE_DIR', 'data_cache')
+TRADER_INFO_PATH = os.path.join(CACHE_DIR, 'trader_info.json')
+TRADER_INFO_MAX_AGE = 30 * 86400        # 券商分點代號表 30 天更新一次
+MIN_PCT = float(os.environ.get('DAY_TRADE_MIN_PCT', 1))   # 占比低於此值 (%) 的代號不發布
+FETCH_WORKERS = 4
+TRADING_REPORT_URL = 'https://api.finmindtrade.com/api/v4/taiwan_stock_trading_daily_report'
+
+def normalize_branch(name):
+    """「凱基(台北)」「凱基-台北」「凱基證券台北」-> 「凱基台北」"""
+    name = str(name).replace('證券', '')
+    return re.sub(r'[\s()（）\-－_]', '', name)
+
+def load_broker_list(path=BROKER_LIST_PATH):
+    """名單檔 -> 去重後的分點名稱 (保留原始寫法，顯示用)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    names = [name for group in data.get('brokers', {}).values() for name in group]
+    return list(dict.fromkeys(names))
+
+def load_trader_info(fetch, refresh=False):
+    """{正規化分點名稱: 分點代號}；快取於 data_cache，過期才重抓"""
+    if not refresh and os.path.exists(TRADER_INFO_PATH) and time.time() - os.path.getmtime(TRADER_INFO_PATH) < TRADER_INFO_MAX_AGE:
+        with open(TRADER_INFO_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    rows = fetch({"dataset": "TaiwanSecuritiesTraderInfo"})
+    info = {normalize_branch(r['securities_trader']): str(r['securities_trader_id']) for r in rows}
+    if info:
+        os.makedirs(os.path.dirname(TRADER_INFO_PATH), exist_ok=True)
+        with open(TRADER_INFO_PATH, 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+    return info
+
+def resolve_branches(names, trader_info):
+    """分點名稱 -> 代號；對不到的名稱回傳在 missing (名單寫法與交易所不同時提醒維護)"""
+    resolved = {}; missing = []
+    for name in names:
+        trader_id = trader_info.get(normalize_branch(name))
+        if trader_id: resolved[trader_id] = name
+        else: missing.append(name)
+    return resolved, missing
+
+def fetch_branch_trades(fetch, branches, date_str):
+    """每個分點一次請求 -> DataFrame[stock_id, branch, buy, sell] (股)
+    分點進出不走通用 /data 端點，改用專用端點並以單一 date 查詢；全部分點都失敗時拋出錯誤，不發布空表"""
+    def one(trader_id):
+        rows = fetch({"securities_trader_id": trader_id, "date": date_str}, url=TRADING_REPORT_URL)
+        return [(str(r['stock_id']), branches[trader_id], r.get('buy', 0), r.get('sell', 0)) for r in rows]
+
+    records = []
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        futures = {executor.submit(one, trader_id): trader_id for trader_id in branches}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                records.extend(future.result())
+            except Exception as e:
+                failed += 1
+                print(f"⚠️ 分點 {branches[futures[future]]} 進出資料抓取失敗: {e}")
+    run_report.count("day_trade_branch_failures", failed)
+    if branches and failed == len(branches):
+        raise RuntimeError(f"隔日沖分點進出 {failed} 個分點全部抓取失敗 ({date_str})")
+    return pd.DataFrame(records, columns=['stock_id', 'branch', 'buy', 'sell'])
+
+def compute_concentration(trades, snapshot, min_pct=MIN_PCT):
+    """各代號：名單分點買進股數占當日成交股數 (%)、分點淨買張數、買最多的分點"""
+    if trades.empty: return []
+    trades = trades.astype({'buy': 'float64', 'sell': 'float64'})
+    per_branch = trades.groupby(['stock_id', 'branch'], as_index=False)[['buy', 'sell']].sum()
+    totals = per_branch.groupby('stock_id')[['buy', 'sell']].sum()
+    top = per_branch.sort_values('buy', ascending=False).drop_duplicates('stock_id').set_index('stock_id')['branch']
+
+    volume = snapshot.set_index('code')['volume']
+    df = totals.join(volume, how='inner').join(top.rename('top_branch'))
+    df = df[df['volume'] > 0]
+    df['pct'] = (df['buy'] / df['volume'] * 100).round(1)
+    df['net_lots'] = ((df['buy'] - df['sell']) // 1000).astype('int64')
+    df = df[df['pct'] >= min_pct].sort_values('pct', ascending=False)
+    return [{"code": code, "pct": float(r['pct']), "net_lots": int(r['net_lots']), "top_branch": r['top_branch']}
+            for code, r in df.iterrows()]
+
+def build_day_trade_index(fetch, snapshot, path=BROKER_LIST_PATH):
+    """整合流程：fetch 為 FinMind 查詢函式 (generator.finmind_get)"""
+    date_str = snapshot.attrs['date'].isoformat()
+    branches, missing = resolve_branches(load_broker_list(path), load_trader_info(fetch))
+    if missing:
+        print(f"⚠️ 隔日沖名單中有 {len(missing)} 個分點對不到代號：{'、'.join(missing)}")
+    if not branches: return []
+    t0 = time.perf_counter()
+    trades = fetch_branch_trades(fetch, branches, date_str)
+    rows = compute_concentration(trades, snapshot)
+    print(f"🚨 隔日沖集中度：{len(branches)} 個分點、{len(trades)} 筆進出 -> {len(rows)} 檔占比 >= {MIN_PCT}% ({time.perf_counter() - t0:.1f}s)")
+    return rows
@@ -1,22 +1,107 @@
 import requests
 import pandas as pd
+import numpy as np
 import json
-import re
 import os
 import time
+import random
+import threading
+import concurrent.futures
+import lxml.html
 from datetime import datetime, timedelta, timezone
-from io import StringIO
+import institutional_flows
+import revenue
+import trading_calendar
+import market_snapshot
+import bar_store
+import stock_listing
+import pipeline
+import http_archive
+import publication
+import day_trade
+import run_report
+from providers import LiveProviders
 
 # ================= 新增：FinMind 查詢區域 =================
 FINMIND_TOKEN = os.environ.get('FINMIND_TOKEN', '')
+FINMIND_URL = "https://api.finmindtrade.com/api/v4/data"
+FINMIND_RATE = float(os.environ.get('FINMIND_RATE', 5))           # 全域每秒請求上限
+DEEP_SCAN_SIZE = int(os.environ.get('DEEP_SCAN_SIZE', 200))       # 深度掃描的母體檔數
+DEEP_SCAN_WORKERS = int(os.environ.get('DEEP_SCAN_WORKERS', 8))   # 深度掃描並行數
+
+class RateLimiter:
+    """Token bucket 限速器：所有執行緒共用，平均每秒最多 rate 次請求"""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if http_archive.is_replaying(): return  # 重播時不需限速
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            run_report.count("rate_limit_waits")
+            run_report.count("rate_limit_wait_seconds", wait)
+            time.sleep(wait)
+
+FINMIND_LIMITER = RateLimiter(FINMIND_RATE)
+
+# 📊 每種 API 呼叫的耗時紀錄 (執行結束時輸出統計)
+CALL_TIMINGS = {}
+TIMING_LOCK = threading.Lock()
+
+def record_call_timing(name, elapsed):
+    with TIMING_LOCK:
+        CALL_TIMINGS.setdefault(name, []).append(elapsed)
+
+def report_call_timings():
+    if not CALL_TIMINGS: return
+    print("\n⏱️ API 呼叫耗時統計：")
+    for name, vals in sorted(CALL_TIMINGS.items()):
+        vals = sorted(vals)
+        p50 = vals[len(vals) // 2]
+        p95 = vals[min(len(vals) - 1, int(len(vals) * 0.95))]
+        print(f"   {name}: {len(vals)} 次, 合計 {sum(vals):.1f}s, p50 {p50:.2f}s, p95 {p95:.2f}s, 最慢 {vals[-1]:.2f}s")
+
+def finmind_get(params, timeout=10, retries=3, url=FINMIND_URL):
+    """共用 FinMind 請求：全域限速 + 指數退避重試，回傳 data 陣列 (url 供專用端點，例如分點進出)"""
+    name = params.get('dataset') or url.rsplit('/', 1)[-1]
+    last_error = None
+    for attempt in range(retries + 1):
+        FINMIND_LIMITER.acquire()
+        t0 = time.perf_counter()
+        try:
+            res = requests.get(url, params={**params, "token": FINMIND_TOKEN}, timeout=timeout)
+            record_call_timing(name, time.perf_counter() - t0)
+            # 429/402 (額度用盡) 與 5xx 屬於暫時性錯誤，退避後重試
+            if res.status_code == 200:
+                return res.json().get('data', [])
+            last_error = f"HTTP {res.status_code}"
+            if res.status_code not in (402, 429) and res.status_code < 500: break
+        except (requests.RequestException, ValueError) as e:
+            record_call_timing(f"{name} (失敗)", time.perf_counter() - t0)
+            last_error = e
+        if attempt < retries:
+            run_report.count("finmind_retries")
+            http_archive.pause(0.5 * (2 ** attempt) + random.uniform(0, 0.3))
+    raise RuntimeError(f"{name} 重試 {retries} 次仍失敗: {last_error}")
 
 def get_finmind_chips(code):
-    """查詢近 5 日法人買超張數 (抗長假 30 天版)"""
-    start = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-    url = "https://api.finmindtrade.com/api/v4/data"
+    """查詢近 5 日法人買超張數 (抗長假 30 天版)；已載入全市場法人索引時直接查表"""
+    if institutional_flows.has_flows(5):
+        return institutional_flows.get_flow_sum(code, days=5)
+    start = (trading_calendar.tw_now() - timedelta(days=30)).strftime('%Y-%m-%d')
     try:
-        res = requests.get(url, params={"dataset": "TaiwanStockInstitutionalInvestorsBuySell", "data_id": code, "start_date": start, "token": FINMIND_TOKEN}, timeout=10)
-        data = res.json().get('data', [])
+        data = finmind_get({"dataset": "TaiwanStockInstitutionalInvestorsBuySell", "data_id": code, "start_date": start})
         if not data: return 0, 0
         unique_dates = sorted(list(set([d['date'] for d in data])), reverse=True)
         target_dates = unique_dates[:5]
@@ -30,10 +115,11 @@ def get_finmind_chips(code):
     except: return 0, 0
 
 def get_finmind_revenue_yoy(code):
-    """查詢營收，自動對齊去年同月，並回傳開發者查核數據"""
+    """查詢營收，自動對齊去年同月，並回傳開發者查核數據；已載入全市場營收表時直接查表"""
+    indexed = revenue.get_revenue_yoy(code)
+    if indexed: return indexed
     # 抓取過去 480 天，確保涵蓋 16 個月以便對齊去年同期
-    start = (datetime.now() - timedelta(days=480)).strftime('%Y-%m-%d')
-    url = "https://api.finmindtrade.com/api/v4/data"
+    start = (trading_calendar.tw_now() - timedelta(days=480)).strftime('%Y-%m-%d')
     # 預設回傳格式 (現在改為回傳字典)
     default_res = {
         "yoy": 0.0, 
@@ -41,26 +127,26 @@ def get_finmind_revenue_yoy(code):
     }
     
     try:
-        res = requests.get(url, params={"dataset": "TaiwanStockMonthRevenue", "data_id": code, "start_date": start, "token": FINMIND_TOKEN}, timeout=10)
-        data = res.json().get('data', [])
+        data = finmind_get({"dataset": "TaiwanStockMonthRevenue", "data_id": code, "start_date": start})
         
         if not data: return default_res
             
         # 依日期由新到舊排序 (年、月雙重排序，徹底防呆)
         data.sort(key=lambda x: (x['revenue_year'], x['revenue_month']), reverse=True)
         
+        # 以 (年, 月) 建索引，查去年同月為 O(1)
+        by_period = {(row['revenue_year'], row['revenue_month']): row['revenue'] for row in data}
+        
         # 嘗試從最新一筆開始，往回找去年同月
-        for i in range(len(data)):
-            target = data[i]
+        for target in data:
             t_rev = target['revenue']
             t_y = target['revenue_year']
             t_m = target['revenue_month']
             
             # 尋找去年同月 (年份 -1 且 月份相同)
-            last_year_data = next((row for row in data if row['revenue_year'] == t_y - 1 and row['revenue_month'] == t_m), None)
+            l_rev = by_period.get((t_y - 1, t_m))
             
-            if last_year_data:
-                l_rev = last_year_data['revenue']
+            if l_rev is not None:
                 if l_rev == 0: continue
                 yoy = round(((t_rev - l_rev) / l_rev) * 100, 2)
                 
@@ -78,8 +164,104 @@ def get_finmind_revenue_yoy(code):
     except Exception as e:
         default_res["debug_info"]["status"] = f"Error: {str(e)}"
         return default_res
+
+def get_finmind_chips_history(code, days=5):
+    """近 days 日每日法人 (外資+投信) 淨買張數，新到舊"""
+    if institutional_flows.has_flows(days):
+        return [f + t for f, t in institutional_flows.get_flow_history(code, days)]
+    start = (trading_calendar.tw_now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    try:
+        data = finmind_get({"dataset": "TaiwanStockInstitutionalInvestorsBuySell", "data_id": code, "start_date": start})
+        daily = {}
+        for row in data:
+            if row['name'] in ('Foreign_Investor', 'Investment_Trust'):
+                daily[row['date']] = daily.get(row['date'], 0) + (row['buy'] - row['sell']) // 1000
+        return [daily[d] for d in sorted(daily, reverse=True)[:days]]
+    except: return []
+
+def deep_scan_candidates(candidates, checkpoint=None):
+    """並行深度掃描：每檔同時查法人與營收，並行數由 DEEP_SCAN_WORKERS 控制、速率由共用限速器控制
+    傳入 checkpoint 時，已完成的代號直接沿用，新完成的代號逐檔寫入檢查點"""
+    results = []
+    todo = [item for item in candidates if checkpoint is None or item['code'] not in checkpoint]
+    if checkpoint is not None:
+        run_report.cache("deep_scan_checkpoint", True, len(candidates) - len(todo))
+        run_report.cache("deep_scan_checkpoint", False, len(todo))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=DEEP_SCAN_WORKERS) as executor:
+        jobs = {
+            item['code']: (executor.submit(get_finmind_chips, item['code']), executor.submit(get_finmind_revenue_yoy, item['code']))
+            for item in todo
+        }
+        for item in candidates:
+            code = item['code']
+            if code not in jobs:
+                saved = checkpoint.get(code)
+                results.append((item, saved['acc_f'], saved['acc_t'], saved['yoy_data']))
+                continue
+            future_chips, future_yoy = jobs[code]
+            acc_f, acc_t = future_chips.result()
+            yoy_data = future_yoy.result()
+            results.append((item, acc_f, acc_t, yoy_data))
+            # 查詢失敗的結果不寫入檢查點，重跑時會再查一次
+            failed = str(yoy_data['debug_info'].get('status', '')).startswith('Error') or (
+                (acc_f, acc_t) == (0, 0) and not institutional_flows.has_flows(5))
+            if checkpoint is not None and not failed:
+                checkpoint.put(code, {"acc_f": acc_f, "acc_t": acc_t, "yoy_data": yoy_data})
+    return results
 # ========================================================
 
+# --- ISIN 公告解析 (lxml 直接掃表格，略過權證等非股票列) ---
+ISIN_URLS = [
+    "https://isin.twse.com.tw/isin/C_public.jsp?strMode=2", # 上市
+    "https://isin.twse.com.tw/isin/C_public.jsp?strMode=4"  # 上櫃
+]
+CODE_NAME_PATTERN = r'^([A-Z0-9]{4,6})\s+(.+)'
+
+def _maybe_listed(text):
+    """便宜的前置檢查：四萬多檔權證 (6 碼數字) 在這裡就被略過，不進入後續解析"""
+    return text.startswith('00') or (text[:4].isdigit() and text[4:5].isspace())
+
+def extract_isin_rows(html):
+    """以 lxml 掃描 ISIN 表格，只保留「四碼普通股」與「00 開頭 ETF」，回傳 DataFrame(code, name, sector)"""
+    doc = lxml.html.fromstring(html)
+    sector_idx = None
+    cells = []; sectors = []
+    for tr in doc.iter('tr'):
+        tds = tr.findall('td')
+        if not tds: continue
+        first = tds[0].text_content().strip()
+        if sector_idx is None:
+            # 表頭列決定產業別欄位位置
+            if "有價證券代號" in first:
+                headers = [td.text_content().strip() for td in tds]
+                sector_idx = next((i for i, h in enumerate(headers) if "產業別" in h), -1)
+            continue
+        if not _maybe_listed(first): continue
+        cells.append(first)
+        sectors.append(tds[sector_idx].text_content().strip() if 0 <= sector_idx < len(tds) else "未知產業")
+
+    if not cells:
+        return pd.DataFrame(columns=['code', 'name', 'sector'])
+    # 代號與名稱一次拆開 (向量化)
+    parts = pd.Series(cells).str.extract(CODE_NAME_PATTERN)
+    df = pd.DataFrame({'code': parts[0], 'name': parts[1].str.strip(), 'sector': sectors})
+    df['sector'] = df['sector'].replace('', "無")
+    code = df['code'].fillna('')
+    # 🛡️ 【關鍵過濾器】：四碼純數字 (一般股票) 或 00 開頭 (ETF)，排除權證與可轉債
+    keep = ((code.str.len() == 4) & code.str.isdigit()) | code.str.startswith('00')
+    return df[keep].reset_index(drop=True)
+
+def fetch_isin_listing(url):
+    res = requests.get(url, timeout=10)
+    return extract_isin_rows(res.text)
+
+# 菁英股的熱門產業標籤 (清單覆寫規則，也是「推薦 <產業>」索引的自訂關鍵字)
+CUSTOM_ELITE_DATA = {
+    "2330": "半導體", "2317": "AI伺服器", "2454": "IC設計", "2382": "AI伺服器",
+    "3231": "AI伺服器", "2376": "板卡", "2603": "航運", "2609": "航運",
+    "1519": "重電", "1503": "重電", "3017": "散熱", "3324": "散熱"
+}
+
 # --- 功能 1: 抓取所有股票代號與產業分類 (精準過濾版) ---
 def update_stock_list_json():
     print("🚀 [Task 1] 開始抓取所有股票代號與產業分類...")
@@ -99,91 +281,46 @@ def update_stock_list_json():
         "00679B":{"name": "元大美債20年", "type": "債券型ETF", "sector": "美債殖利率/降息預期"},
         "00687B":{"name": "國泰20年美債", "type": "債券型ETF", "sector": "美債殖利率/降息預期"}
     }
-
-    # 菁英股的熱門產業標籤
-    CUSTOM_ELITE_DATA = {
-        "2330": "半導體", "2317": "AI伺服器", "2454": "IC設計", "2382": "AI伺服器",
-        "3231": "AI伺服器", "2376": "板卡", "2603": "航運", "2609": "航運",
-        "1519": "重電", "1503": "重電", "3017": "散熱", "3324": "散熱"
-    }
-    
-    urls = [
-        "https://isin.twse.com.tw/isin/C_public.jsp?strMode=2", # 上市
-        "https://isin.twse.com.tw/isin/C_public.jsp?strMode=4"  # 上櫃
-    ]
     
     stock_map = {}
-
-    for url in urls:
-        try:
-            res = requests.get(url, timeout=10)
-            # 🔥 修復 Pandas 警告，使用 StringIO 包裝 HTML 內容
-            dfs = pd.read_html(StringIO(res.text))
-            df = dfs[0]
-            
-            df.columns = df.iloc[0]
-            df = df.iloc[1:]
-            
-            # 找出欄位名稱
-            col_code_name = [c for c in df.columns if "有價證券代號" in str(c)]
-            col_sector = [c for c in df.columns if "產業別" in str(c)]
-            if not col_code_name: continue
-            
-            name_col = col_code_name[0]
-            sector_col = col_sector[0] if col_sector else None
-            
-            for index, row in df.iterrows():
-                item = str(row[name_col]).strip()
-                sector_val = str(row[sector_col]).strip() if sector_col else "未知產業"
-                if sector_val == 'nan': sector_val = "無"
-                
-                # 抓出代號與名稱
-                match = re.match(r'^([A-Z0-9]{4,6})\s+(.+)', item)
-                if match:
-                    code = match.group(1)
-                    name = match.group(2).strip()
-                    
-                    # 🛡️ 【關鍵過濾器】：排除四萬檔權證與可轉債
-                    is_normal_stock = (len(code) == 4 and code.isdigit()) # 條件 1: 四碼純數字 (一般股票)
-                    is_etf = code.startswith('00')                        # 條件 2: 00 開頭 (ETF)
-                    
-                    if not (is_normal_stock or is_etf):
-                        continue # 不是一般股票也不是 ETF，直接跳過不收錄
-                    
-                    # 套用覆寫規則：若是菁英股，替換為我們自訂的熱門標籤
-                    if code in CUSTOM_ELITE_DATA:
-                        sector_val = CUSTOM_ELITE_DATA[code]
-                        
-                    stock_map[code] = {
-                        "name": name,
-                        "sector": sector_val,
-                        "type": "股票"
-                    }
-        except Exception as e:
-            print(f"⚠️ [Task 1] 抓取錯誤 ({url}): {e}")
+    # 上市、上櫃兩個 ISIN 頁面並行下載，lxml 解析時即略過權證等非股票列
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ISIN_URLS)) as executor:
+        futures = [(url, executor.submit(fetch_isin_listing, url)) for url in ISIN_URLS]
+        for url, future in futures:
+            try:
+                df = future.result()
+            except Exception as e:
+                print(f"⚠️ [Task 1] 抓取錯誤 ({url}): {e}")
+                df = None
+            if df is None or df.empty:
+                # 任一市場抓不到就保留舊清單，避免整個市場被誤判為下市
+                print("⚠️ [Task 1] 清單不完整，本次不更新 stock_list.json")
+                return None
+            # 套用覆寫規則：若是菁英股，替換為我們自訂的熱門標籤
+            sectors = df['code'].map(CUSTOM_ELITE_DATA).fillna(df['sector'])
+            for code, name, sector_val in zip(df['code'], df['name'], sectors):
+                stock_map[code] = {"name": name, "sector": sector_val, "type": "股票"}
 
     # 將 ETF 專屬資訊合併進去 (覆蓋掉爬蟲抓的生硬分類)
     for code, meta in CUSTOM_ETF_META.items():
         stock_map[code] = meta
 
-    print(f"✅ [Task 1] 完成，共過濾出 {len(stock_map)} 檔純股票與ETF -> 存入 stock_list.json")
+    print(f"✅ [Task 1] 完成，共過濾出 {len(stock_map)} 檔純股票與ETF")
 
-    # 存檔 1 (新版結構)
-    with open('stock_list.json', 'w', encoding='utf-8') as f:
-        json.dump(stock_map, f, ensure_ascii=False, indent=2)
+    # 與上一版比對，有變動才重寫 stock_list.json 並輸出差異檔
+    delta = stock_listing.save_if_changed(stock_map, trading_calendar.tw_now().strftime('%Y-%m-%d'))
+    if delta is None:
+        print("📇 [Task 1] 清單無變動，沿用現有 stock_list.json")
+    else:
+        print(f"📇 [Task 1] 清單已更新：新上市 {len(delta['added'])}、下市 {len(delta['removed'])}、變動 {len(delta['changed'])} 檔")
+        for code, change in list(delta['changed'].items())[:10]:
+            print(f"   ✏️ {code} {change['old'].get('name')} -> {change['new'].get('name')} ({change['new'].get('sector')})")
+    return delta
 
 # --- 功能 2: 抓取每日熱門飆股 (建立推薦菜單) ---
-def generate_daily_recommendations():
+def generate_daily_recommendations(snapshot=None, checkpoint=None):
     print("\n🚀 [Task 2] 開始分析每日熱門飆股...")
     
-    stock_meta = {}
-    try:
-        if os.path.exists('stock_list.json'):
-            with open('stock_list.json', 'r', encoding='utf-8') as f:
-                stock_meta = json.load(f)
-    except Exception as e:
-        print(f"⚠️ 讀取 stock_list.json 失敗: {e}")
-   
     # 🔥 [新增] 讀取剛剛產生的 stock_list.json，用來查詢名稱與產業別
     stock_meta = {}
     try:
@@ -193,241 +330,113 @@ def generate_daily_recommendations():
     except Exception as e:
         print(f"⚠️ 讀取 stock_list.json 失敗: {e}")
 
-    # 設定目標日期 (GitHub Actions 通常在 UTC 時間跑，台灣+8)
-    # 策略：抓取「最新收盤日」。如果今天是週六日，API 會自動給最近的週五資料，或我們指定日期。
-    # 這裡使用簡單策略：抓取當下台灣時間，如果是下午2點後抓今天，否則抓昨天
-    utc_now = datetime.now(timezone.utc)
-    tw_now = utc_now + timedelta(hours=8)
-    
-    if tw_now.hour < 14: 
-        target_date = (tw_now - timedelta(days=1)).strftime('%Y%m%d')
-    else:
-        target_date = tw_now.strftime('%Y%m%d')
-
-    print(f"📅 目標日期: {target_date}")
-    
-    url = f"https://www.twse.com.tw/exchangeReport/MI_INDEX?response=json&type=ALLBUT0999&date={target_date}"
-    
     final_list = []
     
     try:
-        res = requests.get(url, timeout=10)
-        data = res.json()
-        
-        if data.get('stat') != 'OK':
-            print(f"⚠️ [Task 2] 今日 ({target_date}) 無資料或休市: {data.get('stat')}")
-            # 若無資料(例如假日)，嘗試不帶日期參數，抓取「最新交易日」
-            print("🔄 嘗試抓取最新交易日資料...")
-            url_latest = "https://www.twse.com.tw/exchangeReport/MI_INDEX?response=json&type=ALLBUT0999"
-            res = requests.get(url_latest, timeout=10)
-            data = res.json()
+        # 📊 全市場快照 (上市+上櫃並行下載)；由主程式傳入時各產線共用同一份
+        if snapshot is None:
+            snapshot = market_snapshot.load_market_snapshot()
         
-        if data.get('stat') == 'OK':
-            # 解析資料表
-            target_table = None
-            # 尋找包含股價的表格 (通常是 data9 或 title 含 '每日收盤行情')
-            if 'tables' in data:
-                for table in data['tables']:
-                    if '證券代號' in table.get('fields', []) and '收盤價' in table.get('fields', []):
-                        target_table = table
-                        break
-            # 舊版 API 相容
-            elif 'data9' in data:
-                target_table = {'data': data['data9'], 'fields': data.get('fields9', [])}
-
-            if target_table:
-                raw_data = target_table['data']
-                fields = target_table['fields']
-                
-                # 動態找索引位置
-                try:
-                    idx_code = fields.index("證券代號")
-                    idx_vol = fields.index("成交股數")
-                    idx_turnover = fields.index("成交金額") # 🔥 新增成交金額
-                    idx_price = fields.index("收盤價")
-                    idx_sign = fields.index("漲跌(+/-)")
-                except:
-                    idx_code, idx_vol, idx_turnover, idx_price, idx_sign = 0, 2, 4, 8, 9 # 預設值
-
-                candidates = []
-                for row in raw_data:
-                    try:
-                        code = row[idx_code]
-                        # 過濾權證、ETF(00開頭)、DR股(91開頭) -> 若你想保留 ETF，可移除 00 判斷
-                        if len(code) > 4 or code.startswith('91') or code.startswith('00'): continue 
-                        
-                        price_str = row[idx_price].replace(',', '')
-                        turnover_str = row[idx_turnover].replace(',', '')
-                        
-                        if price_str == '--' or turnover_str == '--': continue
-                        price = float(price_str)
-                        turnover = float(turnover_str)
-                        
-                        # 🔥 選股邏輯：價格 > 10元
-                        if price < 10: continue
-                        
-                        sign = row[idx_sign]
-                        is_up = ('+' in sign) or ('red' in sign) # 簡單判斷漲勢
-                        
-                        # 🔥 動能濾網升級：收紅，且單日成交金額大於 3 億元 (300,000,000)
-                        if is_up and turnover > 300000000: 
-                            # ⚠️ 這裡一定要把 price 存進來，FinMind 才能算金額！
-                            candidates.append({"code": code, "turnover": turnover, "price": price, "exchange": "上市"})
-                    except: continue
-
-                # 👇👇👇 從這裡開始替換【上櫃 (TPEx) 爬蟲】 👇👇👇
-                print(f"🔄 正在尋找最新上櫃 (TPEx) 行情...")
-                
-                data_otc = None
-                valid_roc_date = None
-                base_date = datetime.strptime(target_date, '%Y%m%d')
-                
-                # 🛡️ 加上 User-Agent 偽裝成瀏覽器，避免被櫃買中心阻擋
-                headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
+        if snapshot is not None and not snapshot.empty:
+            target_date = snapshot.attrs['date'].strftime('%Y%m%d')
+            print(f"📅 資料日期: {target_date}")
+            
+            # 🔥 選股邏輯 (向量化)：排除權證/ETF/DR，價格 >= 10 元，收紅且單日成交金額大於 3 億元
+            mask = (
+                market_snapshot.common_stock_mask(snapshot)
+                & (snapshot['close'] >= 10)
+                & snapshot['is_up']
+                & (snapshot['turnover'] > 300000000)
+            )
+            passed = snapshot.loc[mask, ['code', 'turnover', 'close', 'exchange']]
+            # ⚠️ 這裡一定要把 price 存進來，FinMind 才能算金額！
+            candidates = passed.rename(columns={'close': 'price'}).to_dict('records')
+            tpex_count = int((passed['exchange'] == '上櫃').sum())
+            run_report.funnel("daily", "market", len(candidates))
+            print(f"✅ 上市櫃收紅且成交金額 > 3 億：共 {len(candidates)} 檔 (其中上櫃 {tpex_count} 檔)")
+            
+            # 🔥 1. 依「成交金額 (turnover)」排序，取前 DEEP_SCAN_SIZE 檔母體
+            candidates.sort(key=lambda x: x['turnover'], reverse=True)
+            top_n = candidates[:DEEP_SCAN_SIZE]
+            
+            # 📈 全市場營收一次載入 (本地快取，每月只下載一次)，後續 YoY 查詢不需再打 API
+            if not revenue.has_revenue():
+                revenue.load_revenue_table()
+            
+            # 🏦 全市場法人索引可用時，籌碼查詢為 O(1)：改對「所有」候選做籌碼預篩，只有達標者才查營收
+            # (產線模式下由 flows 階段預先載入，這裡直接沿用)
+            if institutional_flows.has_flows(5) or institutional_flows.load_market_flows(days=5, base_date=snapshot.attrs['date']) >= 5:
+                top_n = []
+                for x in candidates:
+                    acc_f, acc_t = institutional_flows.get_flow_sum(x['code'], days=5)
+                    if (acc_f + acc_t) * 1000 * x['price'] > 300000000: top_n.append(x)
+                print(f"🏦 全市場籌碼預篩：{len(candidates)} 檔候選中 {len(top_n)} 檔法人買超 > 3 億")
+            
+            # 📊 [新增] 統計母體的板塊分佈
+            tw_count = sum(1 for x in top_n if x.get('exchange') == '上市')
+            otc_count = sum(1 for x in top_n if x.get('exchange') == '上櫃')
+            
+            run_report.funnel("daily", "chips_prefilter", len(top_n))
+            print(f"✅ [Task 2] 第一階段篩選完成，取得 {len(top_n)} 檔強勢資金股 (上市: {tw_count} 檔 / 上櫃: {otc_count} 檔)。")
+            print(f"啟動 FinMind 深度掃描 (並行 {DEEP_SCAN_WORKERS}、限速 {FINMIND_RATE} 次/秒)...")
+            final_list = []
+            scan_start = time.perf_counter()
+            
+            # 🔥 2. 並行調查基本面與籌碼 (逐檔檢查點：同一資料日重跑時跳過已查過的代號)
+            if checkpoint is None:
+                checkpoint = pipeline.Checkpoint('deep_scan', snapshot.attrs['date'].isoformat())
+            for item, acc_f, acc_t, yoy_data in deep_scan_candidates(top_n, checkpoint):
+                code = item['code']
+                turnover = item['turnover']
+                price = item['price']
                 
-                # 🔥 主動往回找最近的交易日 (最多找 6 天)
-                for i in range(6):
-                    check_date = base_date - timedelta(days=i)
-                    roc_year = check_date.year - 1911
-                    roc_date = f"{roc_year}/{check_date.strftime('%m/%d')}"
-                    
-                    url_otc = f"https://www.tpex.org.tw/web/stock/aftertrading/otc_quotes_no1430/stk_wn1430_result.php?l=zh-tw&d={roc_date}&se=EW"
-                    try:
-                        res_otc = requests.get(url_otc, headers=headers, timeout=10)
-                        temp_data = res_otc.json()
-                        
-                        # 🌟 適應 TPEx 新版 API 結構 (tables)
-                        if 'tables' in temp_data and temp_data['tables']:
-                            if 'data' in temp_data['tables'][0] and len(temp_data['tables'][0]['data']) > 0:
-                                data_otc = temp_data
-                                valid_roc_date = roc_date
-                                print(f"✅ 成功取得上櫃資料，實際資料日期: {valid_roc_date}")
-                                break
-                    except Exception as e:
-                        print(f"⚠️ {roc_date} 抓取失敗，嘗試前一天... ({e})")
-                    
-                    time.sleep(0.5)
-
-                tpex_count = 0  # 📊 [新增] 用來統計有幾檔上櫃股通過 3 億門檻
-
-                # 開始解析新版上櫃資料
-                if data_otc and 'tables' in data_otc and data_otc['tables']:
-                    table = data_otc['tables'][0]
-                    fields = [str(f).strip() for f in table.get('fields', [])]
-                    raw_data = table.get('data', [])
-                    
-                    try:
-                        idx_code = fields.index("代號")
-                        idx_price = fields.index("收盤")
-                        idx_turnover = fields.index("成交金額(元)")
-                        idx_sign = fields.index("漲跌")
-                    except:
-                        idx_code, idx_price, idx_turnover, idx_sign = 0, 2, 8, 3
-                    
-                    for row in raw_data:
-                        try:
-                            code = str(row[idx_code]).strip()
-                            if len(code) > 4 or code.startswith('91') or code.startswith('00'): continue 
-                            
-                            price_str = str(row[idx_price]).replace(',', '').strip()
-                            turnover_str = str(row[idx_turnover]).replace(',', '').strip() 
-                            
-                            if price_str in ['----', '--', '', '除息', '除權'] or turnover_str in ['--', '', '0']: continue
-                            
-                            price = float(price_str)
-                            turnover = float(turnover_str)
-                            if price < 10: continue
-                            
-                            # 🔥 強化版漲跌判斷：處理沒有加號的隱藏紅K
-                            raw_sign = str(row[idx_sign]).replace(',', '').strip()
-                            is_up = False
-                            if '+' in raw_sign or 'red' in raw_sign:
-                                is_up = True
-                            else:
-                                try:
-                                    clean_sign = re.sub(r'[^\d.-]', '', raw_sign)
-                                    if clean_sign and float(clean_sign) > 0:
-                                        is_up = True
-                                except: pass
-                            
-                            # 條件：收紅 且 成交金額 > 3億
-                            if is_up and turnover > 300000000: 
-                                candidates.append({"code": code, "turnover": turnover, "price": price, "exchange": "上櫃"})
-                                tpex_count += 1
-                        except: continue
-                    print(f"✅ 上櫃 (TPEx) 飆股已成功合併至候選池！(共 {tpex_count} 檔通過 3 億門檻)")
-                else:
-                    print("❌ 仍無法取得上櫃資料，請檢查 API 狀態。")
-                # 👆👆👆 替換結束 👆👆👆
-                            
-                # 🔥 1. 依「成交金額 (turnover)」排序，取前 50 檔母體
-                candidates.sort(key=lambda x: x['turnover'], reverse=True)
-                top_50 = candidates[:50]
+                # ⚠️ 這裡接收剛剛寫好的新版字典
+                yoy = yoy_data['yoy']
                 
-                # 📊 [新增] 統計 Top 50 的板塊分佈
-                tw_count = sum(1 for x in top_50 if x.get('exchange') == '上市')
-                otc_count = sum(1 for x in top_50 if x.get('exchange') == '上櫃')
+                chips_sum = acc_f + acc_t
+                buy_value = chips_sum * 1000 * price
+                buy_value_y = round(buy_value / 100000000, 1)
                 
-                print(f"✅ [Task 2] 第一階段篩選完成，取得 50 檔強勢資金股 (上市: {tw_count} 檔 / 上櫃: {otc_count} 檔)。")
-                print("啟動 FinMind 深度掃描...")
-                final_list = []
+                print(f"掃描 {code}: YoY={yoy}%, 法人買超={buy_value_y}億")
                 
-                # 🔥 2. 針對 50 檔逐一調查基本面與籌碼
-                for item in top_50:
-                    code = item['code']
-                    turnover = item['turnover']
-                    price = item['price']
-                    
-                    acc_f, acc_t = get_finmind_chips(code)
-                    
-                    # ⚠️ 這裡接收剛剛寫好的新版字典
-                    yoy_data = get_finmind_revenue_yoy(code) 
-                    yoy = yoy_data['yoy']
+                # 🔥 3. 分析師終極濾網：營收 YoY > 10% 且 法人買超金額 > 3億
+                # 👇👇👇 從這裡開始替換 👇👇👇
+                if yoy > 10 and buy_value > 300000000:
+                    meta_info = stock_meta.get(code, {})
+                    stock_name = meta_info.get('name', '未知名稱')
+                    stock_sector = meta_info.get('sector', '未知產業')
                     
-                    chips_sum = acc_f + acc_t
-                    buy_value = chips_sum * 1000 * price
-                    buy_value_y = round(buy_value / 100000000, 1)
-                    
-                    print(f"掃描 {code}: YoY={yoy}%, 法人買超={buy_value_y}億")
-                    time.sleep(0.5) # 避免被 API 封鎖
-                    
-                    # 🔥 3. 分析師終極濾網：營收 YoY > 10% 且 法人買超金額 > 3億
-                    # 👇👇👇 從這裡開始替換 👇👇👇
-                    if yoy > 10 and buy_value > 300000000:
-                        meta_info = stock_meta.get(code, {})
-                        stock_name = meta_info.get('name', '未知名稱')
-                        stock_sector = meta_info.get('sector', '未知產業')
-                        
-                        # 取得剛剛貼上的上市/上櫃標籤，並格式化日期 (YYYY-MM-DD)
-                        stock_exchange = item.get('exchange', '未知')
-                        date_str = f"{target_date[:4]}-{target_date[4:6]}-{target_date[6:8]}"
-
-                        final_list.append({
-                            "date": date_str,          # ✅ 新增：資料日期
-                            "code": code,
-                            "name": stock_name,
-                            "exchange": stock_exchange,# ✅ 新增：上市或上櫃
-                            "sector": stock_sector,
-                            "price": price,
-                            "turnover": turnover,
-                            "chips_display": f"{chips_sum}張 ({buy_value_y}億)",
-                            "buy_value": buy_value,
-                            "yoy": yoy,
-                            "tag": "外資大買" if acc_f > acc_t else "投信作帳",
-                            "debug_info": yoy_data['debug_info']
-                        })
-                    # 👆👆👆 替換到這裡結束 👆👆👆
-                
-                # 🔥 4. 將過關的菁英，依照「買超金額」由大到小排序
-                final_list.sort(key=lambda x: x['buy_value'], reverse=True)
-                
-                # 為了避免 JSON 太大，我們只保留最強的前 15 檔給 app.py 抽樣
-                final_list = final_list[:15]
-                print(f"🎉 掃描結束！共 {len(final_list)} 檔符合【高潛力成長飆股】終極標準。")
-            else:
-                print("⚠️ [Task 2] 找不到對應的資料表")
+                    # 取得剛剛貼上的上市/上櫃標籤，並格式化日期 (YYYY-MM-DD)
+                    stock_exchange = item.get('exchange', '未知')
+                    date_str = f"{target_date[:4]}-{target_date[4:6]}-{target_date[6:8]}"
+
+                    final_list.append({
+                        "date": date_str,          # ✅ 新增：資料日期
+                        "code": code,
+                        "name": stock_name,
+                        "exchange": stock_exchange,# ✅ 新增：上市或上櫃
+                        "sector": stock_sector,
+                        "price": price,
+                        "turnover": turnover,
+                        "chips_display": f"{chips_sum}張 ({buy_value_y}億)",
+                        "buy_value": buy_value,
+                        "yoy": yoy,
+                        "tag": "外資大買" if acc_f > acc_t else "投信作帳",
+                        "debug_info": yoy_data['debug_info']
+                    })
+                # 👆👆👆 替換到這裡結束 👆👆👆
+            
+            # 🔥 4. 將過關的菁英，依照「買超金額」由大到小排序
+            final_list.sort(key=lambda x: x['buy_value'], reverse=True)
+            
+            # 為了避免 JSON 太大，我們只保留最強的前 15 檔給 app.py 抽樣
+            run_report.funnel("daily", "deep_scan", len(final_list))
+            final_list = final_list[:15]
+            run_report.funnel("daily", "final", len(final_list))
+            print(f"⏱️ 深度掃描耗時 {time.perf_counter() - scan_start:.1f} 秒")
+            print(f"🎉 掃描結束！共 {len(final_list)} 檔符合【高潛力成長飆股】終極標準。")
         else:
-            print("⚠️ [Task 2] API 回傳狀態非 OK")
+            print("⚠️ [Task 2] 無法取得全市場行情")
 
     except Exception as e:
         print(f"❌ [Task 2] 發生錯誤: {e}")
@@ -442,186 +451,155 @@ def generate_daily_recommendations():
             print("💾 已儲存 daily_recommendations.json")
     else:
         print("⚠️ 本次未產出新名單，未覆蓋檔案。")
-
-if __name__ == "__main__":
-    # 執行兩個任務
-    update_stock_list_json()
-    generate_daily_recommendations()
+    return final_list
 
 #----------3/13增加左側交易-------------
+LAYER2_LOOKBACK = 80   # 多取幾天，扣掉停牌日後仍要湊滿 60 根 K 棒
+
+def last_valid_bars(matrix, n):
+    """每列 (代號) 取最後 n 根非 NaN 的值 (停牌日不算)，不足 n 根的列會含 NaN"""
+    order = np.argsort(~np.isnan(matrix), axis=1, kind='stable')  # NaN 排前面，其餘保持時間順序
+    return np.take_along_axis(matrix, order, axis=1)[:, -n:]
+
+def screen_left_side_layer2(closes, highs, lows, volumes):
+    """第二層批次篩選：輸入 (代號數 × 天數) 矩陣 (舊到新)，四個條件全部以陣列運算完成"""
+    valid = ~np.isnan(closes)
+    closes = last_valid_bars(closes, 60)
+    highs = last_valid_bars(np.where(valid, highs, np.nan), 60)
+    lows = last_valid_bars(np.where(valid, lows, np.nan), 60)
+    volumes = last_valid_bars(np.where(valid, volumes, np.nan), 60)
+    enough = ~np.isnan(closes).any(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        close_today = closes[:, -1]
+        ma60 = closes.mean(axis=1)
+        bias60 = (close_today - ma60) / ma60
+        ma20_vol = volumes[:, -20:].mean(axis=1)
+        recent_10_low = lows[:, -10:].min(axis=1)
+        amplitude = (highs[:, -10:].max(axis=1) - recent_10_low) / recent_10_low
+        ret_5 = (close_today - closes[:, -5]) / closes[:, -5]
+
+        conditions = {
+            "A 季線負乖離<-5%": bias60 < -0.05,
+            "B 量縮<20日均量6成": volumes[:, -1] < ma20_vol * 0.6,
+            "C 10日振幅<5%": amplitude < 0.05,
+            "D 5日漲幅<3%": ret_5 < 0.03,
+        }
+
+    passed = enough.copy()
+    counts = {}; funnel = {}
+    for name, cond in conditions.items():
+        counts[name] = int((enough & cond).sum())
+        passed &= cond
+        funnel[name] = int(passed.sum())
+    return {"passed": passed, "bias60": bias60, "amplitude": amplitude, "ma60": ma60, "counts": counts, "funnel": funnel}
+
 # ========================================================
 # 🔥 新增功能 3: 【左側交易：三層漏斗價值雷達】(100% 獨立產線)
 # ========================================================
-def generate_left_side_value():
+def generate_left_side_value(providers=None, output_path='left_side_value.json'):
     print("\n🛡️ [Task 3] 啟動左側交易：重裝價值雷達 (三層漏斗過濾)...")
+    if providers is None:
+        providers = LiveProviders(revenue_lookup=get_finmind_revenue_yoy, chips_lookup=get_finmind_chips_history)
     
     # 讀取基礎股票池
-    stock_meta = {}
     try:
-        with open('stock_list.json', 'r', encoding='utf-8') as f:
-            stock_meta = {k: v for k, v in json.load(f).items() if v.get('type') == '股票'}
+        stock_meta = {k: v for k, v in providers.stock_meta().items() if v.get('type') == '股票'}
     except Exception as e:
         print(f"⚠️ 讀取 stock_list.json 失敗，左側雷達中止: {e}")
         return
 
     # ---------------------------------------------------------
     # 🌊 第一層：大數據降維 (流動性 5,000萬 ~ 3億)
-    # 為了 100% 不干擾右側，我們在左側雷達內自己發動一次輕量級爬蟲
+    # 直接使用主程式共用的全市場快照，以向量化條件一次篩完
     # ---------------------------------------------------------
     print("🌊 [第一層] 大數據降維：尋找流動性 5000萬~3億 的潛伏股...")
     layer1_candidates = []
+    trade_day = None
     
-    # 1. 抓取上市 (TWSE) 最新交易日
     try:
-        res = requests.get("https://www.twse.com.tw/exchangeReport/MI_INDEX?response=json&type=ALLBUT0999", timeout=10)
-        data = res.json()
-        if data.get('stat') == 'OK':
-            target_table = next((t for t in data.get('tables', []) if '證券代號' in t.get('fields', [])), None)
-            if not target_table and 'data9' in data:
-                target_table = {'data': data['data9'], 'fields': data.get('fields9', [])}
-
-            if target_table:
-                fields = target_table['fields']
-                idx_code = fields.index("證券代號") if "證券代號" in fields else 0
-                idx_turnover = fields.index("成交金額") if "成交金額" in fields else 4
-                idx_price = fields.index("收盤價") if "收盤價" in fields else 8
-
-                for row in target_table['data']:
-                    code = row[idx_code]
-                    if code not in stock_meta: continue
-                    try:
-                        turnover = float(row[idx_turnover].replace(',', ''))
-                        price = float(row[idx_price].replace(',', ''))
-                        # 🔥 條件：成交金額 5000萬 ~ 3億，且股價 > 10元
-                        if 50000000 <= turnover <= 300000000 and price >= 10:
-                            layer1_candidates.append({"code": code, "price": price, "market": "TW"})
-                    except: pass
+        snapshot = providers.snapshot()
+        if snapshot is not None and not snapshot.empty:
+            trade_day = snapshot.attrs['date']
+            # 🔥 條件：一般股票、成交金額 5000萬 ~ 3億，且股價 > 10元
+            mask = (
+                snapshot['code'].isin(stock_meta.keys())
+                & snapshot['turnover'].between(50000000, 300000000)
+                & (snapshot['close'] >= 10)
+            )
+            layer1_candidates = snapshot.loc[mask, ['code', 'close', 'market']].rename(columns={'close': 'price'}).to_dict('records')
     except Exception as e:
-        print(f"⚠️ TWSE 第一層抓取錯誤: {e}")
-
-    # 2. 抓取上櫃 (TPEx) 最新交易日
-    try:
-        base_date = datetime.now(timezone.utc) + timedelta(hours=8)
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        for i in range(6): # 往回找最近的交易日
-            check_date = base_date - timedelta(days=i)
-            roc_date = f"{check_date.year - 1911}/{check_date.strftime('%m/%d')}"
-            url_otc = f"https://www.tpex.org.tw/web/stock/aftertrading/otc_quotes_no1430/stk_wn1430_result.php?l=zh-tw&d={roc_date}&se=EW"
-            res_otc = requests.get(url_otc, headers=headers, timeout=10)
-            temp_data = res_otc.json()
-            if 'tables' in temp_data and temp_data['tables'] and len(temp_data['tables'][0].get('data', [])) > 0:
-                table = temp_data['tables'][0]
-                fields = [str(f).strip() for f in table.get('fields', [])]
-                idx_code = fields.index("代號") if "代號" in fields else 0
-                idx_turnover = fields.index("成交金額(元)") if "成交金額(元)" in fields else 8
-                idx_price = fields.index("收盤") if "收盤" in fields else 2
-                
-                for row in table['data']:
-                    code = str(row[idx_code]).strip()
-                    if code not in stock_meta: continue
-                    try:
-                        price_str = str(row[idx_price]).replace(',', '').strip()
-                        turnover_str = str(row[idx_turnover]).replace(',', '').strip()
-                        if price_str in ['----', '--', '除息', '除權'] or turnover_str in ['--', '']: continue
-                        turnover = float(turnover_str)
-                        price = float(price_str)
-                        # 🔥 條件：成交金額 5000萬 ~ 3億，且股價 > 10元
-                        if 50000000 <= turnover <= 300000000 and price >= 10:
-                            layer1_candidates.append({"code": code, "price": price, "market": "TWO"})
-                    except: pass
-                break
-            time.sleep(0.3)
-    except Exception as e:
-        print(f"⚠️ TPEx 第一層抓取錯誤: {e}")
+        print(f"⚠️ 第一層全市場行情錯誤: {e}")
 
+    trade_day = trade_day or trading_calendar.latest_close_date()
+    run_report.funnel("left_side", "layer1", len(layer1_candidates))
     print(f"✅ 第一層降維完畢，全市場 2000 檔中，共 {len(layer1_candidates)} 檔符合流動性門檻，進入第二層。")
 
     # ---------------------------------------------------------
-    # 📉 第二層：位階與動能過濾 (yfinance 抓 60 天 K 線)
+    # 📉 第二層：位階與動能過濾 (整批取 60 天 K 線矩陣，本地日K庫優先)
     # ---------------------------------------------------------
-    print("📉 [第二層] 啟動 yfinance 計算：尋找負乖離、量縮窒息、低波築底...")
+    print("📉 [第二層] 整批讀取日K：尋找負乖離、量縮窒息、低波築底...")
     layer2_candidates = []
-    
-    for item in layer1_candidates:
-        code = item['code']
+    codes = [x['code'] for x in layer1_candidates]
+    if codes:
+        markets = {x['code']: x['market'] for x in layer1_candidates}
         try:
-            ticker = yf.Ticker(f"{code}.{item['market']}")
-            df = ticker.history(period="3mo") # 抓約 60 個交易日
-            if len(df) < 60: continue
-
-            closes = df['Close'].tolist()
-            lows = df['Low'].tolist()
-            highs = df['High'].tolist()
-            volumes = df['Volume'].tolist()
-
-            close_today = closes[-1]
-            ma60 = sum(closes[-60:]) / 60
-            bias60 = (close_today - ma60) / ma60
-
-            # 🛑 條件 A: 季線負乖離 (必須小於 -5%)
-            if bias60 >= -0.05: continue
-
-            # 🛑 條件 B: 量縮窒息 (今日成交量 < 20日均量 * 0.6)
-            vol_today = volumes[-1]
-            ma20_vol = sum(volumes[-20:]) / 20
-            if vol_today >= ma20_vol * 0.6: continue
-
-            # 🛑 條件 C: 低波震盪 (近 10 日高低點振幅 < 5%，代表跌勢趨緩築底中)
-            recent_10_high = max(highs[-10:])
-            recent_10_low = min(lows[-10:])
-            amplitude = (recent_10_high - recent_10_low) / recent_10_low
-            if amplitude >= 0.05: continue
-
-            # 🛑 條件 D: 籌碼逆向發動前 (近 5 日股價漲幅 < 3%)
-            if (close_today - closes[-5]) / closes[-5] >= 0.03: continue
-
-            # 通過第二層嚴苛考驗！
-            item['bias60'] = bias60
-            item['amplitude'] = amplitude
-            item['ma60'] = ma60
-            layer2_candidates.append(item)
-            print(f"   🎯 鎖定符合技術特徵標的: {code}")
-            
-        except Exception: pass
-        time.sleep(0.1) # 保護 yfinance 不被鎖 IP
-
+            window = providers.bar_matrix(codes, LAYER2_LOOKBACK, markets)
+        except Exception as e:
+            print(f"⚠️ 第二層日K取得失敗: {e}")
+            window = None
+        if window is not None and window['close'].shape[1] > 0:
+            screen = screen_left_side_layer2(window['close'], window['high'], window['low'], window['volume'])
+            print("   📊 各條件通過檔數 (單獨 / 累計)：" + "、".join(
+                f"{name} {screen['counts'][name]} / {screen['funnel'][name]}" for name in screen['counts']))
+            for i in np.flatnonzero(screen['passed']):
+                # 通過第二層嚴苛考驗！
+                item = layer1_candidates[i]
+                item['bias60'] = float(screen['bias60'][i])
+                item['amplitude'] = float(screen['amplitude'][i])
+                item['ma60'] = float(screen['ma60'][i])
+                layer2_candidates.append(item)
+                print(f"   🎯 鎖定符合技術特徵標的: {item['code']}")
+
+    run_report.funnel("left_side", "layer2", len(layer2_candidates))
     print(f"✅ 第二層過濾完畢，剩餘 {len(layer2_candidates)} 檔進入終極基本面查核。")
 
     # ---------------------------------------------------------
-    # 🏦 第三層：聰明錢與基本面定錨 (FinMind 深查)
+    # 🏦 第三層：聰明錢與基本面定錨 (全市場表批次查核)
+    # 依「最便宜的條件先篩」排序：EPS -> 營收 -> 籌碼，每一步都是整批查詢
     # ---------------------------------------------------------
-    print("🏦 [第三層] 啟動 FinMind 查核：法人連買、EPS>0、營收 YoY>0...")
+    print("🏦 [第三層] 批次查核：法人連買、EPS>0、營收 YoY>0...")
     final_list = []
-    
-    for item in layer2_candidates:
-        code = item['code']
-        
-        # 1. 查 EPS 與 殖利率
-        eps, yield_rate = get_finmind_fundamentals(code, item['price'])
-        if eps <= 0: continue # 🔴 淘汰：近一季虧損股
-        
-        # 2. 查營收 YoY
-        yoy_data = get_finmind_revenue_yoy(code)
-        yoy = yoy_data['yoy']
-        if yoy <= 0: continue # 🔴 淘汰：營收衰退股
-        
-        # 3. 查法人籌碼 (近 5 天內，有 3 天以上買超)
-        chips_history = get_finmind_chips_history(code, days=5)
-        buy_days = sum(1 for x in chips_history if x > 0)
+    codes = [x['code'] for x in layer2_candidates]
+    fundamentals = providers.fundamentals(codes) if codes else {}
+    # 🔴 淘汰：近一季虧損股
+    codes = [c for c in codes if fundamentals[c]['eps'] > 0]
+    revenue_data = providers.revenue_yoy(codes) if codes else {}
+    # 🔴 淘汰：營收衰退股
+    codes = [c for c in codes if revenue_data[c]['yoy'] > 0]
+    # 查法人籌碼 (近 5 天內，有 3 天以上買超)
+    chips = providers.chip_history(codes, 5) if codes else {}
+    run_report.funnel("left_side", "fundamentals", len(codes))
+    print(f"   📊 EPS>0 且營收 YoY>0：{len(codes)} 檔進入籌碼查核")
+
+    by_code = {x['code']: x for x in layer2_candidates}
+    for code in codes:
+        item = by_code[code]
+        buy_days = sum(1 for x in chips.get(code, []) if x > 0)
         
         if buy_days >= 3:
             # 🏆 完美通過三層漏斗！
             final_list.append({
-                "date": datetime.now(timezone.utc).strftime('%Y-%m-%d'),
+                "date": trade_day.strftime('%Y-%m-%d'),
                 "code": code,
                 "name": stock_meta[code]['name'],
                 "sector": stock_meta[code]['sector'],
                 "price": item['price'],
                 "bias60": f"{item['bias60']*100:.1f}%",
                 "amplitude": f"{item['amplitude']*100:.1f}%",
-                "eps": eps,
-                "yield_rate": yield_rate,
-                "yoy": yoy,
+                "eps": fundamentals[code]['eps'],
+                "yield_rate": fundamentals[code]['yield_rate'],
+                "yoy": revenue_data[code]['yoy'],
                 "buy_days_in_5": buy_days,
                 "tag": "左側黃金坑"
             })
@@ -630,17 +608,228 @@ def generate_left_side_value():
     # ---------------------------------------------------------
     # 📦 結算與獨立存檔
     # ---------------------------------------------------------
+    run_report.funnel("left_side", "final", len(final_list))
     if final_list:
         # 依照負乖離率由深到淺排序 (越便宜越前面)
         final_list.sort(key=lambda x: float(x['bias60'].replace('%', '')))
-        with open('left_side_value.json', 'w', encoding='utf-8') as f:
+        with open(output_path, 'w', encoding='utf-8') as f:
             json.dump(final_list, f, ensure_ascii=False, indent=4)
-        print(f"💾 任務完成！已儲存 left_side_value.json (共 {len(final_list)} 檔無敵黃金坑達標)")
+        print(f"💾 任務完成！已儲存 {output_path} (共 {len(final_list)} 檔無敵黃金坑達標)")
     else:
         print("⚠️ 本次掃描無任何股票通過嚴格的三層漏斗 (市場可能無超跌錯殺股)。")
+    return final_list
+
+# ========================================================
+# 🏅 全市場評分索引 (供「推薦 <產業>」直接查表)
+# 不只保留前 15 名：所有達標或接近達標的股票都給一個 0~100 的綜合分數，
+# 再依產業關鍵字 / 自訂標籤建立倒排索引，代號清單預先依分數排好。
+# ========================================================
+SCORE_INDEX_SIZE = int(os.environ.get('SCORE_INDEX_SIZE', 300))   # 發布的評分名單上限
+SCORE_MIN_TURNOVER = 100000000                                     # 納入評分的最低成交金額 (1 億)
+SCORE_WEIGHTS = {"buy_value": 0.4, "yoy": 0.3, "turnover": 0.2, "change_pct": 0.1}
+
+def sector_keywords(sector):
+    """產業字串 -> 索引關鍵字：原字串、以 / 分隔的子標籤、去掉「業」「工業」字尾的簡稱"""
+    keys = set()
+    for part in [sector] + sector.split('/'):
+        group = stock_listing.sector_group(part)
+        if group: keys.update({part.strip(), group})
+    return keys
+
+def build_score_index(snapshot, stock_meta=None):
+    """向量化計算全市場綜合分數，回傳 {"rows": 依分數排序的名單, "sector_index": {關鍵字: [代號...]}}"""
+    if stock_meta is None:
+        stock_meta = stock_listing.load_stock_list()
+    universe = snapshot[
+        market_snapshot.common_stock_mask(snapshot)
+        & (snapshot['close'] >= 10)
+        & (snapshot['turnover'] >= SCORE_MIN_TURNOVER)
+    ].set_index('code')
+    flows = institutional_flows.flow_sum_frame(days=5).reindex(universe.index).fillna(0)
+    yoy = revenue.REVENUE_TABLE['yoy'] if revenue.has_revenue() else pd.Series(dtype=float)
+
+    df = pd.DataFrame({
+        'price': universe['close'],
+        'turnover': universe['turnover'],
+        'change_pct': (universe['change'] / (universe['close'] - universe['change']).replace(0, np.nan) * 100).fillna(0),
+        'is_up': universe['is_up'],
+        'acc_f': flows['foreign'].astype(int),
+        'acc_t': flows['trust'].astype(int),
+        'yoy': yoy.reindex(universe.index),
+    })
+    df['buy_value'] = (df['acc_f'] + df['acc_t']) * 1000 * df['price']
+    # 與每日推薦相同的終極標準
+    df['passed'] = df['is_up'] & (df['turnover'] > 300000000) & (df['yoy'] > 10) & (df['buy_value'] > 300000000)
+    # 接近達標：法人買超且營收成長
+    df = df[df['passed'] | ((df['buy_value'] > 0) & (df['yoy'] > 0))]
+    if df.empty: return {"rows": [], "sector_index": {}}
+
+    score = sum(df[col].rank(pct=True) * w for col, w in SCORE_WEIGHTS.items())
+    df['score'] = (score * 100).round(1)
+    df = df.sort_values(['passed', 'score'], ascending=False).head(SCORE_INDEX_SIZE)
+
+    rows = []
+    sector_index = {}
+    for code, r in df.iterrows():
+        meta = stock_meta.get(code, {})
+        sector = meta.get('sector', '未知產業')
+        chips_sum = int(r['acc_f'] + r['acc_t'])
+        rows.append({
+            "code": code, "name": meta.get('name', code), "sector": sector,
+            "price": round(float(r['price']), 2), "turnover": float(r['turnover']),
+            "chips_display": f"{chips_sum}張 ({round(r['buy_value'] / 100000000, 1)}億)",
+            "buy_value": float(r['buy_value']), "yoy": round(float(r['yoy']), 2),
+            "score": float(r['score']), "passed": bool(r['passed']),
+            "tag": ("外資大買" if r['acc_f'] > r['acc_t'] else "投信作帳") if r['passed'] else "觀察名單",
+        })
+        keys = sector_keywords(sector)
+        if code in CUSTOM_ELITE_DATA: keys.add(CUSTOM_ELITE_DATA[code])
+        for key in keys:
+            sector_index.setdefault(key, []).append(code)  # 依 rows 順序加入，已是分數排序
+    print(f"🏅 全市場評分索引：{len(rows)} 檔 (達標 {int(df['passed'].sum())} 檔)、{len(sector_index)} 個產業關鍵字")
+    return {"rows": rows, "sector_index": sector_index}
+
+# ========================================================
+# 🧩 每日產線：各階段宣告相依關係，互不相依的階段並行執行
+# ========================================================
+def load_snapshot_stage(results):
+    snapshot = market_snapshot.load_market_snapshot()  # 📊 全市場行情只下載一次，兩條產線共用
+    if snapshot is None or snapshot.empty:
+        raise RuntimeError("無法取得全市場行情")
+    return snapshot
 
 # ========================================================
+# 🏭 產業儀表板 (供「產業 <名稱>」直接查表)
+# 以快照 + 清單產業做一次 groupby 算出各產業漲跌家數、成交值加權漲跌幅、
+# 法人買賣超與站上月線家數；另附成分股的參考價與月線基數，
+# bot 盤中只要批次抓報價就能重算，不必逐檔下載歷史K線。
+# ========================================================
+def build_sector_aggregates(snapshot, bars=None, stock_meta=None):
+    """回傳 {"sectors": 各產業彙總列, "members": 成分股參考資料列}"""
+    if stock_meta is None:
+        stock_meta = stock_listing.load_stock_list()
+    groups = pd.Series({code: stock_listing.sector_group(meta.get('sector'))
+                        for code, meta in stock_meta.items() if meta.get('type') == '股票'}, dtype=object)
+    df = snapshot.set_index('code').join(groups.rename('sector'), how='inner')
+    df = df[(df['sector'] != '') & (df['close'] > 0)].copy()
+    if df.empty: return {"sectors": [], "members": []}
+
+    prev = (df['close'] - df['change']).where(lambda x: x > 0)
+    df['change_pct'] = (df['change'] / prev * 100).fillna(0)
+    df['weighted'] = df['change_pct'] * df['turnover']
+    for days, suffix in ((1, ''), (5, '5')):
+        flows = institutional_flows.flow_sum_frame(days).reindex(df.index).fillna(0)
+        df['foreign' + suffix] = flows['foreign']; df['trust' + suffix] = flows['trust']
+
+    # 月線：日K庫最近 20 天 (已含今日)；ma_base = 最近 19 天收盤合計，盤中 MA20 = (ma_base + 現價) / 20
+    df['ma20'] = np.nan; df['ma_base'] = np.nan
+    if bars is not None and len(bars.dates) >= 20:
+        codes = [c for c in df.index if c in bars.code_index]
+        window = bars.window('close', 20, codes)
+        full = ~np.isnan(window).any(axis=1)
+        df.loc[codes, 'ma20'] = np.where(full, window.mean(axis=1), np.nan)
+        df.loc[codes, 'ma_base'] = np.where(full, window[:, 1:].sum(axis=1), np.nan)
+    df['above_ma20'] = df['close'] > df['ma20']
+
+    g = df.groupby('sector')
+    agg = pd.DataFrame({
+        'count': g.size(),
+        'up': g['change'].apply(lambda x: int((x > 0).sum())),
+        'down': g['change'].apply(lambda x: int((x < 0).sum())),
+        'turnover': g['turnover'].sum(),
+        'change_pct': (g['weighted'].sum() / g['turnover'].sum().replace(0, np.nan)).fillna(0).round(2),
+        'foreign': g['foreign'].sum(), 'trust': g['trust'].sum(),
+        'foreign5': g['foreign5'].sum(), 'trust5': g['trust5'].sum(),
+        'above_ma20': g['above_ma20'].sum(),
+        'ma20_count': g['ma20'].count(),
+    }).sort_values('turnover', ascending=False)
+    agg['flat'] = agg['count'] - agg['up'] - agg['down']
+
+    int_cols = ['count', 'up', 'down', 'flat', 'turnover', 'foreign', 'trust', 'foreign5', 'trust5', 'above_ma20', 'ma20_count']
+    agg[int_cols] = agg[int_cols].astype('int64')
+    sectors = agg.rename_axis('sector').reset_index().to_dict('records')
+    members = [
+        {"code": code, "sector": r['sector'], "ref_close": round(float(r['close']), 2),
+         "ma_base": round(float(r['ma_base']), 2) if pd.notna(r['ma_base']) else None}
+        for code, r in df.sort_values(['sector', 'turnover'], ascending=[True, False]).iterrows()
+    ]
+    print(f"🏭 產業儀表板：{len(sectors)} 個產業、{len(members)} 檔成分股")
+    return {"sectors": sectors, "members": members}
+
+def build_indicator_snapshot(codes, bars):
+    """入選股的技術指標快照 (由本地日K庫計算)，bot 端不必再為這些股票下載歷史K線"""
+    codes = [c for c in dict.fromkeys(codes) if bars is not None and c in bars.code_index]
+    if not codes or len(bars.dates) < 60: return {}
+    close = bars.window('close', 60, codes); high = bars.window('high', 20, codes)
+    low = bars.window('low', 20, codes); volume = bars.window('volume', 20, codes)
+    out = {}
+    with np.errstate(invalid='ignore'):
+        for i, code in enumerate(codes):
+            c = close[i][~np.isnan(close[i])]
+            if len(c) < 20: continue
+            ma = lambda n: round(float(c[-n:].mean()), 2)
+            out[code] = {
+                "close": float(c[-1]), "ma5": ma(5), "ma20": ma(20), "ma60": ma(60) if len(c) >= 60 else None,
+                "high20": float(np.nanmax(high[i])), "low20": float(np.nanmin(low[i])),
+                "vol_ma20": int(np.nanmean(volume[i]) // 1000),  # 張
+            }
+    return out
+
+def publish_stage(results):
+    daily = results.get('daily') or None          # 空名單沿用上一版 (與 daily_recommendations.json 相同規則)
+    left_side = results.get('left_side') or None
+    codes = [x['code'] for x in (daily or []) + (left_side or [])]
+    indicators = build_indicator_snapshot(codes, results.get('bars')) or None
+    scores = results.get('scores') or {}
+    sectors = results.get('sectors') or {}
+    day_trade_rows = results.get('day_trade') or None
+    manifest = publication.publish(
+        {"daily": daily, "left_side": left_side, "indicators": indicators,
+         "scores": scores.get('rows') or None, "sector_index": scores.get('sector_index') or None,
+         "sectors": sectors.get('sectors') or None, "sector_members": sectors.get('members') or None,
+         "day_trade": day_trade_rows},
+        results['snapshot'].attrs['date'].isoformat())
+    print(f"📦 已發布 {publication.PUBLISH_DIR}/ (hash {manifest['hash']}，{manifest['bytes']} bytes / gzip {manifest['gzip_bytes']} bytes)："
+          + "、".join(f"{k} {v['rows']} 筆" for k, v in manifest['artifacts'].items()))
+    return manifest
+
+def build_pipeline():
+    pipe = pipeline.Pipeline()
+    pipe.add("calendar", lambda r: trading_calendar.load_calendar(refresh=True))  # 每日更新休市公告 (颱風假等臨時休市)
+    pipe.add("stock_list", lambda r: update_stock_list_json(), deps=["calendar"])
+    pipe.add("snapshot", load_snapshot_stage, deps=["calendar"], retries=2)
+    pipe.add("revenue", lambda r: revenue.load_revenue_table(), deps=["calendar"])
+    pipe.add("flows", lambda r: institutional_flows.load_market_flows(days=5, base_date=r['snapshot'].attrs['date']), deps=["snapshot"])
+    # 🗄️ 當日K棒併入本地日K庫
+    pipe.add("bars", lambda r: bar_store.update_bar_store(r['snapshot'], list(stock_listing.load_stock_list().keys())),
+             deps=["stock_list", "snapshot"])
+    # 🏦 當日法人買賣超併入歷史庫 (回測用)；排在日K庫之後，兩者首次回補時才不會同時連打 TWSE
+    pipe.add("flow_store", lambda r: institutional_flows.update_flow_store(base_date=r['snapshot'].attrs['date']),
+             deps=["flows"], after=["bars"])
+    # 右側產線 (舊有機制，0% 干擾)
+    pipe.add("daily", lambda r: generate_daily_recommendations(r['snapshot']),
+             deps=["stock_list", "snapshot", "revenue", "flows"])
+    # 左側產線 (全新獨立機制)
+    pipe.add("left_side", lambda r: generate_left_side_value(LiveProviders(
+                 bars=r['bars'], snapshot=r['snapshot'],
+                 revenue_lookup=get_finmind_revenue_yoy, chips_lookup=get_finmind_chips_history)),
+             deps=["bars", "revenue", "flows"])
+    # 🏅 全市場評分索引 / 🏭 產業儀表板
+    pipe.add("scores", lambda r: build_score_index(r['snapshot']), deps=["stock_list", "snapshot", "revenue", "flows"])
+    pipe.add("sectors", lambda r: build_sector_aggregates(r['snapshot'], r['bars']), deps=["stock_list", "snapshot", "flows", "bars"])
+    # 🚨 隔日沖分點集中度
+    pipe.add("day_trade", lambda r: day_trade.build_day_trade_index(finmind_get, r['snapshot']), deps=["snapshot"])
+    # 📦 打包發布 (任一產線失敗時，該產物沿用上一版)
+    pipe.add("publish", publish_stage, deps=["snapshot"], after=["daily", "left_side", "bars", "scores", "sectors", "day_trade"])
+    return pipe
+
 if __name__ == "__main__":
-    update_stock_list_json()
-    generate_daily_recommendations()  # 右側產線 (舊有機制，0% 干擾)
-    generate_left_side_value()        # 左側產線 (全新獨立機制)
+    http_archive.install()  # HTTP_ARCHIVE_MODE=record / replay 時錄製或離線重播所有請求
+    run_report.install()    # 📋 HTTP 次數 / 位元組 / 等待統計 (包在錄製重播之外)
+    pipe = build_pipeline()
+    pipe.run()
+    pipeline.prune_checkpoints()
+    pipe.report()
+    report_call_timings()
+    http_archive.report()
+    run_report.save(run_report.build(pipe))
@@ -0,0 +1,174 @@
+import requests
+import json
+import gzip
+import hashlib
+import os
+import pickle
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qsl, urlencode
+import trading_calendar
+
+# ========================================================
+# 📼 HTTP 錄製 / 重播 (離線調參、效能量測用)
+# HTTP_ARCHIVE_MODE=record  -> 正常連網，並把每個回應存進本地檔案庫
+# HTTP_ARCHIVE_MODE=replay  -> 完全不連網，由檔案庫直接回放，限速與等待一併略過
+# 檔案庫格式 (預設 data_cache/http_archive/)：
+#   objects/ab/abcd....gz -> 回應內容 (gzip，以內容 sha256 命名，相同內容只存一份)
+#   index.jsonl           -> 請求指紋 -> 狀態碼 / Content-Type / 內容雜湊
+#   meta.json             -> 錄製時間 (重播時時鐘固定在這個時間點，日期參數才會一致)
+# ========================================================
+
+CACHE_DIR = os.environ.get('DATA_CACHE_DIR', 'data_cache')
+ARCHIVE_DIR = os.environ.get('HTTP_ARCHIVE_DIR', os.path.join(CACHE_DIR, 'http_archive'))
+IGNORED_PARAMS = {'token'}   # 不納入請求指紋的參數 (金鑰不落地)
+
+ARCHIVE = None
+_ORIGINAL_REQUEST = requests.Session.request
+
+class HttpArchive:
+    def __init__(self, root, mode):
+        self.root = root
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.index = {}
+        self.stats = {"hit": 0, "miss": 0, "recorded": 0, "new_objects": 0}
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        index_path = os.path.join(root, 'index.jsonl')
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.index[entry['key']] = entry
+                    except (ValueError, KeyError):
+                        continue
+        self.meta = {}
+        meta_path = os.path.join(root, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+        if mode == 'record':
+            self.meta = {"recorded_at": trading_calendar.tw_now().isoformat()}
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(self.meta, f)
+
+    @staticmethod
+    def request_key(method, url, params=None, data=None):
+        """請求指紋：method + 正規化網址 (參數排序、去除金鑰) + body"""
+        prepared = requests.Request(method.upper(), url, params=params, data=data).prepare()
+        parts = urlsplit(prepared.url)
+        query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in IGNORED_PARAMS))
+        body = prepared.body or b''
+        if isinstance(body, str): body = body.encode('utf-8')
+        raw = f"{prepared.method} {parts.scheme}://{parts.netloc}{parts.path}?{query}\n".encode('utf-8') + body
+        return hashlib.sha256(raw).hexdigest(), f"{parts.netloc}{parts.path}?{query}"
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], f"{digest}.gz")
+
+    def put_blob(self, content):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp, 'wb') as f:
+                f.write(content)
+            os.replace(tmp, path)
+            with self.lock:
+                self.stats['new_objects'] += 1
+        return digest
+
+    def get_blob(self, digest):
+        with gzip.open(self._object_path(digest), 'rb') as f:
+            return f.read()
+
+    def put_entry(self, key, entry):
+        entry['key'] = key
+        with self.lock:
+            self.index[key] = entry
+            self.stats['recorded'] += 1
+            with open(os.path.join(self.root, 'index.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def lookup(self, key, label):
+        entry = self.index.get(key)
+        with self.lock:
+            self.stats['hit' if entry else 'miss'] += 1
+        if entry is None:
+            raise requests.ConnectionError(f"📼 重播檔案庫沒有這個請求: {label}")
+        return entry
+
+    def record_response(self, key, label, response):
+        self.put_entry(key, {
+            "url": label,
+            "status": response.status_code,
+            "reason": response.reason,
+            "content_type": response.headers.get('Content-Type', ''),
+            "encoding": response.encoding,
+            "body": self.put_blob(response.content),
+        })
+
+    def build_response(self, entry, method, url):
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = entry.get('reason')
+        response._content = self.get_blob(entry['body'])
+        response.headers['Content-Type'] = entry.get('content_type', '')
+        response.encoding = entry.get('encoding')
+        response.url = url
+        response.request = requests.Request(method.upper(), url).prepare()
+        return response
+
+def _archived_request(session, method, url, params=None, data=None, **kwargs):
+    if ARCHIVE is None or ARCHIVE.mode not in ('record', 'replay'):
+        return _ORIGINAL_REQUEST(session, method, url, params=params, data=data, **kwargs)
+    key, label = HttpArchive.request_key(method, url, params, data)
+    if ARCHIVE.mode == 'replay':
+        return ARCHIVE.build_response(ARCHIVE.lookup(key, label), method, url)
+    response = _ORIGINAL_REQUEST(session, method, url, params=params, data=data, **kwargs)
+    ARCHIVE.record_response(key, label, response)
+    return response
+
+def install(mode=None, root=None):
+    """依 HTTP_ARCHIVE_MODE 啟用錄製或重播；所有經由 requests 發出的請求都會被攔截"""
+    global ARCHIVE
+    mode = mode or os.environ.get('HTTP_ARCHIVE_MODE', 'off')
+    if mode not in ('record', 'replay'): return None
+    ARCHIVE = HttpArchive(root or ARCHIVE_DIR, mode)
+    requests.Session.request = _archived_request
+    if mode == 'replay' and ARCHIVE.meta.get('recorded_at'):
+        # 時鐘固定在錄製當下，「最新交易日」與各 API 的日期參數才會和錄製時相同
+        frozen = datetime.fromisoformat(ARCHIVE.meta['recorded_at'])
+        trading_calendar.tw_now = lambda: frozen
+    print(f"📼 HTTP {'錄製' if mode == 'record' else '重播'}模式：{ARCHIVE.root} (已收錄 {len(ARCHIVE.index)} 個請求)")
+    return ARCHIVE
+
+def is_replaying():
+    return ARCHIVE is not None and ARCHIVE.mode == 'replay'
+
+def pause(seconds):
+    """禮貌性等待 (避免被交易所封鎖)；重播時不需要"""
+    if not is_replaying():
+        time.sleep(seconds)
+
+def archived_call(label, producer):
+    """非 requests 的資料來源 (例如 yfinance 自帶的連線) 以結果物件整包錄製 / 重播"""
+    if ARCHIVE is None or ARCHIVE.mode not in ('record', 'replay'):
+        return producer()
+    key = hashlib.sha256(f"call {label}".encode('utf-8')).hexdigest()
+    if ARCHIVE.mode == 'replay':
+        return pickle.loads(ARCHIVE.get_blob(ARCHIVE.lookup(key, label)['body']))
+    value = producer()
+    ARCHIVE.put_entry(key, {"url": f"call {label}", "status": 200, "body": ARCHIVE.put_blob(pickle.dumps(value))})
+    return value
+
+def report():
+    if ARCHIVE is None: return
+    s = ARCHIVE.stats
+    if ARCHIVE.mode == 'replay':
+        print(f"\n📼 重播統計：命中 {s['hit']} 次、未收錄 {s['miss']} 次")
+    else:
+        print(f"\n📼 錄製統計：{s['recorded']} 個回應，新增 {s['new_objects']} 個內容物件 (其餘內容重複，不另存)")
@@ -0,0 +1,177 @@
+import requests
+import pandas as pd
+import numpy as np
+import os
+import concurrent.futures
+import trading_calendar
+import http_archive
+import run_report
+import bar_store
+
+# ========================================================
+# 🏦 全市場三大法人買賣超 (TWSE T86 + TPEx 三大法人日報)
+# 每個交易日只需 2 個請求即可取得全市場外資/投信淨買賣，
+# 取代 get_finmind_chips 一檔一檔查詢 FinMind 的做法。
+# 每日結果另存一份 日期 × 代號 的歷史庫 (data_cache/flows，格式同日K庫)，
+# 之後的執行只需抓最新一天，回測也能直接讀取多年的法人籌碼。
+# ========================================================
+
+FLOW_INDEX = {}   # 代號 -> {日期 'YYYY-MM-DD': (外資淨買張數, 投信淨買張數)}
+FLOW_DATES = []   # 已載入的交易日 (新到舊)
+
+FLOW_DIR = os.path.join(bar_store.CACHE_DIR, 'flows')
+FLOW_FIELDS = ['foreign', 'trust']
+FLOW_BACKFILL_DAYS = int(os.environ.get('FLOW_BACKFILL_DAYS', 60))
+
+TPEX_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
+
+def _to_lots(val):
+    """'1,234,000' 股 -> 1234 張 (與 FinMind 版 (buy - sell) // 1000 相同算法)"""
+    try:
+        return int(str(val).replace(',', '').strip()) // 1000
+    except ValueError:
+        return 0
+
+def _find_field(fields, *keywords):
+    for i, f in enumerate(fields):
+        if all(k in str(f) for k in keywords):
+            return i
+    return None
+
+def _parse_flow_table(fields, rows, default_idx):
+    fields = [str(f).strip() for f in fields]
+    idx_code = _find_field(fields, '代號')
+    idx_f = _find_field(fields, '買賣超', '不含')       # 外陸資 (不含外資自營商)
+    idx_t = _find_field(fields, '投信', '買賣超')
+    if idx_code is None or idx_f is None or idx_t is None:
+        idx_code, idx_f, idx_t = default_idx
+
+    flows = {}
+    for row in rows:
+        try:
+            code = str(row[idx_code]).strip()
+            flows[code] = (_to_lots(row[idx_f]), _to_lots(row[idx_t]))
+        except IndexError:
+            continue
+    return flows
+
+def fetch_twse_t86(date):
+    """上市三大法人 (T86)，date 為交易日；無資料 (休市) 回傳 {}"""
+    url = f"https://www.twse.com.tw/rwd/zh/fund/T86?date={date.strftime('%Y%m%d')}&selectType=ALLBUT0999&response=json"
+    data = requests.get(url, timeout=15).json()
+    if data.get('stat') != 'OK' or not data.get('data'): return {}
+    return _parse_flow_table(data.get('fields', []), data['data'], (0, 4, 10))
+
+def fetch_tpex_insti(date):
+    """上櫃三大法人日報，date 為交易日；無資料 (休市) 回傳 {}"""
+    roc_date = f"{date.year - 1911}/{date.strftime('%m/%d')}"
+    url = f"https://www.tpex.org.tw/web/stock/3insti/daily_trade/3itrade_hedge_result.php?l=zh-tw&o=json&se=EW&t=D&d={roc_date}"
+    data = requests.get(url, headers=TPEX_HEADERS, timeout=15).json()
+    # 🌟 新版 API 使用 tables，舊版使用 aaData
+    if data.get('tables'):
+        table = data['tables'][0]
+        return _parse_flow_table(table.get('fields', []), table.get('data', []), (0, 4, 13))
+    return _parse_flow_table([], data.get('aaData', []), (0, 4, 13))
+
+def fetch_market_flows(date):
+    """同時抓取上市與上櫃，合併為 {代號: (外資, 投信)}；休市回傳 {}
+    任一交易所失敗或只有一邊有資料 (另一邊尚未公布) 時回傳 None，這一天不計入也不寫進歷史庫"""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        future_twse = executor.submit(fetch_twse_t86, date)
+        future_tpex = executor.submit(fetch_tpex_insti, date)
+        parts = []
+        for future, label in [(future_twse, "上市"), (future_tpex, "上櫃")]:
+            try:
+                parts.append(future.result())
+            except Exception as e:
+                print(f"⚠️ {date.strftime('%Y-%m-%d')} {label}法人資料抓取失敗: {e}")
+    if len(parts) < 2: return None
+    if bool(parts[0]) != bool(parts[1]):
+        print(f"⚠️ {date.strftime('%Y-%m-%d')} 法人資料只有{'上市' if parts[0] else '上櫃'}，略過這一天")
+        return None
+    return {**parts[0], **parts[1]}
+
+def load_market_flows(days=5, base_date=None):
+    """下載最近 days 個交易日的全市場法人買賣超並建立索引，回傳實際載入的日數"""
+    global FLOW_INDEX, FLOW_DATES
+    # 📅 交易日曆直接給出要抓的日期；若最新一日盤後資料尚未公布，多備一天遞補
+    trade_days = trading_calendar.recent_trading_days(days + 1, base_date or trading_calendar.latest_close_date())
+
+    store = bar_store.BarStore.load(FLOW_DIR, fields=FLOW_FIELDS)
+    index = {}
+    dates = []
+    for check_date in trade_days:
+        if len(dates) >= days: break
+        date_str = check_date.strftime('%Y-%m-%d')
+        flows = stored_day_flows(store, date_str)  # 歷史庫已有的日子不再重抓
+        run_report.cache("flow_day", flows is not None)
+        if flows is None:
+            flows = fetch_market_flows(check_date)
+            http_archive.pause(0.5)  # TWSE 對連續請求較敏感
+        if flows:
+            dates.append(date_str)
+            for code, val in flows.items():
+                index.setdefault(code, {})[date_str] = val
+
+    FLOW_INDEX, FLOW_DATES = index, dates
+    print(f"🏦 全市場法人索引完成：{len(dates)} 個交易日、{len(index)} 檔 ({', '.join(dates)})")
+    return len(dates)
+
+def stored_day_flows(store, date_str):
+    """從歷史庫取出一天的 {代號: (外資, 投信)}；不在庫內回傳 None"""
+    i = store.date_index.get(date_str)
+    if i is None: return None
+    foreign = np.asarray(store.arrays['foreign'][i]); trust = np.asarray(store.arrays['trust'][i])
+    traded = ~np.isnan(foreign)
+    return {code: (int(f), int(t)) for code, f, t, ok in zip(store.codes, foreign, trust, traded) if ok}
+
+def _flows_frame(flows):
+    return pd.DataFrame([(code, f, t) for code, (f, t) in flows.items()], columns=['code'] + FLOW_FIELDS)
+
+def update_flow_store(backfill_days=FLOW_BACKFILL_DAYS, base_date=None):
+    """把目前索引內的交易日寫入法人歷史庫；不足 backfill_days 的日子只在第一次執行時回補"""
+    store = bar_store.BarStore.load(FLOW_DIR, mmap=False, fields=FLOW_FIELDS)
+    store.ensure_codes(list(FLOW_INDEX))
+    for date_str in FLOW_DATES:
+        day = {code: per_day[date_str] for code, per_day in FLOW_INDEX.items() if date_str in per_day}
+        store.put_day(date_str, _flows_frame(day))
+
+    wanted = trading_calendar.recent_trading_days(backfill_days, base_date or trading_calendar.latest_close_date())
+    missing = [d for d in wanted if d.isoformat() not in store.date_index]
+    if missing:
+        print(f"🏦 法人歷史庫回補 {len(missing)} 個交易日 (僅首次執行需要)...")
+    for i, d in enumerate(sorted(missing), 1):
+        flows = fetch_market_flows(d)
+        if flows:
+            store.ensure_codes(list(flows))
+            store.put_day(d.isoformat(), _flows_frame(flows))
+        if i % bar_store.BACKFILL_SAVE_EVERY == 0:
+            store.save(FLOW_DIR)
+        http_archive.pause(0.5)
+
+    store.trim()
+    store.save(FLOW_DIR)
+    print(f"🏦 法人歷史庫已更新：{len(store.dates)} 個交易日 × {len(store.codes)} 檔")
+    return len(store.dates)
+
+def has_flows(days=5):
+    return len(FLOW_DATES) >= days
+
+def get_flow_history(code, days=5):
+    """近 days 日每日 (外資, 投信) 淨買張數，新到舊；無交易的日子補 (0, 0)"""
+    per_day = FLOW_INDEX.get(code, {})
+    return [per_day.get(d, (0, 0)) for d in FLOW_DATES[:days]]
+
+def flow_sum_frame(days=5):
+    """全市場近 days 日外資 / 投信累計淨買張數，DataFrame[foreign, trust]，以代號為索引"""
+    dates = FLOW_DATES[:days]
+    rows = {code: [sum(per_day.get(d, (0, 0))[0] for d in dates), sum(per_day.get(d, (0, 0))[1] for d in dates)]
+            for code, per_day in FLOW_INDEX.items()}
+    return pd.DataFrame.from_dict(rows, orient='index', columns=FLOW_FIELDS)
+
+def get_flow_sum(code, days=5):
+    """近 days 日外資與投信累計淨買張數 (與 get_finmind_chips 回傳格式相同)"""
+    acc_f = 0; acc_t = 0
+    for f, t in get_flow_history(code, days):
+        acc_f += f; acc_t += t
+    return acc_f, acc_t
@@ -0,0 +1,155 @@
+import requests
+import pandas as pd
+import numpy as np
+import concurrent.futures
+from datetime import datetime
+import trading_calendar
+
+# ========================================================
+# 📊 全市場收盤快照 (上市 MI_INDEX + 上櫃 stk_wn1430)
+# 每次執行只下載一次、兩個交易所並行抓取，
+# 解析成同一張欄位型別固定的 DataFrame，交給所有產線共用：
+#   code, name, exchange(上市/上櫃), market(TW/TWO),
+#   open, high, low, close, volume(股), turnover(元), change, is_up
+# 兩個交易所的資料日期可能不同 (上櫃盤後資料較晚產出時退回前一交易日)，
+# 各自記在 attrs['dates']，寫入歷史庫前以 same_day_rows 只取 attrs['date'] 當天的部分。
+# ========================================================
+
+TPEX_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
+SNAPSHOT_COLUMNS = ['code', 'name', 'exchange', 'market', 'open', 'high', 'low', 'close', 'volume', 'turnover', 'change', 'is_up']
+NUMERIC_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'turnover', 'change']
+MARKETS = ('TW', 'TWO')
+
+def to_number(series):
+    """'1,234.5' -> 1234.5；'--'、'----'、'除息' 等非數字一律轉 NaN (向量化)"""
+    return pd.to_numeric(series.astype(str).str.replace(',', '', regex=False).str.strip(), errors='coerce')
+
+def _column(df, fields, name, default_idx):
+    idx = fields.index(name) if name in fields else default_idx
+    return df.iloc[:, idx]
+
+def fetch_twse_table(trade_day, fallback=True):
+    """上市每日收盤行情；指定日期無資料時改抓「最新交易日」，回傳 (fields, rows, 資料日期)"""
+    base = "https://www.twse.com.tw/exchangeReport/MI_INDEX?response=json&type=ALLBUT0999"
+    data = requests.get(f"{base}&date={trade_day.strftime('%Y%m%d')}", timeout=10).json()
+    if data.get('stat') != 'OK' and fallback:
+        print(f"⚠️ 上市 ({trade_day}) 無資料或休市: {data.get('stat')}，改抓最新交易日...")
+        data = requests.get(base, timeout=10).json()
+    if data.get('stat') != 'OK': return None
+
+    # 尋找包含股價的表格 (新版 tables；舊版 data9)
+    table = next((t for t in data.get('tables', []) if '證券代號' in t.get('fields', []) and '收盤價' in t.get('fields', [])), None)
+    if not table and 'data9' in data:
+        table = {'data': data['data9'], 'fields': data.get('fields9', [])}
+    if not table: return None
+    data_date = datetime.strptime(data['date'], '%Y%m%d').date() if data.get('date') else trade_day
+    return table['fields'], table['data'], data_date
+
+def fetch_tpex_table(trade_day, fallback=True):
+    """上櫃收盤行情；盤後資料若尚未產出，退回前一個交易日，回傳 (fields, rows, 資料日期)"""
+    check_dates = [trade_day, trading_calendar.trading_days_ago(1, trade_day)] if fallback else [trade_day]
+    for check_date in check_dates:
+        if check_date is None: continue
+        roc_date = f"{check_date.year - 1911}/{check_date.strftime('%m/%d')}"
+        url_otc = f"https://www.tpex.org.tw/web/stock/aftertrading/otc_quotes_no1430/stk_wn1430_result.php?l=zh-tw&d={roc_date}&se=EW"
+        try:
+            data = requests.get(url_otc, headers=TPEX_HEADERS, timeout=10).json()
+            # 🌟 適應 TPEx 新版 API 結構 (tables)
+            if data.get('tables') and len(data['tables'][0].get('data', [])) > 0:
+                table = data['tables'][0]
+                return [str(f).strip() for f in table.get('fields', [])], table['data'], check_date
+        except Exception as e:
+            print(f"⚠️ {roc_date} 上櫃行情抓取失敗: {e}")
+    return None
+
+def parse_twse(fields, rows):
+    raw = pd.DataFrame(rows)
+    sign = _column(raw, fields, "漲跌(+/-)", 9).astype(str)
+    # 漲跌欄位是 HTML 片段，例如 <p style= color:red>+</p>
+    direction = np.where(sign.str.contains(r'\+|red', regex=True), 1.0,
+                         np.where(sign.str.contains(r'-|green', regex=True), -1.0, 0.0))
+    df = pd.DataFrame({
+        'code': _column(raw, fields, "證券代號", 0).astype(str).str.strip(),
+        'name': _column(raw, fields, "證券名稱", 1).astype(str).str.strip(),
+        'exchange': '上市', 'market': 'TW',
+        'open': to_number(_column(raw, fields, "開盤價", 5)),
+        'high': to_number(_column(raw, fields, "最高價", 6)),
+        'low': to_number(_column(raw, fields, "最低價", 7)),
+        'close': to_number(_column(raw, fields, "收盤價", 8)),
+        'volume': to_number(_column(raw, fields, "成交股數", 2)),
+        'turnover': to_number(_column(raw, fields, "成交金額", 4)),
+        'change': direction * to_number(_column(raw, fields, "漲跌價差", 10)).fillna(0),
+    })
+    df['is_up'] = direction > 0
+    return df
+
+def parse_tpex(fields, rows):
+    raw = pd.DataFrame(rows)
+    sign = _column(raw, fields, "漲跌", 3).astype(str).str.replace(',', '', regex=False).str.strip()
+    # 🔥 強化版漲跌判斷：處理沒有加號的隱藏紅K
+    change = pd.to_numeric(sign.str.replace(r'[^\d.-]', '', regex=True), errors='coerce').fillna(0)
+    df = pd.DataFrame({
+        'code': _column(raw, fields, "代號", 0).astype(str).str.strip(),
+        'name': _column(raw, fields, "名稱", 1).astype(str).str.strip(),
+        'exchange': '上櫃', 'market': 'TWO',
+        'open': to_number(_column(raw, fields, "開盤", 4)),
+        'high': to_number(_column(raw, fields, "最高", 5)),
+        'low': to_number(_column(raw, fields, "最低", 6)),
+        'close': to_number(_column(raw, fields, "收盤", 2)),
+        'volume': to_number(_column(raw, fields, "成交股數", 7)),
+        'turnover': to_number(_column(raw, fields, "成交金額(元)", 8)),
+        'change': change,
+    })
+    df['is_up'] = sign.str.contains(r'\+|red', regex=True) | (change > 0)
+    return df
+
+def load_market_snapshot(trade_day=None, fallback=True):
+    """並行下載上市與上櫃收盤行情並合併；df.attrs['date'] 為最新的資料日期，
+    df.attrs['dates'] 為各交易所 (TW / TWO) 的資料日期
+    fallback=False 時只接受指定日期的資料 (歷史回補用)"""
+    if trade_day is None:
+        trade_day = trading_calendar.latest_close_date()
+
+    frames = []
+    dates = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        jobs = [
+            ("上市", 'TW', executor.submit(fetch_twse_table, trade_day, fallback), parse_twse),
+            ("上櫃", 'TWO', executor.submit(fetch_tpex_table, trade_day, fallback), parse_tpex),
+        ]
+        for label, market, future, parser in jobs:
+            try:
+                result = future.result()
+                if not result:
+                    print(f"❌ 無法取得{label}行情，請檢查 API 狀態。")
+                    continue
+                fields, rows, day = result
+                frames.append(parser(fields, rows))
+                dates[market] = day
+                print(f"✅ {label}行情 {len(rows)} 筆 (資料日期: {day})")
+            except Exception as e:
+                print(f"⚠️ {label}行情解析錯誤: {e}")
+
+    if not frames: return None
+    snapshot = pd.concat(frames, ignore_index=True)[SNAPSHOT_COLUMNS]
+    snapshot = snapshot.drop_duplicates('code').reset_index(drop=True)
+    snapshot[NUMERIC_COLUMNS] = snapshot[NUMERIC_COLUMNS].astype('float64')
+    snapshot.attrs['date'] = max(dates.values())
+    snapshot.attrs['dates'] = dates
+    if len(set(dates.values())) > 1:
+        print(f"⚠️ 上市 / 上櫃資料日期不一致：{', '.join(f'{m} {d}' for m, d in dates.items())}")
+    return snapshot
+
+def same_day_rows(snapshot):
+    """只留資料日期等於 attrs['date'] 的交易所，回傳 (DataFrame, 兩個交易所是否都齊全)
+    避免把退回前一交易日的上櫃行情當成當日K棒寫進歷史庫"""
+    dates = snapshot.attrs.get('dates')
+    if dates is None: return snapshot, True   # 非 load_market_snapshot 產生的表 (例如回測) 視為完整
+    markets = [m for m, d in dates.items() if d == snapshot.attrs['date']]
+    complete = all(m in markets for m in MARKETS)
+    return (snapshot if len(markets) == len(dates) else snapshot[snapshot['market'].isin(markets)]), complete
+
+def common_stock_mask(snapshot):
+    """排除權證 (代號超過 4 碼)、ETF (00 開頭) 與 DR 股 (91 開頭)"""
+    code = snapshot['code']
+    return (code.str.len() == 4) & ~code.str.startswith('00') & ~code.str.startswith('91')
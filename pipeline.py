@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import threading
+import time
+import concurrent.futures
+import run_report
+
+# ========================================================
+# 🧩 產線執行器 (generator 每日任務的 DAG 排程)
+# 每個階段宣告相依關係，相依都完成的階段立即並行執行；
+# 失敗的階段可自動重試，下游階段會被略過而不是整條產線中止。
+# 逐檔的中間結果寫入 Checkpoint (data_cache/checkpoints/<資料日期>/)，
+# 同一天重跑或重試時直接沿用，不必重打 API。
+# ========================================================
+
+CACHE_DIR = os.environ.get('DATA_CACHE_DIR', 'data_cache')
+CHECKPOINT_DIR = os.path.join(CACHE_DIR, 'checkpoints')
+CHECKPOINT_KEEP = 3   # 保留最近幾個資料日期的檢查點
+
+class Checkpoint:
+    """逐檔中間結果：每完成一檔就追加一行 JSON，重跑時讀回來跳過已完成的代號"""
+    def __init__(self, name, run_key, root=CHECKPOINT_DIR):
+        self.path = os.path.join(root, str(run_key), f"{name}.jsonl")
+        self.lock = threading.Lock()
+        self.records = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                        self.records[row['key']] = row['value']
+                    except (ValueError, KeyError):
+                        continue  # 上次中斷時寫到一半的行
+            print(f"♻️ 檢查點 {name} ({run_key})：沿用 {len(self.records)} 筆已完成結果")
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def get(self, key, default=None):
+        return self.records.get(key, default)
+
+    def put(self, key, value):
+        with self.lock:
+            self.records[key] = value
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"key": key, "value": value}, ensure_ascii=False) + "\n")
+
+def prune_checkpoints(keep=CHECKPOINT_KEEP, root=CHECKPOINT_DIR):
+    if not os.path.isdir(root): return
+    for run_key in sorted(os.listdir(root))[:-keep]:
+        shutil.rmtree(os.path.join(root, run_key), ignore_errors=True)
+
+class Stage:
+    def __init__(self, name, func, deps=(), retries=0, after=()):
+        self.name = name
+        self.func = func          # func(results) -> 結果；results 為 {階段名稱: 結果}
+        self.deps = list(deps)    # 必要相依：任一失敗則本階段略過
+        self.after = list(after)  # 順序相依：只等它結束，成功與否都照常執行 (結果不存在時為 None)
+        self.retries = retries
+
+class Pipeline:
+    def __init__(self, max_workers=4):
+        self.stages = {}
+        self.max_workers = max_workers
+        self.results = {}
+        self.status = {}     # 名稱 -> 'ok' / 'failed' / 'skipped'
+        self.timings = {}    # 名稱 -> 牆鐘秒數
+
+    def add(self, name, func, deps=(), retries=0, after=()):
+        missing = [d for d in list(deps) + list(after) if d not in self.stages]
+        if missing: raise ValueError(f"階段 {name} 的相依 {missing} 尚未定義")
+        self.stages[name] = Stage(name, func, deps, retries, after)
+        return self
+
+    def _run_stage(self, stage):
+        t0 = time.perf_counter()
+        try:
+            for attempt in range(stage.retries + 1):
+                try:
+                    return stage.func(self.results)
+                except Exception as e:
+                    if attempt == stage.retries: raise
+                    run_report.count("stage_retries")
+                    print(f"🔁 [{stage.name}] 失敗 ({e})，{2 ** attempt} 秒後重試...")
+                    time.sleep(2 ** attempt)
+        finally:
+            self.timings[stage.name] = time.perf_counter() - t0
+
+    def run(self):
+        pending = dict(self.stages)
+        running = {}
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    dep_status = [self.status.get(d) for d in stage.deps]
+                    if any(s in ('failed', 'skipped') for s in dep_status):
+                        self.status[name] = 'skipped'
+                        print(f"⏭️ [{name}] 上游階段失敗，略過")
+                        del pending[name]
+                    elif all(s == 'ok' for s in dep_status) and all(a in self.status for a in stage.after):
+                        running[executor.submit(self._run_stage, stage)] = name
+                        del pending[name]
+                if not running: continue  # 本輪有階段被略過，重新檢查下游
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                        self.status[name] = 'ok'
+                    except Exception as e:
+                        self.status[name] = 'failed'
+                        print(f"❌ [{name}] 階段失敗: {e}")
+        self.timings['(total)'] = time.perf_counter() - started
+        return self.results
+
+    def report(self):
+        print("\n⏱️ 產線各階段耗時：")
+        icons = {'ok': '✅', 'failed': '❌', 'skipped': '⏭️'}
+        for name in self.stages:
+            status = self.status.get(name, 'skipped')
+            elapsed = self.timings.get(name)
+            print(f"   {icons[status]} {name}: {f'{elapsed:.1f}s' if elapsed is not None else '-'}")
+        print(f"   合計 (牆鐘): {self.timings.get('(total)', 0):.1f}s")
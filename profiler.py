@@ -0,0 +1,280 @@
+import sys
+import os
+import re
+import json
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+import functools
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+# ========================================================
+# 🔬 取樣式效能分析 (bot 使用，預設關閉)
+# 開啟方式：環境變數 PROFILE_REQUESTS=1，或管理員在聊天室輸入「管理 效能分析 開」。
+# 開啟後每個 webhook 請求期間，背景執行緒每 10ms 以 sys._current_frames() 取樣
+# 「正在替這個請求工作」的執行緒 (handler 本身 + 執行 @timed 函式中的執行緒池執行緒)，
+# 累積成 folded stacks (flamegraph.pl / speedscope 可直接讀)。
+# 超過 PROFILE_SLOW_SECONDS 的請求自動寫檔到 data_cache/profiles/，
+# 並保留最慢的 N 筆 (含各階段耗時與 PID) 供 /admin/profiler 查詢。
+# gunicorn 有多個 worker，開關與最慢清單都放在 data_cache/profiles/ 下由所有 worker 共用：
+# 聊天指令寫入開關檔，各 worker 每個請求檢查一次 (最多每 FLAG_CHECK_INTERVAL 秒讀一次檔)；
+# 各 worker 的最慢清單寫成 slowest/slowest-<PID>.json，/admin/profiler 彙整全部 worker 的結果。
+# ========================================================
+
+CACHE_DIR = os.environ.get('DATA_CACHE_DIR', 'data_cache')
+PROFILE_DIR = os.path.join(CACHE_DIR, 'profiles')
+FLAG_PATH = os.path.join(PROFILE_DIR, 'enabled')     # 共用開關檔 ('1' / '0')；不存在時以環境變數為準
+TOP_DIR = os.path.join(PROFILE_DIR, 'slowest')       # 各 worker 的最慢清單與對應堆疊
+FLAG_CHECK_INTERVAL = 2                              # 開關檔最多每幾秒讀一次
+SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.01))   # 取樣週期 (秒)
+SLOW_THRESHOLD = float(os.environ.get('PROFILE_SLOW_SECONDS', 5))          # 超過幾秒自動輸出 profile
+SLOW_KEEP = int(os.environ.get('PROFILE_SLOW_KEEP', 20))                   # 保留最慢的幾筆
+MAX_STACK_KEYS = 2000   # 單一請求最多保留幾種不同堆疊 (避免記憶體失控)
+IGNORED_THREADS = {'quote-poller', 'alert-evaluator', 'profiler-sampler'}
+
+ENABLED = os.environ.get('PROFILE_REQUESTS', '0') == '1'
+_FLAG = {"checked": 0.0, "mtime": None}
+ACTIVE = {}       # 請求編號 -> RequestProfile
+ACTIVE_LOCK = threading.Lock()
+SLOWEST = []      # (耗時, 請求編號, 摘要) 的最小堆積，只保留本 worker 最慢 SLOW_KEEP 筆
+SLOWEST_LOCK = threading.Lock()
+CURRENT = contextvars.ContextVar('request_profile', default=None)
+_IDS = itertools.count(1)
+_SAMPLER = None
+
+class RequestProfile:
+    def __init__(self, label):
+        self.id = next(_IDS)
+        self.label = label
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.elapsed = None
+        self.stages = []          # (名稱, 起始偏移秒, 耗時秒, 執行緒名稱)
+        self.samples = Counter()  # folded stack -> 取樣次數
+        self.threads = {threading.get_ident(): 1}   # 正在替此請求工作的執行緒 (重入計數)
+        self.lock = threading.Lock()
+
+    def enter_thread(self, ident):
+        with self.lock:
+            self.threads[ident] = self.threads.get(ident, 0) + 1
+
+    def leave_thread(self, ident):
+        with self.lock:
+            self.threads[ident] -= 1
+            if self.threads[ident] <= 0: del self.threads[ident]
+
+    def add_stage(self, name, start, elapsed):
+        with self.lock:
+            self.stages.append((name, round(start - self.t0, 3), round(elapsed, 3), threading.current_thread().name))
+
+    def add_sample(self, stack):
+        with self.lock:
+            if stack in self.samples or len(self.samples) < MAX_STACK_KEYS:
+                self.samples[stack] += 1
+
+    def folded(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+    def summary(self):
+        return {
+            "key": f"{os.getpid()}-{self.id}", "pid": os.getpid(), "id": self.id, "label": self.label,
+            "started_at": datetime.fromtimestamp(self.started_at).strftime('%Y-%m-%d %H:%M:%S'),
+            "elapsed": round(self.elapsed or 0, 3), "samples": sum(self.samples.values()),
+            "stages": [{"name": n, "start": s, "elapsed": e, "thread": t} for n, s, e, t in self.stages],
+        }
+
+def _write_atomic(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def set_enabled(flag):
+    """切換所有 worker 的開關 (寫入共用開關檔)"""
+    global ENABLED
+    ENABLED = bool(flag)
+    try:
+        _write_atomic(FLAG_PATH, '1' if ENABLED else '0')
+        _FLAG.update(checked=time.monotonic(), mtime=os.stat(FLAG_PATH).st_mtime_ns)
+    except OSError as e:
+        print(f"[Warn] 效能分析開關檔寫入失敗 (只影響目前 worker {os.getpid()}): {e}")
+    if ENABLED: _ensure_sampler()
+    return ENABLED
+
+def refresh_enabled():
+    """依共用開關檔更新 ENABLED (其他 worker 的聊天指令也會生效)"""
+    global ENABLED
+    now = time.monotonic()
+    if now - _FLAG['checked'] < FLAG_CHECK_INTERVAL: return ENABLED
+    _FLAG['checked'] = now
+    try:
+        mtime = os.stat(FLAG_PATH).st_mtime_ns
+        if mtime != _FLAG['mtime']:
+            with open(FLAG_PATH, 'r', encoding='utf-8') as f:
+                ENABLED = f.read().strip() == '1'
+            _FLAG['mtime'] = mtime
+    except OSError:
+        pass
+    return ENABLED
+
+def _fold(frame, thread_name):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
+
+def _sampler_loop():
+    me = threading.get_ident()
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        with ACTIVE_LOCK:
+            profiles = list(ACTIVE.values())
+        if not profiles: continue
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me or names.get(ident) in IGNORED_THREADS: continue
+            owners = [p for p in profiles if ident in p.threads]
+            if not owners: continue
+            stack = _fold(frame, names.get(ident, str(ident)))
+            for p in owners:
+                p.add_sample(stack)
+
+def _ensure_sampler():
+    global _SAMPLER
+    if _SAMPLER is not None and _SAMPLER.is_alive(): return
+    _SAMPLER = threading.Thread(target=_sampler_loop, name="profiler-sampler", daemon=True)
+    _SAMPLER.start()
+
+def _owners():
+    """目前執行緒所屬的請求：有 context 就用 context，否則 (執行緒池未帶 context) 歸給唯一進行中的請求"""
+    current = CURRENT.get()
+    if current is not None: return [current]
+    if threading.current_thread().name in IGNORED_THREADS: return []   # 背景輪詢不算任何請求
+    with ACTIVE_LOCK:
+        return list(ACTIVE.values()) if len(ACTIVE) == 1 else []
+
+@contextmanager
+def request(label):
+    """包住一個 webhook 請求；未開啟時完全不做事"""
+    if not refresh_enabled():
+        yield None
+        return
+    _ensure_sampler()
+    profile = RequestProfile(label)
+    token = CURRENT.set(profile)
+    with ACTIVE_LOCK:
+        ACTIVE[profile.id] = profile
+    try:
+        yield profile
+    finally:
+        CURRENT.reset(token)
+        with ACTIVE_LOCK:
+            ACTIVE.pop(profile.id, None)
+        profile.elapsed = time.perf_counter() - profile.t0
+        _finish(profile)
+
+def annotate(label):
+    """請求進行中補上標籤 (例如解析出的指令)"""
+    profile = CURRENT.get()
+    if profile is not None: profile.label = label
+
+def timed(name):
+    """記錄函式耗時為請求的一個階段，並讓取樣器在函式執行期間取樣此執行緒"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED: return func(*args, **kwargs)
+            owners = _owners()
+            if not owners: return func(*args, **kwargs)
+            ident = threading.get_ident()
+            for p in owners: p.enter_thread(ident)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                for p in owners:
+                    p.add_stage(name, start, elapsed)
+                    p.leave_thread(ident)
+        return wrapper
+    return decorator
+
+def _finish(profile):
+    summary = profile.summary()
+    if profile.elapsed >= SLOW_THRESHOLD:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{datetime.fromtimestamp(profile.started_at).strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{profile.id}.folded")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(profile.folded())
+            summary['profile_path'] = path
+            print(f"[Profiler] 🐢 慢請求 #{summary['key']} ({profile.label}) {profile.elapsed:.1f}s -> {path}")
+        except OSError as e:
+            print(f"[Warn] 效能分析檔寫入失敗: {e}")
+    summary['folded'] = profile.folded()
+    with SLOWEST_LOCK:
+        entry = (profile.elapsed, profile.id, summary)
+        evicted = None
+        if len(SLOWEST) < SLOW_KEEP:
+            heapq.heappush(SLOWEST, entry)
+        elif entry > SLOWEST[0]:
+            evicted = heapq.heapreplace(SLOWEST, entry)
+        else:
+            return
+        _save_slowest(summary, evicted)
+
+def _save_slowest(added, evicted):
+    """本 worker 的最慢清單寫回共用目錄 (堆疊另存一檔，清單只放摘要)"""
+    try:
+        _write_atomic(os.path.join(TOP_DIR, f"{added['key']}.folded"), added['folded'])
+        if evicted is not None:
+            try:
+                os.remove(os.path.join(TOP_DIR, f"{evicted[2]['key']}.folded"))
+            except OSError:
+                pass
+        _write_atomic(os.path.join(TOP_DIR, f"slowest-{os.getpid()}.json"),
+                      json.dumps(_local_slowest(), ensure_ascii=False))
+    except OSError as e:
+        print(f"[Warn] 效能分析清單寫入失敗: {e}")
+
+def _local_slowest():
+    return [{k: v for k, v in s.items() if k != 'folded'} for _, _, s in sorted(SLOWEST, reverse=True)]
+
+def slowest():
+    """所有 worker 最慢的請求摘要 (慢到快，不含堆疊內容；key 為「PID-編號」)"""
+    with SLOWEST_LOCK:
+        entries = _local_slowest()
+    mine = f"slowest-{os.getpid()}.json"
+    try:
+        names = os.listdir(TOP_DIR)
+    except OSError:
+        names = []
+    for name in names:
+        if name == mine or not (name.startswith('slowest-') and name.endswith('.json')): continue
+        try:
+            with open(os.path.join(TOP_DIR, name), 'r', encoding='utf-8') as f:
+                entries += json.load(f)
+        except (OSError, ValueError):
+            continue
+    entries.sort(key=lambda s: s['elapsed'], reverse=True)
+    return entries[:SLOW_KEEP]
+
+def get_folded(key):
+    """key 為 slowest() 的「PID-編號」；本 worker 的從記憶體取，其他 worker 的讀共用目錄"""
+    if not re.fullmatch(r'\d+-\d+', key): return None
+    with SLOWEST_LOCK:
+        for _, _, summary in SLOWEST:
+            if summary['key'] == key: return summary['folded']
+    try:
+        with open(os.path.join(TOP_DIR, f"{key}.folded"), 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None
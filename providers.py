@@ -0,0 +1,225 @@
+import requests
+import pandas as pd
+import numpy as np
+import json
+import os
+import concurrent.futures
+from abc import ABC, abstractmethod
+import bar_store
+import market_snapshot
+import institutional_flows
+import revenue
+import http_archive
+
+try:
+    import yfinance as yf
+except ImportError:
+    yf = None
+
+# ========================================================
+# 🔌 左側雷達資料來源 (可抽換介面)
+# 三層漏斗只透過這個介面取資料，每個方法都是「整批代號一次查」：
+#   LiveProviders  -> 正式環境 (日K庫 / Yahoo 多檔批次、交易所 OpenAPI 全市場表、法人索引)
+#   LocalProviders -> 離線替身 (讀本地檔案)，用於回歸測試與效能量測
+# ========================================================
+
+YAHOO_CHUNK_SIZE = 100   # Yahoo 單次請求的代號數
+YAHOO_WORKERS = 4        # 同時進行的批次請求數
+
+STOCK_LIST_PATH = 'stock_list.json'
+
+class LeftSideProviders(ABC):
+    """介面定義：子類別需實作以下整批查詢方法 (少實作任何一個，建構時就會報錯)"""
+    stock_list_path = STOCK_LIST_PATH
+
+    def stock_meta(self):
+        """基礎股票池 (stock_list.json 格式)"""
+        with open(self.stock_list_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @abstractmethod
+    def snapshot(self):
+        """當日全市場快照 (格式同 market_snapshot.load_market_snapshot)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def bar_matrix(self, codes, days, markets=None):
+        """{欄位: (代號數 × days) 矩陣}，欄位含 close/high/low/volume，舊到新，無資料為 NaN"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def fundamentals(self, codes):
+        """{代號: {"eps": 近一季 EPS, "yield_rate": 殖利率 %}}"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def revenue_yoy(self, codes):
+        """{代號: get_finmind_revenue_yoy 格式的字典}"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def chip_history(self, codes, days):
+        """{代號: 近 days 日每日法人 (外資+投信) 淨買張數，新到舊}"""
+        raise NotImplementedError
+
+# ---------------------------------------------------------
+# 🌐 正式環境
+# ---------------------------------------------------------
+def _pick(row, *keys):
+    for k in keys:
+        if k in row and str(row[k]).strip() not in ('', '-', '--', 'N/A'):
+            return str(row[k]).replace(',', '').strip()
+    return None
+
+def _to_float(val, default=0.0):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return default
+
+def download_bars_yahoo(codes, markets, days):
+    """Yahoo 多檔批次下載：每批 YAHOO_CHUNK_SIZE 檔一個請求，多批並行"""
+    if yf is None: raise RuntimeError("未安裝 yfinance")
+    tickers = [f"{c}.{markets.get(c, 'TW')}" for c in codes]
+    chunks = [tickers[i:i + YAHOO_CHUNK_SIZE] for i in range(0, len(tickers), YAHOO_CHUNK_SIZE)]
+    period = "6mo" if days <= 120 else "2y"
+
+    def download(chunk):
+        # yfinance 使用自己的連線，錄製 / 重播時以下載結果整包存取
+        return http_archive.archived_call(f"yfinance {period} {','.join(chunk)}", lambda: yf.download(
+            chunk, period=period, interval="1d", group_by="column",
+            auto_adjust=False, threads=False, progress=False, timeout=20))
+
+    frames = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=YAHOO_WORKERS) as executor:
+        for chunk, future in [(c, executor.submit(download, c)) for c in chunks]:
+            try:
+                frames.append(future.result())
+            except Exception as e:
+                print(f"⚠️ Yahoo 批次下載失敗 ({chunk[0]}...): {e}")
+
+    out = {}
+    for field, col in [('close', 'Close'), ('high', 'High'), ('low', 'Low'), ('volume', 'Volume')]:
+        parts = [df[col] for df in frames if not df.empty and col in df.columns.get_level_values(0)]
+        wide = pd.concat(parts, axis=1).sort_index() if parts else pd.DataFrame()
+        wide = wide.reindex(columns=tickers).tail(days)
+        out[field] = wide.to_numpy(dtype=float).T if not wide.empty else np.full((len(codes), 0), np.nan)
+    return out
+
+def fetch_bulk_fundamentals():
+    """交易所 OpenAPI 全市場表：上市/上櫃最新一季 EPS 與殖利率，共 4 個請求"""
+    sources = {
+        "eps_twse": "https://openapi.twse.com.tw/v1/opendata/t187ap14_L",
+        "eps_tpex": "https://www.tpex.org.tw/openapi/v1/mopsfin_t187ap14_O",
+        "yield_twse": "https://openapi.twse.com.tw/v1/exchangeReport/BWIBBU_ALL",
+        "yield_tpex": "https://www.tpex.org.tw/openapi/v1/tpex_mainboard_peratio_analysis",
+    }
+
+    def get(url):
+        return requests.get(url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=20).json()
+
+    result = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        futures = {name: executor.submit(get, url) for name, url in sources.items()}
+        for name, future in futures.items():
+            try:
+                rows = future.result()
+            except Exception as e:
+                print(f"⚠️ 全市場基本面 ({name}) 抓取失敗: {e}")
+                continue
+            for row in rows:
+                code = _pick(row, '公司代號', 'SecuritiesCompanyCode', 'Code')
+                if not code: continue
+                info = result.setdefault(code, {"eps": 0.0, "yield_rate": 0.0})
+                if name.startswith('eps'):
+                    info['eps'] = _to_float(_pick(row, '基本每股盈餘(元)', '基本每股盈餘', 'BasicEarningsPerShare', 'EPS'))
+                else:
+                    info['yield_rate'] = _to_float(_pick(row, 'DividendYield', 'YieldRatio', '殖利率(%)'))
+    return result
+
+class LiveProviders(LeftSideProviders):
+    """正式環境：日K優先讀本地庫 (不足時改 Yahoo 批次)，基本面/營收/籌碼皆為全市場批次"""
+    def __init__(self, bars=None, revenue_lookup=None, chips_lookup=None, snapshot=None):
+        self.bars = bars
+        self.revenue_lookup = revenue_lookup   # 單檔備援查詢 (全市場表缺資料時使用)
+        self.chips_lookup = chips_lookup
+        self._snapshot = snapshot
+        self._fundamentals = None
+
+    def snapshot(self):
+        if self._snapshot is None:
+            self._snapshot = market_snapshot.load_market_snapshot()
+        return self._snapshot
+
+    def bar_matrix(self, codes, days, markets=None):
+        if self.bars is None:
+            self.bars = bar_store.BarStore.load()
+        if len(self.bars.dates) >= days and all(c in self.bars.code_index for c in codes):
+            return {f: self.bars.window(f, days, codes) for f in ['close', 'high', 'low', 'volume']}
+        print(f"🌐 本地日K庫不足 {days} 天，改用 Yahoo 多檔批次下載 {len(codes)} 檔...")
+        return download_bars_yahoo(codes, markets or {}, days)
+
+    def fundamentals(self, codes):
+        if self._fundamentals is None:
+            self._fundamentals = fetch_bulk_fundamentals()
+        return {c: self._fundamentals.get(c, {"eps": 0.0, "yield_rate": 0.0}) for c in codes}
+
+    def revenue_yoy(self, codes):
+        if codes and not revenue.has_revenue():
+            revenue.load_revenue_table()
+        out = {}
+        for c in codes:
+            out[c] = revenue.get_revenue_yoy(c) or (self.revenue_lookup(c) if self.revenue_lookup else {"yoy": 0.0})
+        return out
+
+    def chip_history(self, codes, days):
+        if codes and not institutional_flows.has_flows(days):
+            institutional_flows.load_market_flows(days=days)
+        if institutional_flows.has_flows(days):
+            return {c: [f + t for f, t in institutional_flows.get_flow_history(c, days)] for c in codes}
+        return {c: self.chips_lookup(c, days) if self.chips_lookup else [] for c in codes}
+
+# ---------------------------------------------------------
+# 💾 離線替身
+# ---------------------------------------------------------
+class LocalProviders(LeftSideProviders):
+    """從本地目錄讀取所有資料，完全不連網：
+        snapshot.csv / bars/ (BarStore 格式) / fundamentals.json / revenue.json / chips.json"""
+    def __init__(self, root):
+        self.root = root
+        self.stock_list_path = os.path.join(root, 'stock_list.json')
+        self.bars = bar_store.BarStore.load(os.path.join(root, 'bars'))
+
+    def _json(self, name):
+        path = os.path.join(self.root, name)
+        if not os.path.exists(path): return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def snapshot(self):
+        df = pd.read_csv(os.path.join(self.root, 'snapshot.csv'), dtype={'code': str})
+        df.attrs['date'] = pd.Timestamp(self.bars.dates[-1]).date() if self.bars.dates else None
+        return df
+
+    def bar_matrix(self, codes, days, markets=None):
+        known = [c for c in codes if c in self.bars.code_index]
+        out = {}
+        for f in ['close', 'high', 'low', 'volume']:
+            mat = np.full((len(codes), min(days, len(self.bars.dates))), np.nan)
+            if known:
+                rows = [codes.index(c) for c in known]
+                mat[rows] = self.bars.window(f, days, known)
+            out[f] = mat
+        return out
+
+    def fundamentals(self, codes):
+        data = self._json('fundamentals.json')
+        return {c: data.get(c, {"eps": 0.0, "yield_rate": 0.0}) for c in codes}
+
+    def revenue_yoy(self, codes):
+        data = self._json('revenue.json')
+        return {c: data.get(c, {"yoy": 0.0}) for c in codes}
+
+    def chip_history(self, codes, days):
+        data = self._json('chips.json')
+        return {c: data.get(c, [])[:days] for c in codes}
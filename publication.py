@@ -0,0 +1,101 @@
+import json
+import gzip
+import hashlib
+import os
+
+# ========================================================
+# 📦 每日發布格式 (generator 產出、bot 讀取，兩邊共用，不依賴 pandas)
+#   published/manifest.json     -> 日期、schema 版本、內容雜湊、各產物筆數 (幾百 bytes)
+#   published/bundle.json       -> 所有產物打包成一份精簡 JSON (無縮排、無 debug 欄位)
+#   published/bundle.json.gz    -> 同上的 gzip 版本
+# 表格型產物以「欄位 + 列」存放，欄位名稱不會每列重複一次。
+# 每個產物各自帶 date：當日產線失敗而沿用上一版的產物保留原本的資料日期，bot 顯示時不會標成新日期。
+# bot 先讀 manifest，雜湊沒變就不下載 bundle。
+# ========================================================
+
+SCHEMA_VERSION = 1
+PUBLISH_DIR = 'published'
+MANIFEST_NAME = 'manifest.json'
+BUNDLE_NAME = 'bundle.json'
+DROP_FIELDS = {'debug_info'}   # 只供開發查核，不發布
+
+def encode_table(rows):
+    """[{...}, ...] -> {"columns": [...], "rows": [[...], ...]}"""
+    columns = []
+    for row in rows:
+        for k in row:
+            if k not in DROP_FIELDS and k not in columns: columns.append(k)
+    return {"columns": columns, "rows": [[row.get(c) for c in columns] for row in rows]}
+
+def decode_table(table):
+    columns = table.get('columns', [])
+    return [dict(zip(columns, row)) for row in table.get('rows', [])]
+
+def content_hash(raw):
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+def _dump(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def load_bundle(root=PUBLISH_DIR):
+    try:
+        with open(os.path.join(root, BUNDLE_NAME), 'rb') as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+def publish(artifacts, date_str, root=PUBLISH_DIR):
+    """artifacts: {名稱: 列表 (表格) 或字典}；值為 None 的產物沿用上一版 (例如當日產線失敗)，
+    沿用的產物保留上一版的 date；內容與上一版相同時不改寫任何檔案，回傳 manifest"""
+    previous = load_bundle(root) or {}
+    bundle = {"schema": SCHEMA_VERSION, "date": date_str, "artifacts": {}}
+    for name, value in artifacts.items():
+        if value is None:
+            if name in previous.get('artifacts', {}):
+                old = previous['artifacts'][name]
+                bundle['artifacts'][name] = {**old, "date": old.get('date') or previous.get('date')}
+            continue
+        encoded = {"kind": "table", **encode_table(value)} if isinstance(value, list) else {"kind": "object", "data": value}
+        bundle['artifacts'][name] = {**encoded, "date": date_str}
+
+    raw = _dump(bundle)
+    digest = content_hash(raw)
+    manifest_path = os.path.join(root, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            old_manifest = json.load(f)
+        if old_manifest.get('hash') == digest: return old_manifest
+    except (OSError, ValueError):
+        pass
+
+    os.makedirs(root, exist_ok=True)
+    packed = gzip.compress(raw, mtime=0)   # mtime=0：相同內容產生相同位元組，git 不會出現假變動
+    with open(os.path.join(root, BUNDLE_NAME), 'wb') as f:
+        f.write(raw)
+    with open(os.path.join(root, BUNDLE_NAME + '.gz'), 'wb') as f:
+        f.write(packed)
+    manifest = {
+        "schema": SCHEMA_VERSION,
+        "date": date_str,
+        "hash": digest,
+        "bytes": len(raw),
+        "gzip_bytes": len(packed),
+        "artifacts": {
+            name: {"rows": len(a['rows']) if a['kind'] == 'table' else len(a['data']), "date": a.get('date')}
+            for name, a in bundle['artifacts'].items()
+        },
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return manifest
+
+def parse_bundle(raw, gzipped=False):
+    """bundle 位元組 -> {產物名稱: 列表或字典}"""
+    if gzipped: raw = gzip.decompress(raw)
+    bundle = json.loads(raw)
+    if bundle.get('schema', 0) > SCHEMA_VERSION:
+        print(f"[Warn] 發布格式版本 {bundle.get('schema')} 比程式支援的 {SCHEMA_VERSION} 新，嘗試照舊解析")
+    return {
+        name: decode_table(a) if a.get('kind') == 'table' else a.get('data')
+        for name, a in bundle.get('artifacts', {}).items()
+    }
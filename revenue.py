@@ -0,0 +1,183 @@
+import requests
+import pandas as pd
+import numpy as np
+import os
+from datetime import datetime, timedelta
+from io import StringIO
+import trading_calendar
+import run_report
+
+# ========================================================
+# 📈 全市場月營收 (公開資訊觀測站彙總表)
+# 每月只需下載一次全市場營收，以 (代號, 年, 月) 建立索引，
+# 一次向量化算出所有公司的 YoY / MoM / 近三月 YoY，
+# 取代 get_finmind_revenue_yoy 每檔一個 HTTP 請求的做法。
+# ========================================================
+
+CACHE_DIR = os.environ.get('DATA_CACHE_DIR', 'data_cache')
+REVENUE_DIR = os.path.join(CACHE_DIR, 'revenue')
+RELEASE_DAY = 10       # 上市櫃公司需於每月 10 日前公布上月營收
+HISTORY_MONTHS = 16    # 近三月 YoY 需要 t-14 ~ t，多抓一個月給尚未公布本期的公司
+
+REVENUE_TABLE = None   # 代號為索引的成長率表 (load_revenue_table 後可用)
+
+def _period(year, month):
+    return year * 12 + (month - 1)
+
+def _period_str(period):
+    return f"{period // 12}/{period % 12 + 1}"
+
+def latest_released_period(now=None):
+    """本期營收月份 (上個月) 的期間序號；公布期限前只有部分公司已公布"""
+    if now is None:
+        now = trading_calendar.tw_now()
+    return _period(now.year, now.month) - 1
+
+def fetch_month_revenue(year, month):
+    """下載單月上市 (sii) + 上櫃 (otc) 營收彙總表，回傳 DataFrame[code, revenue] (單位：元)"""
+    frames = []
+    for market in ['sii', 'otc']:
+        url = f"https://mopsov.twse.com.tw/nas/t21/{market}/t21sc03_{year - 1911}_{month}_0.html"
+        try:
+            res = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=20)
+            res.encoding = 'big5'
+            for df in pd.read_html(StringIO(res.text)):
+                # 彙總表依產業拆成多張表，欄位為兩層表頭，攤平後找「公司代號」與「當月營收」
+                cols = [' '.join(str(x) for x in c) if isinstance(c, tuple) else str(c) for c in df.columns]
+                idx_code = next((i for i, c in enumerate(cols) if '公司代號' in c), None)
+                idx_rev = next((i for i, c in enumerate(cols) if '當月營收' in c), None)
+                if idx_code is None or idx_rev is None: continue
+                part = pd.DataFrame({'code': df.iloc[:, idx_code].astype(str).str.strip(), 'revenue': df.iloc[:, idx_rev]})
+                frames.append(part)
+        except Exception as e:
+            print(f"⚠️ 營收彙總表抓取失敗 ({market} {year}/{month}): {e}")
+
+    if not frames: return pd.DataFrame(columns=['code', 'revenue'])
+    out = pd.concat(frames, ignore_index=True)
+    out = out[out['code'].str.fullmatch(r'\d{4}')]
+    # 觀測站單位為「千元」，轉為元以與 FinMind 數據一致
+    out['revenue'] = pd.to_numeric(out['revenue'].astype(str).str.replace(',', ''), errors='coerce') * 1000
+    return out.dropna().drop_duplicates('code')
+
+def _is_partial(year, month):
+    """檔案是在公布期限前下載的 -> 可能缺少晚公布的公司，需要重新下載"""
+    path = os.path.join(REVENUE_DIR, f"{year}_{month:02d}.csv")
+    if not os.path.exists(path): return False
+    next_y, next_m = (year + 1, 1) if month == 12 else (year, month + 1)
+    deadline = datetime(next_y, next_m, RELEASE_DAY) + timedelta(days=1)
+    return datetime.fromtimestamp(os.path.getmtime(path)) < deadline
+
+def load_month_revenue(year, month, refresh=False):
+    """讀取本地快取的單月營收，無快取 (或 refresh) 才下載"""
+    path = os.path.join(REVENUE_DIR, f"{year}_{month:02d}.csv")
+    if os.path.exists(path) and not refresh:
+        run_report.cache("revenue_month", True)
+        return pd.read_csv(path, dtype={'code': str})
+    run_report.cache("revenue_month", False)
+    df = fetch_month_revenue(year, month)
+    if not df.empty:
+        os.makedirs(REVENUE_DIR, exist_ok=True)
+        df.to_csv(path, index=False)
+    return df
+
+def _shifted(arr, k):
+    out = np.full_like(arr, np.nan)
+    out[:, k:] = arr[:, :-k]
+    return out
+
+def _revenue_matrix(long_df):
+    """long_df[code, period, revenue] -> (代號索引, 期間陣列, 代號 × 連續月份 營收矩陣)"""
+    wide = long_df.pivot_table(index='code', columns='period', values='revenue', aggfunc='last')
+    # 補齊連續月份欄位，讓「往前 12 欄」精準等於去年同月
+    full = range(int(wide.columns.min()), int(wide.columns.max()) + 1)
+    return wide.index, np.array(full), wide.reindex(columns=full).to_numpy(dtype=float)
+
+def compute_growth_table(long_df):
+    """long_df[code, period, revenue] -> 每家公司最新一期的 YoY / MoM / 近三月 YoY (向量化)"""
+    codes, periods, rev = _revenue_matrix(long_df)
+    shifted = _shifted
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        last_year = shifted(rev, 12)
+        yoy = np.where(last_year > 0, (rev - last_year) / last_year * 100, np.nan)
+        prev = shifted(rev, 1)
+        mom = np.where(prev > 0, (rev - prev) / prev * 100, np.nan)
+        sum3 = rev + shifted(rev, 1) + shifted(rev, 2)
+        sum3_ly = shifted(sum3, 12)
+        yoy_3m = np.where(sum3_ly > 0, (sum3 - sum3_ly) / sum3_ly * 100, np.nan)
+
+    # 每家公司取「最新一個算得出 YoY」的月份 (等同舊版從最新月份往回找)
+    valid = ~np.isnan(yoy)
+    has_any = valid.any(axis=1)
+    last_col = rev.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    rows = np.arange(rev.shape[0])
+
+    table = pd.DataFrame({
+        'period': periods[last_col],
+        'yoy': np.round(yoy[rows, last_col], 2),
+        'mom': np.round(mom[rows, last_col], 2),
+        'yoy_3m': np.round(yoy_3m[rows, last_col], 2),
+        'this_rev': rev[rows, last_col],
+        'last_rev': last_year[rows, last_col],
+    }, index=codes)
+    return table[has_any]
+
+def load_revenue_table(now=None):
+    """載入 (或使用快取) 近 HISTORY_MONTHS 個月全市場營收並計算成長率表，回傳檔數"""
+    global REVENUE_TABLE
+    latest = latest_released_period(now)
+    frames = []
+    for period in range(latest - HISTORY_MONTHS + 1, latest + 1):
+        year, month = period // 12, period % 12 + 1
+        # 已完整公布的月份只會下載一次；本期月份在期限前每次執行都補抓新公布的公司
+        df = load_month_revenue(year, month, refresh=_is_partial(year, month))
+        if not df.empty:
+            frames.append(df.assign(period=period))
+
+    if not frames:
+        print("⚠️ 全市場營收載入失敗，將改用逐檔查詢")
+        return 0
+    REVENUE_TABLE = compute_growth_table(pd.concat(frames, ignore_index=True))
+    print(f"📈 全市場營收成長率表完成：{len(REVENUE_TABLE)} 家公司 (最新月份 {_period_str(latest)})")
+    return len(REVENUE_TABLE)
+
+def load_yoy_history(months=HISTORY_MONTHS + 36, now=None):
+    """回測用：近 months 個月的 (代號 × 期間) YoY 矩陣；已快取的月份不重新下載"""
+    latest = latest_released_period(now)
+    frames = []
+    for period in range(latest - months + 1, latest + 1):
+        df = load_month_revenue(period // 12, period % 12 + 1)
+        if not df.empty:
+            frames.append(df.assign(period=period))
+    if not frames: return pd.DataFrame()
+    codes, periods, rev = _revenue_matrix(pd.concat(frames, ignore_index=True))
+    last_year = _shifted(rev, 12)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        yoy = np.where(last_year > 0, (rev - last_year) / last_year * 100, np.nan)
+    return pd.DataFrame(yoy, index=codes, columns=periods)
+
+def available_period(d):
+    """日期 d 當下確定已全數公布的最新營收月份 (過了 RELEASE_DAY 才算上個月)"""
+    return _period(d.year, d.month) - (1 if d.day > RELEASE_DAY else 2)
+
+def has_revenue():
+    return REVENUE_TABLE is not None and not REVENUE_TABLE.empty
+
+def get_revenue_yoy(code):
+    """與 get_finmind_revenue_yoy 相同格式的回傳值；查無資料回傳 None"""
+    if not has_revenue() or code not in REVENUE_TABLE.index: return None
+    row = REVENUE_TABLE.loc[code]
+    period = int(row['period'])
+    t_rev = int(row['this_rev']); l_rev = int(row['last_rev'])
+    return {
+        "yoy": float(row['yoy']),
+        "mom": None if pd.isna(row['mom']) else float(row['mom']),
+        "yoy_3m": None if pd.isna(row['yoy_3m']) else float(row['yoy_3m']),
+        "debug_info": {
+            "this_rev": t_rev,
+            "last_rev": l_rev,
+            "this_period": _period_str(period),
+            "last_period": _period_str(period - 12),
+            "formula": f"({t_rev} - {l_rev}) / {l_rev}"
+        }
+    }
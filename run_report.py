@@ -0,0 +1,194 @@
+import sys
+import os
+import json
+import time
+import threading
+import statistics
+from datetime import datetime
+from urllib.parse import urlsplit
+import requests
+import http_archive
+
+# ========================================================
+# 📋 產線執行報告與效能回歸檢查 (generator 使用，只依賴標準庫 + requests)
+# 每次執行結束寫一份 JSON 到 data_cache/run_reports/ (跟著 Action 的資料快取保留)：
+#   - 各階段牆鐘秒數與狀態
+#   - 每個主機的 HTTP 次數、下載位元組、錯誤次數、累計秒數
+#   - 重試 / 等待次數與秒數、各快取命中 / 未命中、各漏斗層的檔數
+# `python run_report.py` 以前 N 次執行的中位數為基準比對最新一份報告，
+# 上游變慢或不小心寫出逐檔打 API 的迴圈 (呼叫次數暴增) 都會被標出來，有回歸時結束碼為 1。
+# ========================================================
+
+CACHE_DIR = os.environ.get('DATA_CACHE_DIR', 'data_cache')
+REPORT_DIR = os.environ.get('RUN_REPORT_DIR', os.path.join(CACHE_DIR, 'run_reports'))
+REPORT_KEEP = 60          # 最多保留幾份報告
+BASELINE_RUNS = 7         # 以前幾次執行為基準
+MIN_BASELINE = 3          # 基準不足幾份時不做判定 (資料太少，中位數沒有意義)
+REGRESSION_RATIO = 1.5    # 超過基準中位數幾倍算回歸
+MIN_DELTA = {             # 絕對差距門檻：小數值的倍數波動不算回歸
+    "seconds": 10,        # 階段耗時 (秒)
+    "calls": 20,          # 單一主機呼叫次數
+    "bytes": 5 * 1024 * 1024,
+    "counter": 10,        # 重試 / 等待次數
+}
+
+_LOCK = threading.Lock()
+HTTP = {}       # 主機 -> {calls, bytes, errors, seconds}
+COUNTERS = {}   # 名稱 -> 數值 (重試次數、等待秒數...)
+CACHE = {}      # 名稱 -> {hit, miss}
+FUNNEL = {}     # 產線 -> {層名稱: 檔數} (依加入順序)
+_ORIGINAL_REQUEST = requests.Session.request
+_ORIGINAL_PAUSE = http_archive.pause
+_INSTALLED = False
+
+def count(name, n=1):
+    with _LOCK:
+        COUNTERS[name] = COUNTERS.get(name, 0) + n
+
+def cache(name, hit, n=1):
+    """快取命中 / 未命中各記一筆 (n 為筆數，例如檢查點一次沿用多檔)"""
+    if n <= 0: return
+    with _LOCK:
+        entry = CACHE.setdefault(name, {"hit": 0, "miss": 0})
+        entry["hit" if hit else "miss"] += n
+
+def funnel(name, layer, n):
+    """記錄漏斗某一層剩下的檔數"""
+    with _LOCK:
+        FUNNEL.setdefault(name, {})[layer] = int(n)
+
+def _counted_request(session, method, url, **kwargs):
+    host = urlsplit(url).netloc
+    t0 = time.perf_counter()
+    error = False
+    size = 0
+    try:
+        response = _ORIGINAL_REQUEST(session, method, url, **kwargs)
+        error = response.status_code >= 400
+        # stream=True 時不讀取內容 (會破壞呼叫端的串流)，改用 Content-Length
+        size = int(response.headers.get('Content-Length') or 0) if kwargs.get('stream') else len(response.content)
+        return response
+    except Exception:
+        error = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        with _LOCK:
+            entry = HTTP.setdefault(host, {"calls": 0, "bytes": 0, "errors": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["bytes"] += size
+            entry["errors"] += int(error)
+            entry["seconds"] += elapsed
+
+def _counted_pause(seconds):
+    if not http_archive.is_replaying():
+        count("pauses")
+        count("pause_seconds", seconds)
+    return _ORIGINAL_PAUSE(seconds)
+
+def install():
+    """攔截 requests 與禮貌性等待；在 http_archive.install() 之後呼叫 (重播時計的是回放次數)"""
+    global _ORIGINAL_REQUEST, _ORIGINAL_PAUSE, _INSTALLED
+    if _INSTALLED: return
+    _ORIGINAL_REQUEST = requests.Session.request
+    requests.Session.request = _counted_request
+    _ORIGINAL_PAUSE = http_archive.pause
+    http_archive.pause = _counted_pause
+    _INSTALLED = True
+
+def build(pipe):
+    """彙整本次執行的報告 (pipe 為執行完的 pipeline.Pipeline)"""
+    stages = {name: {"status": pipe.status.get(name, 'skipped'),
+                     "seconds": round(pipe.timings[name], 2) if name in pipe.timings else None}
+              for name in pipe.stages}
+    with _LOCK:
+        return {
+            "finished_at": datetime.now().isoformat(timespec='seconds'),
+            "archive_mode": http_archive.ARCHIVE.mode if http_archive.ARCHIVE is not None else 'off',
+            "total_seconds": round(pipe.timings.get('(total)', 0), 2),
+            "stages": stages,
+            "http": {host: {**v, "seconds": round(v["seconds"], 2)} for host, v in sorted(HTTP.items())},
+            "counters": {k: round(v, 2) for k, v in sorted(COUNTERS.items())},
+            "cache": {k: dict(v) for k, v in sorted(CACHE.items())},
+            "funnel": {k: dict(v) for k, v in FUNNEL.items()},
+        }
+
+def save(report, root=REPORT_DIR):
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f"run-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    for old in list_reports(root)[:-REPORT_KEEP]:
+        os.remove(old)
+    print(f"📋 執行報告已寫入 {path}")
+    return path
+
+def list_reports(root=REPORT_DIR):
+    """舊到新 (檔名含時間戳記，字典序即時間序)"""
+    if not os.path.isdir(root): return []
+    return [os.path.join(root, name) for name in sorted(os.listdir(root)) if name.startswith('run-') and name.endswith('.json')]
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _metrics(report):
+    """報告攤平成 {(類別, 名稱): (數值, 絕對門檻)}，供逐項比對"""
+    out = {("total", "合計"): (report.get("total_seconds", 0), MIN_DELTA["seconds"])}
+    for name, s in report.get("stages", {}).items():
+        if s.get("status") == 'ok' and s.get("seconds") is not None:
+            out[("stage", name)] = (s["seconds"], MIN_DELTA["seconds"])
+    for host, h in report.get("http", {}).items():
+        out[("calls", host)] = (h["calls"], MIN_DELTA["calls"])
+        out[("bytes", host)] = (h["bytes"], MIN_DELTA["bytes"])
+        out[("errors", host)] = (h["errors"], MIN_DELTA["counter"])
+    for name, v in report.get("counters", {}).items():
+        out[("counter", name)] = (v, MIN_DELTA["seconds"] if name.endswith("_seconds") else MIN_DELTA["counter"])
+    return out
+
+def compare(report, baselines, ratio=REGRESSION_RATIO):
+    """回傳 (回歸清單, 提醒清單)；基準為各指標在 baselines 中的中位數 (某次沒出現的指標視為 0)"""
+    baselines = [b for b in baselines if b.get("archive_mode") == report.get("archive_mode")]  # 重播與連網不互比
+    if len(baselines) < MIN_BASELINE: return [], [f"基準報告只有 {len(baselines)} 份 (需要 {MIN_BASELINE} 份)，略過比對"]
+    history = [_metrics(b) for b in baselines]
+    regressions = []
+    for key, (value, min_delta) in _metrics(report).items():
+        base = statistics.median(h[key][0] if key in h else 0 for h in history)
+        if value > base * ratio and value - base >= min_delta:
+            regressions.append(f"{key[0]} {key[1]}: {value:g} (基準 {base:g}，{value / base:.1f} 倍)" if base
+                               else f"{key[0]} {key[1]}: {value:g} (基準 0)")
+    notes = []
+    # 漏斗與快取不算效能回歸，但「某一層突然歸零」或「快取幾乎全部失效」通常代表上游資料出了問題
+    for name, layers in report.get("funnel", {}).items():
+        for layer, n in layers.items():
+            base = statistics.median(b.get("funnel", {}).get(name, {}).get(layer, 0) for b in baselines)
+            if n == 0 and base > 0:
+                notes.append(f"漏斗 {name}/{layer}: 0 檔 (基準 {base:g} 檔)")
+    for name, c in report.get("cache", {}).items():
+        total = c["hit"] + c["miss"]
+        rates = [b["cache"][name]["hit"] / max(1, b["cache"][name]["hit"] + b["cache"][name]["miss"])
+                 for b in baselines if name in b.get("cache", {})]
+        if total and rates and c["hit"] / total < statistics.median(rates) - 0.5:
+            notes.append(f"快取 {name}: 命中率 {c['hit'] / total:.0%} (基準 {statistics.median(rates):.0%})")
+    return regressions, notes
+
+def check_latest(runs=BASELINE_RUNS, root=REPORT_DIR):
+    """最新一份報告對前 runs 份比對並輸出，回傳回歸數"""
+    paths = list_reports(root)
+    if not paths:
+        print("📋 沒有任何執行報告")
+        return 0
+    report = load(paths[-1])
+    regressions, notes = compare(report, [load(p) for p in paths[-runs - 1:-1]])
+    print(f"\n📋 效能回歸檢查：{os.path.basename(paths[-1])} vs 前 {min(runs, len(paths) - 1)} 次執行")
+    for line in regressions:
+        print(f"   🐢 {line}")
+    for line in notes:
+        print(f"   ⚠️ {line}")
+    if not regressions: print("   ✅ 未發現效能回歸")
+    return len(regressions)
+
+if __name__ == "__main__":
+    # 用法：python run_report.py [基準次數]
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else BASELINE_RUNS
+    sys.exit(1 if check_latest(runs) else 0)
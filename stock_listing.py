@@ -0,0 +1,64 @@
+import json
+import hashlib
+
+# ========================================================
+# 📇 股票清單差異比對 (generator 與 bot 共用，不依賴 pandas)
+# generator 每日重抓上市/上櫃 ISIN 頁面，只有清單真的變動才重寫 stock_list.json，
+# 並輸出一份差異檔 stock_list_delta.json (新上市 / 下市 / 更名或改分類)，
+# bot 端只需套用差異即可熱更新，不必重新部署。
+# ========================================================
+
+STOCK_LIST_PATH = 'stock_list.json'
+DELTA_PATH = 'stock_list_delta.json'
+
+def listing_hash(stock_map):
+    """清單內容指紋 (與 key 順序無關)，generator 與 bot 用來確認差異檔的基準版本"""
+    raw = json.dumps(stock_map, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+def diff_listing(old_map, new_map):
+    """新上市 / 下市 / 內容變動 (更名、改分類)"""
+    added = {c: new_map[c] for c in new_map if c not in old_map}
+    removed = [c for c in old_map if c not in new_map]
+    changed = {c: {"old": old_map[c], "new": new_map[c]} for c in new_map if c in old_map and old_map[c] != new_map[c]}
+    return {"added": added, "removed": removed, "changed": changed}
+
+def apply_delta(stock_map, delta):
+    """把差異檔套用到現有清單 (原地修改)"""
+    for code in delta.get('removed', []):
+        stock_map.pop(code, None)
+    for code, meta in delta.get('added', {}).items():
+        stock_map[code] = meta
+    for code, change in delta.get('changed', {}).items():
+        stock_map[code] = change['new']
+    return stock_map
+
+def sector_group(sector):
+    """產業歸戶：去掉「業」「工業」字尾，讓「半導體業」與自訂標籤「半導體」算同一組；無分類回傳空字串"""
+    sector = (sector or '').strip()
+    if sector in ('', '無', '未知產業'): return ''
+    for suffix in ('工業', '業'):
+        if sector.endswith(suffix) and len(sector) > len(suffix) + 1:
+            return sector[:-len(suffix)]
+    return sector
+
+def load_stock_list(path=STOCK_LIST_PATH):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_if_changed(new_map, date_str, path=STOCK_LIST_PATH, delta_path=DELTA_PATH):
+    """與上一版比對；有變動才重寫清單並輸出差異檔，回傳差異 (無變動時為 None)"""
+    old_map = load_stock_list(path)
+    delta = diff_listing(old_map, new_map)
+    if not (delta['added'] or delta['removed'] or delta['changed']):
+        return None
+
+    delta.update({"date": date_str, "base_hash": listing_hash(old_map) if old_map else None, "hash": listing_hash(new_map)})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(new_map, f, ensure_ascii=False, indent=2)
+    with open(delta_path, 'w', encoding='utf-8') as f:
+        json.dump(delta, f, ensure_ascii=False, indent=2)
+    return delta
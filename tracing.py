@@ -0,0 +1,168 @@
+import sys
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+import functools
+import concurrent.futures
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlsplit
+import requests
+
+# ========================================================
+# 🧵 請求追蹤 (bot 使用，預設關閉：TRACE_REQUESTS=1 開啟)
+# 每個 LINE 事件一個 trace id，以 contextvars 帶進：
+#   - TracedExecutor 送出的每個工作 (包含 fetch_data_light 內層的巢狀執行緒池)
+#   - 所有經由 requests 發出的 HTTP 請求 (記錄主機、狀態碼、回應大小，不記錄查詢參數以免洩漏金鑰)
+# span 結束時寫一行 JSON 到 data_cache/traces/traces-YYYYMMDD.jsonl，供離線分析延遲。
+# 開啟時 print 輸出也會自動加上 [trace id] 前綴，多人同時查詢的 log 才分得開。
+# ========================================================
+
+CACHE_DIR = os.environ.get('DATA_CACHE_DIR', 'data_cache')
+TRACE_DIR = os.environ.get('TRACE_DIR', os.path.join(CACHE_DIR, 'traces'))
+ENABLED = os.environ.get('TRACE_REQUESTS', '0') == '1'
+
+TRACE_ID = contextvars.ContextVar('trace_id', default=None)
+SPAN_ID = contextvars.ContextVar('span_id', default=None)
+_WRITE_LOCK = threading.Lock()
+_ORIGINAL_REQUEST = requests.Session.request
+_INSTALLED = False
+
+def new_id(n=16):
+    return uuid.uuid4().hex[:n]
+
+def current_trace():
+    return TRACE_ID.get()
+
+def _export(record):
+    path = os.path.join(TRACE_DIR, f"traces-{datetime.now().strftime('%Y%m%d')}.jsonl")
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _WRITE_LOCK:
+        try:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError:
+            pass   # 追蹤資料寫不進去不能影響回覆
+
+@contextmanager
+def span(name, **attrs):
+    """一個計時區段；結束時匯出 (未開啟或不在 trace 內時不做事)"""
+    trace_id = TRACE_ID.get()
+    if not ENABLED or trace_id is None:
+        yield attrs
+        return
+    span_id = new_id(8)
+    parent = SPAN_ID.get()
+    token = SPAN_ID.set(span_id)
+    started = time.time(); t0 = time.perf_counter()
+    try:
+        yield attrs   # 呼叫端可以在區段內補充屬性 (狀態碼、位元組數...)
+    except Exception as e:
+        attrs['error'] = f"{type(e).__name__}: {e}"[:200]
+        raise
+    finally:
+        SPAN_ID.reset(token)
+        _export({"trace": trace_id, "span": span_id, "parent": parent, "name": name,
+                 "start": round(started, 3), "duration_ms": round((time.perf_counter() - t0) * 1000, 1),
+                 "thread": threading.current_thread().name, **attrs})
+
+@contextmanager
+def trace(name, **attrs):
+    """開一條新的 trace (每個 LINE 事件一條)；attrs 例如 webhook 批次的 trace id"""
+    if not ENABLED:
+        yield None
+        return
+    trace_token = TRACE_ID.set(new_id())
+    span_token = SPAN_ID.set(None)
+    try:
+        with span(name, **attrs):
+            yield TRACE_ID.get()
+    finally:
+        SPAN_ID.reset(span_token)
+        TRACE_ID.reset(trace_token)
+
+def traced(name):
+    """函式層級的 span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED or TRACE_ID.get() is None: return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def per_event(name):
+    """每次呼叫開一條新的 trace (LINE 事件處理函式用)，並記下所屬 webhook 請求的 trace id"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(event, *args, **kwargs):
+            if not ENABLED: return func(event, *args, **kwargs)
+            with trace(name, webhook=TRACE_ID.get(), event_type=getattr(event, 'type', None)):
+                return func(event, *args, **kwargs)
+        return wrapper
+    return decorator
+
+class TracedExecutor(concurrent.futures.ThreadPoolExecutor):
+    """送出的工作在「送出當下」的 context 中執行 (trace id / 父 span / 效能分析請求都會跟著走)
+    map() 內部也是呼叫 submit，一併適用"""
+    def submit(self, fn, *args, **kwargs):
+        ctx = contextvars.copy_context()
+        return super().submit(ctx.run, fn, *args, **kwargs)
+
+def _traced_request(session, method, url, **kwargs):
+    if not ENABLED or TRACE_ID.get() is None:
+        return _ORIGINAL_REQUEST(session, method, url, **kwargs)
+    parts = urlsplit(url)
+    with span("http", method=method.upper(), host=parts.netloc, path=parts.path) as attrs:
+        response = _ORIGINAL_REQUEST(session, method, url, **kwargs)
+        attrs['status'] = response.status_code
+        attrs['bytes'] = len(response.content) if not kwargs.get('stream') else None
+        return response
+
+class _TraceStdout:
+    """print 輸出在每行開頭加上 [trace id] 前綴 (不在 trace 內的輸出維持原樣)"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()   # 各執行緒目前是否位於行首 (print 的多個參數會分次寫入)
+
+    def write(self, s):
+        trace_id = TRACE_ID.get()
+        at_line_start = getattr(self.local, 'at_line_start', True)
+        if not s: return self.stream.write(s)
+        if trace_id:
+            prefix = f"[{trace_id[:8]}] "
+            out = []
+            for line in s.splitlines(keepends=True):
+                if at_line_start: out.append(prefix)
+                out.append(line)
+                at_line_start = line.endswith("\n")
+            s = "".join(out)
+        else:
+            at_line_start = s.endswith("\n")
+        self.local.at_line_start = at_line_start
+        return self.stream.write(s)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def install():
+    """攔截 requests 與 stdout；在 http_archive 之後安裝也能正確串接 (包住當下的 Session.request)"""
+    global _ORIGINAL_REQUEST, _INSTALLED
+    if _INSTALLED: return
+    _ORIGINAL_REQUEST = requests.Session.request
+    requests.Session.request = _traced_request
+    sys.stdout = _TraceStdout(sys.stdout)
+    _INSTALLED = True
+
+def set_enabled(flag):
+    global ENABLED
+    ENABLED = bool(flag)
+    if ENABLED: install()
+    return ENABLED
+
+if ENABLED: install()
@@ -0,0 +1,143 @@
+import requests
+import json
+import os
+import threading
+from datetime import datetime, date, timedelta, time as dtime, timezone
+
+# ========================================================
+# 📅 台股交易日曆 (依證交所公告的休市日建立，本地快取)
+# 取代「往回一天一天試打 API」的做法：
+#   last_trading_day / trading_days_ago / is_market_open 皆為 O(1) 查表
+# generator 與 app 共用，generator 每日更新 trading_calendar.json 並隨 repo 發布
+# (repo 內附已公告年份的休市日，bot 啟動後不必在請求中下載公告)
+# ========================================================
+
+CALENDAR_PATH = os.environ.get('TRADING_CALENDAR_PATH', 'trading_calendar.json')
+MARKET_OPEN = dtime(9, 0)
+MARKET_CLOSE = dtime(13, 30)
+
+HOLIDAYS = {}       # 年 -> 休市日字串集合 'YYYY-MM-DD' (不含週末)
+TRADING_DAYS = []   # 已載入年份內所有交易日 (舊到新)
+DAY_INDEX = {}      # 任一日期 -> 「當日或之前最近交易日」在 TRADING_DAYS 的索引
+FALLBACK_YEARS = set()  # 公告抓取失敗、暫以「只排除週末」代替的年份 (不存檔，下次再試)
+CALENDAR_LOCK = threading.Lock()
+
+def tw_now():
+    return datetime.now(timezone.utc) + timedelta(hours=8)
+
+def _to_date(d):
+    if d is None: return tw_now().date()
+    return d.date() if isinstance(d, datetime) else d
+
+def fetch_holidays(year):
+    """下載證交所休市日公告；「開始交易」、「最後交易」等說明的日子仍有交易，不算休市"""
+    url = f"https://www.twse.com.tw/rwd/zh/holidaySchedule/holidaySchedule?response=json&queryYear={year - 1911}"
+    data = requests.get(url, timeout=10).json()
+    if data.get('stat') != 'OK': return None
+    holidays = set()
+    for row in data.get('data', []):
+        day, name = str(row[0]).strip(), " ".join(str(x) for x in row[1:])
+        if '開始交易' in name or '最後交易' in name: continue
+        try:
+            if datetime.strptime(day, '%Y-%m-%d').weekday() < 5: holidays.add(day)
+        except ValueError:
+            continue
+    return holidays
+
+def _save():
+    try:
+        with open(CALENDAR_PATH, 'w', encoding='utf-8') as f:
+            json.dump({str(y): sorted(days) for y, days in sorted(HOLIDAYS.items()) if y not in FALLBACK_YEARS}, f, ensure_ascii=False, indent=1)
+    except OSError as e:
+        print(f"[Warn] 交易日曆存檔失敗: {e}")
+
+def _rebuild():
+    global TRADING_DAYS, DAY_INDEX
+    if not HOLIDAYS: return
+    start = date(min(HOLIDAYS), 1, 1); end = date(max(HOLIDAYS), 12, 31)
+    trading_days = []; day_index = {}
+    d = start
+    while d <= end:
+        if d.weekday() < 5 and d.isoformat() not in HOLIDAYS.get(d.year, ()):   # 防呆：中間缺年份時不致崩潰
+            trading_days.append(d)
+        day_index[d] = len(trading_days) - 1  # 年初第一個交易日之前為 -1
+        d += timedelta(days=1)
+    TRADING_DAYS, DAY_INDEX = trading_days, day_index
+
+def load_calendar(years=None, refresh=False):
+    """確保指定年份 (預設去年與今年) 已載入；優先讀本地檔，缺年份才上網抓"""
+    if years is None:
+        this_year = tw_now().year
+        years = [this_year - 1, this_year]
+    with CALENDAR_LOCK:
+        if not HOLIDAYS and os.path.exists(CALENDAR_PATH):
+            try:
+                with open(CALENDAR_PATH, 'r', encoding='utf-8') as f:
+                    HOLIDAYS.update({int(y): set(days) for y, days in json.load(f).items()})
+            except Exception as e:
+                print(f"[Warn] 讀取交易日曆失敗: {e}")
+
+        missing = [y for y in years if refresh or y not in HOLIDAYS or y in FALLBACK_YEARS]
+        fetched = False
+        for y in missing:
+            try:
+                holidays = fetch_holidays(y)
+            except Exception as e:
+                print(f"[Warn] 下載 {y} 休市日失敗: {e}")
+                holidays = None
+            if holidays:
+                HOLIDAYS[y] = holidays
+                FALLBACK_YEARS.discard(y)
+                fetched = True
+            elif y not in HOLIDAYS or y in FALLBACK_YEARS:
+                # 抓不到公告 (或尚未公告) 時只排除週末，確保查詢仍可運作
+                HOLIDAYS[y] = set()
+                FALLBACK_YEARS.add(y)
+        if fetched or not os.path.exists(CALENDAR_PATH): _save()   # 抓取失敗也先寫出檔案 (暫代的年份不存)，讓 Action 的 git add 不會因檔案不存在而中斷
+        if missing or not DAY_INDEX: _rebuild()
+
+def _index_of(d):
+    d = _to_date(d)
+    if d not in DAY_INDEX:
+        # 連同查詢日與已載入範圍之間的年份一併載入，已載入的年份必須連續 (否則中間的年份會缺休市日)
+        years = {d.year - 1, d.year}
+        if HOLIDAYS:
+            years.update(range(min(d.year - 1, min(HOLIDAYS)), max(d.year, max(HOLIDAYS)) + 1))
+        load_calendar(years=sorted(years))
+    return DAY_INDEX.get(d, -1)
+
+def is_trading_day(d=None):
+    d = _to_date(d)
+    idx = _index_of(d)
+    return idx >= 0 and TRADING_DAYS[idx] == d
+
+def last_trading_day(d=None):
+    """當日 (若為交易日) 或之前最近的交易日"""
+    idx = _index_of(d)
+    return TRADING_DAYS[idx] if idx >= 0 else None
+
+def trading_days_ago(n, d=None):
+    """自 last_trading_day(d) 起往前第 n 個交易日 (n=0 即 last_trading_day)"""
+    idx = _index_of(d)
+    if idx - n < 0:
+        # 跨越已載入範圍的年初，補載前一年
+        d0 = TRADING_DAYS[0] if TRADING_DAYS else _to_date(d)
+        load_calendar(years=[d0.year - 1])
+        idx = _index_of(d)
+    return TRADING_DAYS[idx - n] if idx - n >= 0 else None
+
+def recent_trading_days(n, d=None):
+    """最近 n 個交易日 (新到舊)"""
+    return [day for day in (trading_days_ago(i, d) for i in range(n)) if day]
+
+def is_market_open(now=None):
+    now = now or tw_now()
+    return is_trading_day(now) and MARKET_OPEN <= now.time() <= MARKET_CLOSE
+
+def latest_close_date(now=None, ready_time=dtime(14, 0)):
+    """最新「已收盤且盤後資料可取得」的交易日：今天 14:00 前取前一交易日"""
+    now = now or tw_now()
+    today = now.date()
+    if is_trading_day(today) and now.time() >= ready_time:
+        return today
+    return trading_days_ago(1, today) if is_trading_day(today) else last_trading_day(today)